@@ -0,0 +1,150 @@
+import frappe
+import numpy as np
+from frappe.utils import add_days, flt, getdate
+
+from erplex_rental.rental_ledger import get_on_rent_balances
+
+DAYS_PER_MONTH = 30
+# keep IN (...) lists to a sane size when accruing thousands of order lines
+QUERY_CHUNK_SIZE = 1000
+
+
+def get_per_day_rate(rate):
+    """Per-day hire rate of a monthly Sales Order Item rate, rounded like the invoice rate"""
+    return flt(flt(rate) / DAYS_PER_MONTH, 2)
+
+
+def to_days(dates):
+    return np.fromiter((getdate(d).toordinal() for d in dates), dtype=np.int64)
+
+
+def compute_qty_days(line_starts, line_ends, event_lines, event_days, event_qty):
+    """Qty-days on rent per line for the period [start, end) of each line
+
+    Every event keeps its signed qty on rent from the later of its own day and the line's start
+    until the line's end, so events before the start make up the opening qty and a return simply
+    stops accruing the days after it. All arrays are indexed by line / event and evaluated in one pass.
+    """
+    qty_days = np.zeros(len(line_starts))
+    if not len(event_lines):
+        return qty_days
+    from_days = np.maximum(event_days, line_starts[event_lines])
+    days = np.clip(line_ends[event_lines] - from_days, 0, None)
+    qty_days += np.bincount(event_lines, weights=event_qty * days, minlength=len(line_starts))
+    return qty_days
+
+
+def get_ledger_events(lines, end_date):
+    """On-rent events of order lines up to the end date, in posting order
+
+    The qty on rent at each line's `start_date` comes from the monthly snapshots as one "Opening" event
+    dated the day before, followed by the ledger movements of the period, so no line rescans its history.
+    """
+    by_start = {}
+    for line in lines:
+        by_start.setdefault(getdate(line.start_date), []).append(line)
+    events = []
+    for start_date, group in by_start.items():
+        for start in range(0, len(group), QUERY_CHUNK_SIZE):
+            chunk = group[start : start + QUERY_CHUNK_SIZE]
+            so_details = {line.so_detail for line in chunk}
+            balances = get_on_rent_balances({line.sales_order for line in chunk}, start_date)
+            events += [
+                frappe._dict(so_detail=so_detail, name="Opening", posting_date=add_days(start_date, -1), qty=qty)
+                for so_detail, qty in balances.items()
+                if so_detail in so_details and flt(qty)
+            ]
+            events += frappe.db.sql(
+                """Select so_detail, voucher_no as name, posting_date, qty from `tabRental Ledger Entry`
+            where is_cancelled = 0 and so_detail in %(so_details)s
+            and posting_date >= %(start_date)s and posting_date < %(end_date)s
+            order by posting_date, posting_time, creation""",
+                {"so_details": tuple(so_details), "start_date": start_date, "end_date": end_date},
+                as_dict=True,
+            )
+    return events
+
+
+def accrue_rental_lines(lines, end_date):
+    """Qty-days and closing on-rent qty of order lines, from each line's `start_date` up to the end date
+
+    `lines` are rows with a `sales_order`, `so_detail` and `start_date`; returns
+    {so_detail: {qty_days, closing_qty, days}}.
+    """
+    if not lines:
+        return {}
+    end_date = getdate(end_date)
+    positions = {line.so_detail: idx for idx, line in enumerate(lines)}
+    line_starts = to_days(line.start_date for line in lines)
+    line_ends = np.full(len(lines), end_date.toordinal(), dtype=np.int64)
+
+    events = get_ledger_events(lines, end_date)
+    event_lines = np.fromiter((positions[event.so_detail] for event in events), dtype=np.int64)
+    event_days = to_days(event.posting_date for event in events)
+    event_qty = np.fromiter((flt(event.qty) for event in events), dtype=np.float64)
+
+    qty_days = compute_qty_days(line_starts, line_ends, event_lines, event_days, event_qty)
+    closing_qty = np.bincount(event_lines, weights=event_qty, minlength=len(lines)) if len(events) else np.zeros(len(lines))
+    return {
+        line.so_detail: frappe._dict(
+            qty_days=flt(qty_days[idx]),
+            closing_qty=flt(closing_qty[idx]),
+            days=int(max(line_ends[idx] - line_starts[idx], 0)),
+        )
+        for idx, line in enumerate(lines)
+    }
+
+
+def build_rental_statement(events, from_date, to_date, per_day_rate):
+    """Opening and per-event rows of one Sales Order Item for the period [from_date, to_date)
+
+    The rows are priced with the same per-day rate and day counts as billing, and the total comes from
+    the same kernel, so a statement always adds up to the invoiced amount.
+    """
+    from_date, to_date = getdate(from_date), getdate(to_date)
+    days = max((to_date - from_date).days, 0)
+    opening = frappe._dict(name="Opening", posting_date=from_date, qty=0, days=days)
+    rows = []
+    for event in events:
+        event.posting_date = getdate(event.posting_date)
+        event.qty = flt(event.qty)
+        if event.posting_date < from_date:
+            opening.qty += event.qty
+            continue
+        event.days = (to_date - event.posting_date).days
+        event.amount = flt(per_day_rate * event.qty * event.days, 2)
+        rows.append(event)
+    opening.amount = flt(per_day_rate * opening.qty * days, 2)
+
+    qty_days = compute_qty_days(
+        to_days([from_date]),
+        to_days([to_date]),
+        np.zeros(len(events), dtype=np.int64),
+        to_days(event.posting_date for event in events),
+        np.fromiter((event.qty for event in events), dtype=np.float64),
+    )[0]
+    return frappe._dict(
+        per_day_rate=per_day_rate,
+        opening=opening,
+        rows=rows,
+        qty_days=flt(qty_days),
+        total_qty=flt(sum(event.qty for event in events)),
+        total_amount=flt(per_day_rate * qty_days, 2),
+    )
+
+
+def get_rental_statements(lines, end_date):
+    """Statements of order lines from each line's `start_date` up to the end date, as {so_detail: statement}
+
+    `lines` are invoice lines with a `sales_order`, `so_detail`, `start_date` and the per-day `rate`.
+    """
+    if not lines:
+        return {}
+    end_date = getdate(end_date)
+    events = {}
+    for event in get_ledger_events(lines, end_date):
+        events.setdefault(event.so_detail, []).append(event)
+    return {
+        line.so_detail: build_rental_statement(events.get(line.so_detail, []), line.start_date, end_date, line.rate)
+        for line in lines
+    }
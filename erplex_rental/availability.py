@@ -0,0 +1,167 @@
+import frappe
+import numpy as np
+from frappe.utils import add_months, cint, flt, getdate, today
+
+from erplex_rental.erplex_rental.doctype.rental_settings.rental_settings import get_defaults
+
+
+class AvailabilityIndex:
+    """Future shelf qty of one item in the rental source warehouse, as a prefix sum over dated changes
+
+    Rented stock comes back to the shelf at the end of its rental period, and undelivered rental
+    order rows take from it from their delivery date until the end of theirs. Changes dated in the
+    past count from today; stock that is overdue from rent is not expected back. The lowest level
+    over a period is one binary search and one slice minimum.
+    """
+
+    def __init__(self, in_stock=0, on_rent=0, event_days=(), event_qty=()):
+        self.in_stock = flt(in_stock)
+        self.on_rent = flt(on_rent)
+        self.event_days = np.asarray(event_days, dtype=np.int64)
+        self.event_qty = np.asarray(event_qty, dtype=float)
+        self.incoming = flt(self.event_qty[self.event_qty > 0].sum())
+        self.reserved = flt(-self.event_qty[self.event_qty < 0].sum())
+        order = np.argsort(self.event_days, kind="stable")
+        days, starts = np.unique(self.event_days[order], return_index=True)
+        self.days = days
+        self.levels = self.in_stock + np.cumsum(
+            np.add.reduceat(self.event_qty[order], starts) if len(days) else np.zeros(0)
+        )
+
+    def with_bookings(self, bookings):
+        """Index with extra (from_date, to_date, qty) rows off the shelf from from_date and back on to_date"""
+        from_days = [max(getdate(from_date), getdate(today())).toordinal() for from_date, _, _ in bookings]
+        to_days = [getdate(to_date).toordinal() for _, to_date, _ in bookings]
+        booked = np.asarray([flt(qty) for _, _, qty in bookings], dtype=float)
+        return AvailabilityIndex(
+            self.in_stock,
+            self.on_rent,
+            np.concatenate([self.event_days, np.asarray(from_days + to_days, dtype=np.int64)]),
+            np.concatenate([self.event_qty, -booked, booked]),
+        )
+
+    def available(self, from_date=None, to_date=None):
+        """Lowest shelf qty from the date on, until to_date (inclusive) or for good when not given"""
+        from_day = max(getdate(from_date or today()), getdate(today())).toordinal()
+        start = np.searchsorted(self.days, from_day, side="right")
+        level = self.levels[start - 1] if start else self.in_stock
+        end = np.searchsorted(self.days, getdate(to_date).toordinal(), side="right") if to_date else len(self.days)
+        if end > start:
+            level = min(level, self.levels[start:end].min())
+        return flt(level)
+
+
+def get_rental_period():
+    """Months a rental is expected to last, from Rental Settings"""
+    return cint(frappe.db.get_single_value("Rental Settings", "default_rental_period")) or 1
+
+
+def get_booking_end(from_date, rental_period):
+    """Day booked stock is back on the shelf, a rental period after it goes out (today at the earliest)"""
+    return add_months(max(getdate(from_date), getdate(today())), rental_period)
+
+
+def get_availability_index(company, item_codes, exclude_sales_order=None):
+    """{item_code: AvailabilityIndex} of the items in the company's rental source warehouse
+
+    Built from grouped queries over the given items only: stock, pending Rental Delivery rows and
+    the days they are due back, and the undelivered rows of submitted rental Sales Orders. Submitted
+    Hired Items are already in the stock qty, drafts are not counted.
+    """
+    item_codes = tuple({item_code for item_code in item_codes if item_code})
+    if not item_codes:
+        return {}
+    warehouse = get_defaults(company).source_warehouse
+    params = {
+        "company": company,
+        "warehouse": warehouse,
+        "item_codes": item_codes,
+        "exclude_sales_order": exclude_sales_order or "",
+        "today": getdate(today()),
+        "rental_period": get_rental_period(),
+    }
+    in_stock = dict(
+        frappe.db.sql(
+            """Select item_code, SUM(actual_qty) from `tabBin`
+        where warehouse = %(warehouse)s and item_code in %(item_codes)s group by item_code""",
+            params,
+        )
+    )
+    on_rent = dict(
+        frappe.db.sql(
+            """Select rdi.item_code, SUM(rdi.pending_qty) from `tabRental Delivery` rd
+        inner join `tabRental Delivery Item` rdi on rdi.parent = rd.name
+        where rd.docstatus = 1 and rd.company = %(company)s and rdi.item_code in %(item_codes)s
+        group by rdi.item_code""",
+            params,
+        )
+    )
+    booking_start = "GREATEST(ifnull(soi.delivery_date, so.delivery_date), %(today)s)"
+    undelivered_rows = """from `tabSales Order` so inner join `tabSales Order Item` soi on soi.parent = so.name
+    where so.docstatus = 1 and so.order_type = 'Rental' and so.company = %(company)s
+    and so.status not in ('Completed', 'Closed') and so.name != %(exclude_sales_order)s
+    and soi.item_code in %(item_codes)s and soi.qty > soi.custom_rental_delivered_qty
+    group by soi.item_code, date"""
+    events = {}
+    for item_code, date, qty in frappe.db.sql(
+        f"""Select rdi.item_code, DATE_ADD(rd.posting_date, INTERVAL %(rental_period)s MONTH) as date,
+        SUM(rdi.pending_qty)
+    from `tabRental Delivery` rd inner join `tabRental Delivery Item` rdi on rdi.parent = rd.name
+    where rd.docstatus = 1 and rd.company = %(company)s and rdi.item_code in %(item_codes)s
+    and rdi.pending_qty > 0 and DATE_ADD(rd.posting_date, INTERVAL %(rental_period)s MONTH) >= %(today)s
+    group by rdi.item_code, date
+    union all
+    Select soi.item_code, {booking_start} as date, -SUM(soi.qty - soi.custom_rental_delivered_qty)
+    {undelivered_rows}
+    union all
+    Select soi.item_code, DATE_ADD({booking_start}, INTERVAL %(rental_period)s MONTH) as date,
+        SUM(soi.qty - soi.custom_rental_delivered_qty)
+    {undelivered_rows}""",
+        params,
+    ):
+        item_events = events.setdefault(item_code, ([], []))
+        item_events[0].append(getdate(date).toordinal())
+        item_events[1].append(flt(qty))
+    return {
+        item_code: AvailabilityIndex(in_stock.get(item_code), on_rent.get(item_code), *events.get(item_code, ((), ())))
+        for item_code in item_codes
+    }
+
+
+@frappe.whitelist()
+def get_rental_availability(company, item_codes, from_date=None, to_date=None, exclude_sales_order=None):
+    """Available qty of each item from from_date to to_date, with the figures it is made of"""
+    frappe.has_permission("Sales Order", "read", throw=True)
+    index = get_availability_index(company, frappe.parse_json(item_codes), exclude_sales_order)
+    return {
+        item_code: {
+            "in_stock": item.in_stock,
+            "on_rent": item.on_rent,
+            "incoming": item.incoming,
+            "reserved": item.reserved,
+            "available": item.available(from_date, to_date),
+        }
+        for item_code, item in index.items()
+    }
+
+
+def validate_availability(so):
+    """Stop a rental Sales Order whose undelivered rows would take an item's shelf qty below zero"""
+    rental_period = get_rental_period()
+    bookings = {}
+    for row in so.items:
+        qty = flt(row.qty) - flt(row.get("custom_rental_delivered_qty"))
+        if row.item_code and qty > 0:
+            from_date = row.delivery_date or so.delivery_date or so.transaction_date
+            bookings.setdefault(row.item_code, []).append(
+                (from_date, get_booking_end(from_date, rental_period), qty)
+            )
+    index = get_availability_index(so.company, bookings, so.name)
+    shortages = []
+    for item_code, item_bookings in bookings.items():
+        first_date = min(getdate(from_date) for from_date, _, _ in item_bookings)
+        available = index[item_code].with_bookings(item_bookings).available(first_date)
+        if available < 0:
+            shortages.append(f"{item_code}: short by {flt(-available)} from {first_date}")
+    if shortages:
+        frappe.throw("Not enough rental stock for this order:<br>" + "<br>".join(shortages))
@@ -0,0 +1,719 @@
+import time
+from contextlib import contextmanager
+
+import frappe
+from erpnext.selling.doctype.sales_order.sales_order import make_sales_invoice
+from frappe.utils import cint, flt, getdate, now_datetime
+
+from erplex_rental.accrual import accrue_rental_lines, get_per_day_rate, get_rental_statements
+from erplex_rental.billing_queue import get_due_orders, settle_billing_queue
+from erplex_rental.daily_accrual import (
+    get_accrued_invoice_lines,
+    is_daily_accrual_enabled,
+    mark_accruals_invoiced,
+)
+
+# keep IN (...) lists to a sane size on sites with thousands of open orders
+QUERY_CHUNK_SIZE = 1000
+BILLING_SHARD_SIZE = 250
+BILLING_BATCH_SIZE = 50
+BILLING_JOB_TIMEOUT = 3600
+BILLING_SAVEPOINT = "rental_billing_order"
+
+
+class BillingStats:
+    """Query count and timings of one billing run, logged when the run finishes"""
+
+    def __init__(self, label):
+        self.label = label
+        self.orders = 0
+        self.lines = 0
+        self.invoices = 0
+        self.skipped = 0
+        self.failed = 0
+        self.queries = 0
+        self.phases = {}
+        self.started = None
+        self.seconds = 0
+
+    @contextmanager
+    def track(self):
+        original_sql = frappe.db.sql
+
+        def counted_sql(*args, **kwargs):
+            self.queries += 1
+            return original_sql(*args, **kwargs)
+
+        frappe.db.sql = counted_sql
+        self.started = time.monotonic()
+        try:
+            yield self
+        finally:
+            frappe.db.sql = original_sql
+            self.seconds = round(time.monotonic() - self.started, 3)
+            frappe.logger("erplex_rental.billing").info(self.summary())
+
+    @contextmanager
+    def phase(self, name):
+        queries, started = self.queries, time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = {
+                "queries": self.queries - queries,
+                "seconds": round(time.monotonic() - started, 3),
+            }
+
+    def summary(self):
+        return {
+            "run": self.label,
+            "orders": self.orders,
+            "lines": self.lines,
+            "invoices": self.invoices,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "queries": self.queries,
+            "queries_per_order": flt(self.queries / self.orders, 2) if self.orders else 0,
+            "seconds": self.seconds,
+            "phases": self.phases,
+        }
+
+
+def chunked(values, size=QUERY_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def get_open_rental_order_items(orders=None):
+    """Every Sales Order Item of the rental orders that still have qty on rent"""
+    if orders is not None and not orders:
+        return []
+    conds = ""
+    if orders:
+        conds += " and so.name in %(orders)s "
+    return (
+        frappe.db.sql(
+            f"""Select so.name as sales_order, so.transaction_date, so.custom_last_billed_date,
+        soi.name as so_detail, soi.item_code, soi.rate,
+        soi.custom_rental_delivered_qty, soi.custom_rental_returned_qty
+    from `tabSales Order` so inner join `tabSales Order Item` soi on so.name = soi.parent
+    where so.order_type = 'Rental' and so.docstatus = 1 and so.status not in ('Completed', 'Cancelled')
+    and exists (Select 1 from `tabSales Order Item` open_soi where open_soi.parent = so.name
+        and open_soi.custom_rental_returned_qty < open_soi.custom_rental_delivered_qty) {conds}
+    order by so.name, soi.idx""",
+            {"orders": tuple(orders or ())},
+            as_dict=True,
+        )
+        or []
+    )
+
+
+def get_completed_rental_orders(order=None, orders=None):
+    if orders is not None and not orders:
+        return []
+    conds = ""
+    if order:
+        conds += " and so.name = %(order)s "
+    if orders:
+        conds += " and so.name in %(orders)s "
+    return (
+        frappe.db.sql(
+            f"""Select so.name as sales_order, so.transaction_date, so.custom_last_billed_date
+    from `tabSales Order` so
+    where so.order_type = 'Rental' and so.docstatus = 1 and so.status = 'Completed' {conds}
+    and exists (Select 1 from `tabSales Order Item` soi where soi.parent = so.name
+        and soi.custom_rental_returned_qty = soi.custom_rental_delivered_qty)""",
+            {"order": order, "orders": tuple(orders or ())},
+            as_dict=True,
+        )
+        or []
+    )
+
+
+def get_last_rental_returns(orders):
+    """Latest submitted Rental Return of each Sales Order, as {sales_order: row}"""
+    last_returns = {}
+    for names in chunked(set(orders)):
+        data = frappe.db.sql(
+            """Select sales_order, name, posting_date, return_date from (
+        Select rri.sales_order, rr.name, rr.posting_date, rr.return_date,
+        ROW_NUMBER() OVER (PARTITION BY rri.sales_order
+            ORDER BY rr.posting_date DESC, rr.posting_time DESC, rr.creation DESC) as row_no
+        from `tabRental Return` rr inner join `tabRental Return Item` rri on rr.name = rri.parent
+        where rr.docstatus = 1 and rri.sales_order in %(orders)s
+    ) last_return where row_no = 1""",
+            {"orders": tuple(names)},
+            as_dict=True,
+        )
+        last_returns.update({row.sales_order: row for row in data})
+    return last_returns
+
+
+def get_rental_order_items(orders):
+    data = []
+    for names in chunked(set(orders)):
+        data += (
+            frappe.db.sql(
+                """Select so.name as sales_order, so.transaction_date, so.custom_last_billed_date,
+            soi.name as so_detail, soi.item_code, soi.rate
+        from `tabSales Order` so inner join `tabSales Order Item` soi on so.name = soi.parent
+        where so.name in %(orders)s order by so.name, soi.idx""",
+                {"orders": tuple(names)},
+                as_dict=True,
+            )
+            or []
+        )
+    return data
+
+
+def get_billing_start_date(order):
+    return order.custom_last_billed_date or order.transaction_date
+
+
+def compute_invoice_lines(order_items, billing_date=None):
+    """Invoice lines per Sales Order, as {sales_order: [lines]}
+
+    Each Sales Order Item is charged its actual qty-days on rent between the order's last billed date
+    (or order date) and the billing date, as accrued from the Rental Ledger. Lines carry the qty-days
+    as qty and the per-day rate as rate, so the invoice adds up to the printed rental statement.
+    With daily accrual enabled the qty-days are summed from the Rental Accrual rows instead.
+    """
+    billing_date = getdate(billing_date)
+    if is_daily_accrual_enabled():
+        return get_accrued_invoice_lines(order_items, billing_date)
+    for soi in order_items:
+        soi.start_date = get_billing_start_date(soi)
+    accruals = accrue_rental_lines(order_items, billing_date)
+    invoice_lines = {}
+    for soi in order_items:
+        lines = invoice_lines.setdefault(soi.sales_order, [])
+        accrual = accruals[soi.so_detail]
+        if accrual.days <= 0 or flt(accrual.qty_days) <= 0:
+            continue
+        lines.append(
+            frappe._dict(
+                {
+                    "item_code": soi.item_code,
+                    "qty": accrual.qty_days,
+                    "rate": get_per_day_rate(soi.rate),
+                    "sales_order": soi.sales_order,
+                    "so_detail": soi.so_detail,
+                    "start_date": soi.start_date,
+                }
+            )
+        )
+    return invoice_lines
+
+
+def make_rental_invoice(sales_order, lines, billing_date=None):
+    si_doc = make_sales_invoice(sales_order)
+    si_doc.update_stock = 0
+    si_doc.set_posting_time = 1
+    si_doc.posting_date = getdate(billing_date)
+    si_doc.custom_rental_period_from = min(line.start_date for line in lines)
+    si_doc.custom_rental_period_to = si_doc.posting_date
+    si_doc.items = []
+    for line in lines:
+        si_doc.append(
+            "items",
+            {
+                "item_code": line.item_code,
+                "qty": line.qty,
+                "rate": line.rate,
+                "sales_order": line.sales_order,
+                "so_detail": line.so_detail,
+            },
+        )
+    si_doc.flags.ignore_permissions = True
+    si_doc.run_method("set_missing_values")
+    si_doc.run_method("calculate_taxes_and_totals")
+    set_rental_statement(si_doc, lines, billing_date)
+    si_doc.save()
+    return si_doc
+
+
+def set_rental_statement(si_doc, lines, billing_date=None):
+    """Store the opening, movement and total rows behind every invoice line, as printed on the Rental Invoice"""
+    statements = get_rental_statements(lines, getdate(billing_date))
+    descriptions = {row.so_detail: row.description for row in si_doc.items}
+    si_doc.custom_rental_statement = []
+    for line in lines:
+        statement = statements[line.so_detail]
+        row = {"item_code": line.item_code, "so_detail": line.so_detail}
+        si_doc.append(
+            "custom_rental_statement",
+            {
+                **row,
+                "row_type": "Opening",
+                "description": descriptions.get(line.so_detail),
+                "reference": statement.opening.name,
+                "posting_date": statement.opening.posting_date,
+                "qty": statement.opening.qty,
+                "per_day_rate": statement.per_day_rate,
+                "days": statement.opening.days,
+                "amount": statement.opening.amount,
+            },
+        )
+        for event in statement.rows:
+            si_doc.append(
+                "custom_rental_statement",
+                {
+                    **row,
+                    "row_type": "Movement",
+                    "reference": event.name,
+                    "posting_date": event.posting_date,
+                    "qty": event.qty,
+                    "per_day_rate": statement.per_day_rate,
+                    "days": event.days,
+                    "amount": event.amount,
+                },
+            )
+        si_doc.append(
+            "custom_rental_statement",
+            {**row, "row_type": "Total", "qty": statement.total_qty, "amount": statement.total_amount},
+        )
+
+
+def claim_rental_order(sales_order, billing_date=None):
+    """Lock the Sales Order row and check nobody billed it for this period yet
+
+    The lock is held until the caller commits, so a second worker (or an overlapping shard)
+    waits for the first one and then finds its invoice.
+    """
+    frappe.db.get_value("Sales Order", sales_order, "name", for_update=True)
+    return not frappe.db.sql(
+        """Select si.name
+    from `tabSales Invoice` si inner join `tabSales Invoice Item` sii on si.name = sii.parent
+    where si.docstatus < 2 and sii.sales_order = %(sales_order)s and si.posting_date >= %(billing_date)s
+    limit 1""",
+        {"sales_order": sales_order, "billing_date": getdate(billing_date)},
+    )
+
+
+def get_consolidation_keys(orders):
+    """Invoice each Sales Order goes on when consolidating, as {sales_order: key}
+
+    Orders share an invoice when they have the same company, customer, currency and project, the
+    fields a Sales Invoice must agree on with every Sales Order it bills.
+    """
+    keys = {}
+    for names in chunked(set(orders)):
+        for row in frappe.get_all(
+            "Sales Order",
+            filters={"name": ["in", names]},
+            fields=["name", "company", "customer", "currency", "project"],
+        ):
+            keys[row.name] = (row.company, row.customer, row.currency, row.project or "")
+    return keys
+
+
+def group_invoice_lines(invoice_lines, consolidate=False):
+    """Invoices to make, as [(sales_orders, lines)]: one per Sales Order, or one per customer and project"""
+    if not consolidate:
+        return [([sales_order], lines) for sales_order, lines in invoice_lines.items()]
+    keys = get_consolidation_keys(invoice_lines)
+    groups = {}
+    for sales_order, lines in invoice_lines.items():
+        orders, group_lines = groups.setdefault(keys[sales_order], ([], []))
+        orders.append(sales_order)
+        group_lines.extend(lines)
+    return list(groups.values())
+
+
+def create_rental_invoices(invoice_lines, stats, billing_date=None, recorder=None):
+    """Build one invoice per Sales Order, or per customer and project with consolidated invoicing
+
+    Without a recorder every invoice is committed on its own and errors propagate. With a recorder
+    each invoice runs under a savepoint, so a failing one is rolled back and its orders logged while
+    the rest of the batch goes on, and commits happen once per batch.
+    """
+    consolidate = get_billing_settings().consolidate
+    for sales_orders, lines in group_invoice_lines(invoice_lines, consolidate):
+        started = time.monotonic()
+        frappe.db.savepoint(BILLING_SAVEPOINT)
+        try:
+            sales_invoice = None
+            billable = {line.sales_order for line in lines}
+            claimed = {sales_order for sales_order in billable if claim_rental_order(sales_order, billing_date)}
+            claimed_lines = [line for line in lines if line.sales_order in claimed]
+            if claimed_lines:
+                sales_invoice = make_rental_invoice(claimed_lines[0].sales_order, claimed_lines, billing_date).name
+                if is_daily_accrual_enabled():
+                    mark_accruals_invoiced(claimed_lines, sales_invoice, billing_date)
+                stats.invoices += 1
+                stats.lines += len(claimed_lines)
+            stats.skipped += len(billable - claimed)
+        except Exception:
+            if not recorder:
+                raise
+            frappe.db.rollback(save_point=BILLING_SAVEPOINT)
+            stats.failed += len(sales_orders)
+            error = frappe.get_traceback()
+            for sales_order in sales_orders:
+                recorder.record(sales_order, "Failed", time.monotonic() - started, error=error)
+            continue
+        if recorder:
+            duration = (time.monotonic() - started) / len(sales_orders)
+            for sales_order in sales_orders:
+                status = "Nothing to Bill"
+                if sales_order in claimed:
+                    status = "Invoiced"
+                elif sales_order in billable:
+                    status = "Skipped"
+                recorder.record(
+                    sales_order, status, duration, sales_invoice if status == "Invoiced" else None
+                )
+        else:
+            frappe.db.commit()
+    if recorder:
+        recorder.flush()
+
+
+def create_ongoing_rental_invoices(orders=None, billing_date=None, recorder=None):
+    """Bill open rental orders from their last billed date up to the billing date"""
+    stats = BillingStats("ongoing")
+    with stats.track():
+        with stats.phase("fetch"):
+            order_items = get_open_rental_order_items(orders)
+            order_names = {row.sales_order for row in order_items}
+        with stats.phase("compute"):
+            invoice_lines = compute_invoice_lines(order_items, billing_date)
+        stats.orders = len(order_names)
+        with stats.phase("invoice"):
+            create_rental_invoices(invoice_lines, stats, billing_date, recorder)
+    return stats.summary()
+
+
+def get_unbilled_completed_orders(order=None, orders=None):
+    """Completed rental orders with a Rental Return after their last billed date"""
+    orders = get_completed_rental_orders(order, orders)
+    last_returns = get_last_rental_returns([row.sales_order for row in orders])
+    unbilled = []
+    for row in orders:
+        last_return = last_returns.get(row.sales_order)
+        if not row.custom_last_billed_date or (
+            last_return and getdate(row.custom_last_billed_date) < getdate(last_return.posting_date)
+        ):
+            unbilled.append(row)
+    return unbilled
+
+
+def create_unbilled_completed_rental_invoices(order=None, billing_date=None, orders=None, recorder=None):
+    """Bill completed rental orders for the period up to their last Rental Return"""
+    stats = BillingStats("completed")
+    with stats.track():
+        with stats.phase("fetch"):
+            orders = get_unbilled_completed_orders(order, orders)
+            order_items = get_rental_order_items(row.sales_order for row in orders)
+        with stats.phase("compute"):
+            invoice_lines = compute_invoice_lines(order_items, billing_date)
+        stats.orders = len(orders)
+        with stats.phase("invoice"):
+            create_rental_invoices(invoice_lines, stats, billing_date, recorder)
+    return stats.summary()
+
+
+def enqueue_completed_rental_invoice(sales_order):
+    """Bill a Sales Order returned in full in its own job, at most one queued job per order"""
+    frappe.enqueue(
+        "erplex_rental.billing.create_unbilled_completed_rental_invoices",
+        queue="long",
+        timeout=BILLING_JOB_TIMEOUT,
+        job_id=f"rental_completed_billing::{sales_order}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        order=sales_order,
+    )
+
+
+def create_due_rental_invoices(orders, billing_date=None, recorder=None):
+    """Bill the open and the completed unbilled orders among the given ones in one pass
+
+    Both kinds are grouped together, so a consolidated invoice also covers a customer's orders
+    that were returned in full during the period.
+    """
+    stats = BillingStats("due")
+    with stats.track():
+        with stats.phase("fetch"):
+            order_items = get_open_rental_order_items(orders)
+            completed = get_unbilled_completed_orders(orders=orders)
+            order_items += get_rental_order_items(row.sales_order for row in completed)
+        with stats.phase("compute"):
+            invoice_lines = compute_invoice_lines(order_items, billing_date)
+        stats.orders = len(invoice_lines)
+        with stats.phase("invoice"):
+            create_rental_invoices(invoice_lines, stats, billing_date, recorder)
+    return stats.summary()
+
+
+class BillingRunRecorder:
+    """Writes per-order outcomes of one shard to its Rental Billing Run
+
+    Outcomes are buffered and written together with a commit every `batch_size` orders, so the
+    invoices of a batch and the checkpoint that marks them done always land in the same transaction.
+    """
+
+    def __init__(self, run, shard, batch_size=BILLING_BATCH_SIZE, retry_failed=False):
+        self.run = run
+        self.shard = shard
+        self.batch_size = cint(batch_size) or BILLING_BATCH_SIZE
+        self.statuses = ("Pending", "Failed") if retry_failed else ("Pending",)
+        self.pending = []
+        self.failed = set()
+
+    def record(self, sales_order, status, duration, sales_invoice=None, error=None):
+        if status == "Failed":
+            self.failed.add(sales_order)
+        self.pending.append(
+            {
+                "run": self.run,
+                "sales_order": sales_order,
+                "status": status,
+                "duration": flt(duration, 3),
+                "sales_invoice": sales_invoice,
+                "error": error,
+            }
+        )
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        for row in self.pending:
+            frappe.db.sql(
+                """Update `tabRental Billing Run Order`
+            set status = %(status)s, duration = %(duration)s, sales_invoice = %(sales_invoice)s, error = %(error)s
+            where parent = %(run)s and sales_order = %(sales_order)s""",
+                row,
+            )
+        statuses = [row["status"] for row in self.pending]
+        frappe.db.sql(
+            """Update `tabRental Billing Run`
+        set checkpoint = checkpoint + %(processed)s, invoiced_orders = invoiced_orders + %(invoiced)s,
+            skipped_orders = skipped_orders + %(skipped)s, failed_orders = failed_orders + %(failed)s
+        where name = %(run)s""",
+            {
+                "run": self.run,
+                "processed": len(statuses),
+                "invoiced": statuses.count("Invoiced"),
+                "skipped": statuses.count("Skipped"),
+                "failed": statuses.count("Failed"),
+            },
+        )
+        self.pending = []
+        frappe.db.commit()
+
+    def pending_orders(self):
+        return frappe.db.sql_list(
+            """Select sales_order from `tabRental Billing Run Order`
+        where parent = %(run)s and shard = %(shard)s and status in %(statuses)s order by idx""",
+            {"run": self.run, "shard": self.shard, "statuses": self.statuses},
+        )
+
+    def close(self):
+        """Orders the engine found nothing to bill for are done as well"""
+        self.flush()
+        for sales_order in self.pending_orders():
+            self.record(sales_order, "Nothing to Bill", 0)
+        self.flush()
+
+    def finish_shard(self, failed=False):
+        """Count the shard as finished and close the run once every shard is"""
+        frappe.db.sql(
+            f"""Update `tabRental Billing Run` set {"shards_failed = shards_failed" if failed else "shards_done = shards_done"} + 1
+        where name = %s""",
+            self.run,
+        )
+        run = frappe.db.get_value(
+            "Rental Billing Run",
+            self.run,
+            ["shards", "shards_done", "shards_failed", "failed_orders"],
+            as_dict=True,
+            for_update=True,
+        )
+        if run.shards_done + run.shards_failed >= run.shards:
+            status = "Completed"
+            if run.shards_failed:
+                status = "Failed"
+            elif run.failed_orders:
+                status = "Partially Failed"
+            frappe.db.set_value(
+                "Rental Billing Run", self.run, {"status": status, "finished_at": now_datetime()}
+            )
+            frappe.logger("erplex_rental.billing").info(
+                {"run": self.run, "status": status, "shards": run.shards}
+            )
+        frappe.db.commit()
+
+
+def get_billing_orders(billing_date=None):
+    """Rental orders due for billing, read from the billing queue instead of scanning every order"""
+    return get_due_orders(billing_date)
+
+
+def split_billing_orders(orders, shard_by="Order Name", shard_size=BILLING_SHARD_SIZE, consolidate=False):
+    """Split Sales Orders into shards of consecutive names, optionally one set of shards per company
+
+    With consolidated invoicing the orders that share an invoice always land in the same shard.
+    """
+    if consolidate:
+        return split_consolidated_orders(orders, shard_by, shard_size)
+    if shard_by != "Company":
+        return list(chunked(sorted(orders), shard_size))
+    companies = {}
+    for names in chunked(orders):
+        for row in frappe.get_all(
+            "Sales Order", filters={"name": ["in", names]}, fields=["name", "company"]
+        ):
+            companies.setdefault(row.company, []).append(row.name)
+    shards = []
+    for company in sorted(companies):
+        shards += chunked(sorted(companies[company]), shard_size)
+    return shards
+
+
+def split_consolidated_orders(orders, shard_by, shard_size):
+    keys = get_consolidation_keys(orders)
+    groups = {}
+    for sales_order in sorted(orders):
+        groups.setdefault(keys[sales_order], []).append(sales_order)
+    shards, shard, company = [], [], None
+    for key in sorted(groups):
+        # a key starts with the company
+        new_company = shard_by == "Company" and key[0] != company
+        if shard and (new_company or len(shard) + len(groups[key]) > shard_size):
+            shards.append(shard)
+            shard = []
+        shard += groups[key]
+        company = key[0]
+    if shard:
+        shards.append(shard)
+    return shards
+
+
+def get_billing_settings():
+    settings = frappe.db.get_value(
+        "Rental Settings",
+        "Rental Settings",
+        ["billing_batch_size", "billing_shard_size", "consolidate_invoices"],
+        as_dict=True,
+    ) or frappe._dict()
+    return frappe._dict(
+        batch_size=cint(settings.billing_batch_size) or BILLING_BATCH_SIZE,
+        shard_size=cint(settings.billing_shard_size) or BILLING_SHARD_SIZE,
+        consolidate=cint(settings.consolidate_invoices),
+    )
+
+
+def enqueue_monthly_rental_billing(shard_by="Order Name", billing_date=None):
+    """Log a Rental Billing Run for the orders due for billing and bill its shards on the long queue"""
+    settings = get_billing_settings()
+    orders = get_billing_orders(billing_date)
+    shards = split_billing_orders(orders, shard_by, settings.shard_size, settings.consolidate)
+    run = frappe.new_doc("Rental Billing Run")
+    run.update(
+        {
+            "billing_date": getdate(billing_date),
+            "status": "Queued",
+            "shard_by": shard_by,
+            "batch_size": settings.batch_size,
+            "started_at": now_datetime(),
+            "total_orders": len(orders),
+            "shards": len(shards),
+        }
+    )
+    for shard, names in enumerate(shards):
+        for sales_order in names:
+            run.append("orders", {"sales_order": sales_order, "shard": shard, "status": "Pending"})
+    run.flags.ignore_permissions = True
+    run.insert()
+    if not shards:
+        run.db_set({"status": "Completed", "finished_at": now_datetime()})
+    frappe.db.commit()
+    enqueue_billing_shards(run.name, range(len(shards)))
+    return run.name
+
+
+def enqueue_billing_shards(run, shards, retry_failed=False):
+    for shard in shards:
+        frappe.enqueue(
+            "erplex_rental.billing.run_billing_shard",
+            queue="long",
+            timeout=BILLING_JOB_TIMEOUT,
+            job_id=f"rental_billing::{run}::{shard}",
+            deduplicate=True,
+            enqueue_after_commit=True,
+            run=run,
+            shard=shard,
+            retry_failed=retry_failed,
+        )
+
+
+def run_billing_shard(run, shard, retry_failed=False):
+    billing_date, batch_size = frappe.db.get_value("Rental Billing Run", run, ["billing_date", "batch_size"])
+    recorder = BillingRunRecorder(run, shard, batch_size, retry_failed)
+    orders = recorder.pending_orders()
+    if retry_failed:
+        # failed orders are counted again once their retry is recorded
+        failed = len(orders) - len(BillingRunRecorder(run, shard).pending_orders())
+        frappe.db.sql(
+            """Update `tabRental Billing Run` set failed_orders = failed_orders - %(failed)s,
+            checkpoint = checkpoint - %(failed)s where name = %(run)s""",
+            {"run": run, "failed": failed},
+        )
+    frappe.db.set_value("Rental Billing Run", run, "status", "Running")
+    frappe.db.commit()
+    try:
+        if orders:
+            create_due_rental_invoices(orders, billing_date, recorder)
+            recorder.close()
+            settle_billing_queue(orders, billing_date, recorder.failed)
+    except Exception:
+        frappe.db.rollback()
+        recorder.finish_shard(failed=True)
+        raise
+    recorder.finish_shard()
+
+
+def resume_billing_run(run, retry_failed=False):
+    """Re-enqueue the shards of a run that still have orders after the checkpoint"""
+    retry_failed = cint(retry_failed)
+    statuses = ("Pending", "Failed") if retry_failed else ("Pending",)
+    shards = frappe.db.sql_list(
+        """Select distinct shard from `tabRental Billing Run Order`
+    where parent = %(run)s and status in %(statuses)s""",
+        {"run": run, "statuses": statuses},
+    )
+    if not shards:
+        frappe.throw("All orders of this Rental Billing Run have been processed")
+    # the resumed run finishes when the re-enqueued shards do
+    frappe.db.sql(
+        """Update `tabRental Billing Run`
+    set status = 'Queued', finished_at = null, shards = %(shards)s, shards_done = 0, shards_failed = 0
+    where name = %(run)s""",
+        {"run": run, "shards": len(shards)},
+    )
+    enqueue_billing_shards(run, shards, retry_failed)
+
+
+@frappe.whitelist()
+def get_billing_run_status(run):
+    frappe.only_for(("Accounts Manager", "System Manager"))
+    return frappe.db.get_value(
+        "Rental Billing Run",
+        run,
+        [
+            "status",
+            "total_orders",
+            "checkpoint",
+            "invoiced_orders",
+            "skipped_orders",
+            "failed_orders",
+            "shards",
+            "shards_done",
+            "shards_failed",
+        ],
+        as_dict=True,
+    )
@@ -0,0 +1,97 @@
+import frappe
+from frappe.utils import add_months, get_first_day, getdate, now_datetime, today
+
+QUEUE_FIELDS = ("name", "sales_order", "reason", "due_date", "creation", "modified", "owner", "modified_by")
+
+
+def queue_rental_billing(sales_orders, reason, due_date=None, advance=True):
+    """Mark rental orders as due for billing, one queue row per order
+
+    A queued order keeps its row; with advance its due date moves to the earlier of the two,
+    without it (a delivery to an order that is already queued) the existing due date stands.
+    """
+    from erplex_rental.billing import chunked
+
+    sales_orders = {sales_order for sales_order in sales_orders if sales_order}
+    if not sales_orders:
+        return
+    timestamp, user = now_datetime(), frappe.session.user
+    due_date = getdate(due_date or today())
+    update = "modified = values(modified)"
+    if advance:
+        update = """reason = if(values(due_date) < due_date, values(reason), reason),
+        due_date = least(due_date, values(due_date)), modified = values(modified)"""
+    for names in chunked(sorted(sales_orders)):
+        values = [(name, name, reason, due_date, timestamp, timestamp, user, user) for name in names]
+        frappe.db.sql(
+            f"""Insert into `tabRental Billing Queue` ({", ".join(f"`{field}`" for field in QUEUE_FIELDS)})
+        values {", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s)"] * len(values))}
+        on duplicate key update {update}""",
+            [value for row in values for value in row],
+        )
+
+
+def get_due_orders(billing_date=None):
+    """Queued rental orders due on or before the billing date"""
+    return frappe.db.sql_list(
+        """Select sales_order from `tabRental Billing Queue` where due_date <= %s order by sales_order""",
+        getdate(billing_date),
+    )
+
+
+def get_orders_on_rent(orders):
+    from erplex_rental.billing import chunked
+
+    on_rent = set()
+    for names in chunked(orders):
+        on_rent.update(
+            frappe.db.sql_list(
+                """Select distinct so.name
+            from `tabSales Order` so inner join `tabSales Order Item` soi on so.name = soi.parent
+            where so.name in %(orders)s and so.docstatus = 1 and so.status not in ('Completed', 'Cancelled')
+            and soi.custom_rental_returned_qty < soi.custom_rental_delivered_qty""",
+                {"orders": tuple(names)},
+            )
+        )
+    return on_rent
+
+
+def settle_billing_queue(orders, billing_date=None, failed=()):
+    """After billing, roll the orders still on rent over to the next period and drop the rest
+
+    Orders whose invoice failed in this run and completed orders that are still unbilled stay due
+    as they are, so a resumed or the next run picks them up again.
+    """
+    from erplex_rental.billing import get_unbilled_completed_orders
+
+    if not orders:
+        return
+    failed = set(failed)
+    on_rent = get_orders_on_rent(orders) - failed
+    unbilled = {row.sales_order for row in get_unbilled_completed_orders(orders=orders)} | failed
+    if on_rent:
+        frappe.db.sql(
+            """Update `tabRental Billing Queue` set reason = 'Period Rollover', due_date = %(due_date)s,
+            modified = %(modified)s
+        where sales_order in %(orders)s""",
+            {
+                "orders": tuple(on_rent),
+                "due_date": get_first_day(add_months(getdate(billing_date), 1)),
+                "modified": now_datetime(),
+            },
+        )
+    billed = set(orders) - on_rent - unbilled
+    if billed:
+        frappe.db.delete("Rental Billing Queue", {"sales_order": ["in", list(billed)]})
+
+
+def rebuild_billing_queue():
+    """Queue every rental order that is on rent or completed and unbilled, by scanning all of them once"""
+    from erplex_rental.utils import (
+        get_ongoing_rental_orders_for_invoicing,
+        get_unbilled_completed_rental_orders,
+    )
+
+    frappe.db.truncate("Rental Billing Queue")
+    queue_rental_billing(get_ongoing_rental_orders_for_invoicing(), "On Rent")
+    queue_rental_billing(get_unbilled_completed_rental_orders(), "Completed")
@@ -0,0 +1,252 @@
+import frappe
+import numpy as np
+from frappe.utils import add_days, add_months, cint, flt, get_first_day, getdate, today
+
+from erplex_rental.accrual import DAYS_PER_MONTH, compute_qty_days, get_per_day_rate, to_days
+from erplex_rental.billing import chunked
+from erplex_rental.rental_ledger import get_on_rent_balances
+
+DAYS_PER_WEEK = 7
+
+
+def get_pricing(days_per_month=None, minimum_days=None, weekly_rate=None):
+    """What-if pricing of a simulation
+
+    `days_per_month` divides the monthly Sales Order rate into the per-day rate, `minimum_days`
+    charges every line at least that many days of its peak qty on rent, and a `weekly_rate` (a
+    fraction of the monthly rate per week, 0 for daily billing) bills qty-days in whole weeks.
+    """
+    return frappe._dict(
+        days_per_month=flt(days_per_month) or DAYS_PER_MONTH,
+        minimum_days=cint(minimum_days),
+        weekly_rate=flt(weekly_rate),
+    )
+
+
+def price_lines(rates, qty_days, peak_qty, pricing):
+    """Current and what-if amount of every line, as two arrays"""
+    current = np.round(np.fromiter((get_per_day_rate(rate) for rate in rates), dtype=np.float64) * qty_days, 2)
+    billable_days = np.maximum(qty_days, pricing.minimum_days * peak_qty)
+    if pricing.weekly_rate:
+        weeks = np.ceil(np.round(billable_days / DAYS_PER_WEEK, 6))
+        simulated = weeks * np.round(rates * pricing.weekly_rate, 2)
+    else:
+        simulated = np.round(rates / pricing.days_per_month, 2) * billable_days
+    return current, np.round(simulated, 2)
+
+
+def get_peak_qty(line_count, event_lines, event_days, event_qty):
+    """Highest qty on rent of every line, from its events sorted by day and summed up per line"""
+    peak_qty = np.zeros(line_count)
+    if not len(event_lines):
+        return peak_qty
+    order = np.lexsort((event_days, event_lines))
+    lines, qty = event_lines[order], event_qty[order]
+    running = np.cumsum(qty)
+    starts = np.flatnonzero(np.r_[True, lines[1:] != lines[:-1]])
+    offsets = np.r_[0, running[starts[1:] - 1]]
+    running -= np.repeat(offsets, np.diff(np.r_[starts, len(lines)]))
+    np.maximum.at(peak_qty, lines, running)
+    return peak_qty
+
+
+def get_order_conditions(filters):
+    conds = " so.docstatus = 1 and so.order_type = 'Rental' "
+    if filters.get("company"):
+        conds += " and so.company = %(company)s "
+    if filters.get("customer"):
+        conds += " and so.customer = %(customer)s "
+    return conds
+
+
+def get_simulation_orders(filters):
+    """Rental orders on rent at the start of the period or with movements in it, from one grouped query"""
+    return frappe.db.sql_list(
+        f"""Select l.sales_order from `tabRental Ledger Entry` l
+    inner join `tabSales Order` so on so.name = l.sales_order
+    where l.is_cancelled = 0 and l.posting_date < %(to_date)s and {get_order_conditions(filters)}
+    group by l.sales_order
+    having SUM(case when l.posting_date < %(from_date)s then l.qty else 0 end) != 0
+        or MAX(l.posting_date) >= %(from_date)s
+    order by l.sales_order""",
+        filters,
+    )
+
+
+def get_billed_amounts(filters):
+    """Amount actually invoiced per rental order for rental periods ending within the period"""
+    return dict(
+        frappe.db.sql(
+            f"""Select sii.sales_order, SUM(sii.amount)
+        from `tabSales Invoice` si inner join `tabSales Invoice Item` sii on sii.parent = si.name
+        inner join `tabSales Order` so on so.name = sii.sales_order
+        where si.docstatus = 1 and si.custom_rental_period_to > %(from_date)s
+        and si.custom_rental_period_to <= %(to_date)s and {get_order_conditions(filters)}
+        group by sii.sales_order""",
+            filters,
+        )
+    )
+
+
+def simulate_orders(orders, from_date, to_date, pricing):
+    """Simulated qty-days and amounts per order line, as a list of rows
+
+    The opening qty of each line comes from the monthly snapshots and the period's ledger movements
+    are read per line and day, then every line of the chunk is accrued and priced in one array pass.
+    """
+    lines = frappe.db.sql(
+        """Select so.name as sales_order, so.company, so.customer, so.currency,
+        soi.name as so_detail, soi.item_code, soi.rate
+    from `tabSales Order` so inner join `tabSales Order Item` soi on soi.parent = so.name
+    where so.name in %(orders)s order by so.name, soi.idx""",
+        {"orders": tuple(orders)},
+        as_dict=True,
+    )
+    if not lines:
+        return []
+    positions = {line.so_detail: idx for idx, line in enumerate(lines)}
+    opening_day = add_days(from_date, -1)
+    events = [
+        (so_detail, opening_day, qty)
+        for so_detail, qty in get_on_rent_balances(orders, from_date).items()
+        if so_detail in positions and flt(qty)
+    ]
+    events += frappe.db.sql(
+        """Select so_detail, posting_date, SUM(qty) from `tabRental Ledger Entry`
+    where is_cancelled = 0 and sales_order in %(orders)s
+    and posting_date >= %(from_date)s and posting_date < %(to_date)s
+    group by so_detail, posting_date""",
+        {"orders": tuple(orders), "from_date": from_date, "to_date": to_date},
+    )
+    events = [event for event in events if event[0] in positions]
+
+    event_lines = np.fromiter((positions[so_detail] for so_detail, _, _ in events), dtype=np.int64)
+    event_days = to_days(posting_date for _, posting_date, _ in events)
+    event_qty = np.fromiter((flt(qty) for _, _, qty in events), dtype=np.float64)
+    qty_days = compute_qty_days(
+        np.full(len(lines), from_date.toordinal(), dtype=np.int64),
+        np.full(len(lines), to_date.toordinal(), dtype=np.int64),
+        event_lines,
+        event_days,
+        event_qty,
+    )
+    peak_qty = get_peak_qty(len(lines), event_lines, event_days, event_qty)
+    rates = np.fromiter((flt(line.rate) for line in lines), dtype=np.float64)
+    current, simulated = price_lines(rates, qty_days, peak_qty, pricing)
+    for idx, line in enumerate(lines):
+        line.update(
+            qty_days=flt(qty_days[idx]),
+            peak_qty=flt(peak_qty[idx]),
+            current_amount=flt(current[idx]),
+            simulated_amount=flt(simulated[idx]),
+        )
+    return lines
+
+
+def run_billing_simulation(filters):
+    """Per-order, per-customer and per-company totals of a billing period under current and what-if pricing
+
+    Nothing is written: every invoice line is computed in memory and compared with what was
+    actually invoiced for the rental periods that end after from_date and up to to_date.
+    """
+    filters = frappe._dict(filters)
+    filters.from_date = getdate(filters.get("from_date") or get_first_day(add_months(today(), -1)))
+    filters.to_date = getdate(filters.get("to_date") or get_first_day(today()))
+    if filters.from_date >= filters.to_date:
+        frappe.throw("From Date must be before To Date")
+    pricing = get_pricing(filters.get("days_per_month"), filters.get("minimum_days"), filters.get("weekly_rate"))
+
+    orders = {}
+    for names in chunked(get_simulation_orders(filters)):
+        for line in simulate_orders(names, filters.from_date, filters.to_date, pricing):
+            order = orders.setdefault(
+                line.sales_order,
+                frappe._dict(
+                    sales_order=line.sales_order,
+                    company=line.company,
+                    customer=line.customer,
+                    currency=line.currency,
+                    lines=0,
+                    qty_days=0,
+                    current_amount=0,
+                    simulated_amount=0,
+                ),
+            )
+            if line.qty_days:
+                order.lines += 1
+            order.qty_days += line.qty_days
+            order.current_amount += line.current_amount
+            order.simulated_amount += line.simulated_amount
+
+    billed = get_billed_amounts(filters)
+    missing = [name for name in billed if name not in orders]
+    for names in chunked(missing):
+        for row in frappe.get_all(
+            "Sales Order",
+            filters={"name": ["in", names]},
+            fields=["name as sales_order", "company", "customer", "currency"],
+        ):
+            orders[row.sales_order] = frappe._dict(
+                row, lines=0, qty_days=0, current_amount=0, simulated_amount=0
+            )
+    for order in orders.values():
+        order.billed_amount = flt(billed.get(order.sales_order))
+        order.current_amount = flt(order.current_amount, 2)
+        order.simulated_amount = flt(order.simulated_amount, 2)
+        order.difference = flt(order.simulated_amount - order.billed_amount, 2)
+
+    return frappe._dict(
+        from_date=filters.from_date,
+        to_date=filters.to_date,
+        pricing=pricing,
+        orders=sorted(orders.values(), key=lambda order: order.sales_order),
+        customers=get_totals(orders.values(), ("company", "customer", "currency")),
+        companies=get_totals(orders.values(), ("company", "currency")),
+    )
+
+
+def get_totals(orders, group_by):
+    totals = {}
+    for order in orders:
+        key = tuple(order[field] for field in group_by)
+        row = totals.setdefault(
+            key,
+            frappe._dict(
+                dict(zip(group_by, key, strict=True)),
+                orders=0,
+                qty_days=0,
+                billed_amount=0,
+                current_amount=0,
+                simulated_amount=0,
+                difference=0,
+            ),
+        )
+        row.orders += 1
+        for field in ("qty_days", "billed_amount", "current_amount", "simulated_amount", "difference"):
+            row[field] = flt(row[field] + order[field], 2)
+    return [totals[key] for key in sorted(totals, key=lambda key: [value or "" for value in key])]
+
+
+@frappe.whitelist()
+def simulate_rental_billing(
+    from_date=None,
+    to_date=None,
+    company=None,
+    customer=None,
+    days_per_month=None,
+    minimum_days=None,
+    weekly_rate=None,
+):
+    """Dry run of rental billing for a period, without creating any documents"""
+    frappe.only_for(("Accounts Manager", "Accounts User", "System Manager"))
+    return run_billing_simulation(
+        {
+            "from_date": from_date,
+            "to_date": to_date,
+            "company": company,
+            "customer": customer,
+            "days_per_month": days_per_month,
+            "minimum_days": minimum_days,
+            "weekly_rate": weekly_rate,
+        }
+    )
@@ -0,0 +1,165 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import frappe
+from frappe.utils import cint, now_datetime
+
+RENTAL_INVOICE_PRINT_FORMAT = "Rental Invoice"
+PDF_WORKERS = 4
+PDF_JOB_TIMEOUT = 4 * 3600
+PROGRESS_EVENT = "rental_invoice_pdfs_progress"
+
+
+def get_rental_invoices(billing_run=None, from_date=None, to_date=None, company=None):
+    """Submitted rental invoices of a billing run, or of a posting date range and company"""
+    if billing_run:
+        # billing creates drafts, only the ones submitted since are printed
+        return frappe.db.sql_list(
+            """Select si.name from `tabRental Billing Run Order` ro
+        inner join `tabSales Invoice` si on si.name = ro.sales_invoice
+        where ro.parent = %(billing_run)s and ro.status = 'Invoiced' and si.docstatus = 1
+        group by si.name order by MIN(ro.idx)""",
+            {"billing_run": billing_run},
+        )
+    if not (from_date and to_date):
+        frappe.throw("Select a Rental Billing Run or a date range")
+    conds = " and si.company = %(company)s " if company else ""
+    return frappe.db.sql_list(
+        f"""Select si.name from `tabSales Invoice` si
+    where si.docstatus = 1 and si.posting_date between %(from_date)s and %(to_date)s {conds}
+    and exists (Select 1 from `tabSales Invoice Item` sii inner join `tabSales Order` so on so.name = sii.sales_order
+        where sii.parent = si.name and so.order_type = 'Rental')
+    order by si.posting_date, si.name""",
+        {"from_date": from_date, "to_date": to_date, "company": company},
+    )
+
+
+@frappe.whitelist()
+def enqueue_rental_invoice_pdfs(billing_run=None, from_date=None, to_date=None, company=None, merge=0):
+    """Render every Rental Invoice PDF of a billing run (or date range) into one zip or merged PDF"""
+    frappe.has_permission("Sales Invoice", "print", throw=True)
+    invoices = get_rental_invoices(billing_run, from_date, to_date, company)
+    if not invoices:
+        frappe.throw("No submitted rental invoices found")
+    job = frappe.enqueue(
+        "erplex_rental.bulk_print.render_rental_invoice_pdfs",
+        queue="long",
+        timeout=PDF_JOB_TIMEOUT,
+        invoices=invoices,
+        merge=cint(merge),
+        billing_run=billing_run,
+        user=frappe.session.user,
+    )
+    return {"job_id": job.id if job else None, "invoices": len(invoices)}
+
+
+def init_pdf_worker(site, sites_path, user):
+    frappe.init(site=site, sites_path=sites_path)
+    frappe.connect()
+    frappe.set_user(user)
+
+
+def render_invoice_pdf(sales_invoice, directory):
+    """Render one invoice in a pool worker and write it straight to disk, returning the file path"""
+    from erplex_rental.pdf_cache import get_cached_pdf, is_cacheable
+
+    doc = frappe.get_doc("Sales Invoice", sales_invoice)
+    if is_cacheable(doc, RENTAL_INVOICE_PRINT_FORMAT):
+        pdf = get_cached_pdf(doc, RENTAL_INVOICE_PRINT_FORMAT)
+    else:
+        pdf = frappe.get_print("Sales Invoice", sales_invoice, RENTAL_INVOICE_PRINT_FORMAT, doc=doc, as_pdf=True)
+    path = os.path.join(directory, "{}.pdf".format(sales_invoice.replace(" ", "-").replace("/", "-")))
+    with open(path, "wb") as f:
+        f.write(pdf)
+    frappe.db.rollback()
+    return path
+
+
+def render_rental_invoice_pdfs(invoices, merge=0, billing_run=None, user=None, workers=PDF_WORKERS):
+    """Render the invoices in a process pool and stream each finished PDF into the output file
+
+    Workers write their PDF to a scratch directory and return only its path; the PDF is added to the
+    zip and removed from disk as soon as it completes, so memory stays bounded by a single document
+    per worker. A merged PDF has to keep its pages until the whole file is written.
+    """
+    user = user or frappe.session.user
+    directory = tempfile.mkdtemp(prefix="rental_invoice_pdfs_")
+    extension = "pdf" if merge else "zip"
+    file_name = f"Rental Invoices {billing_run or now_datetime().strftime('%Y-%m-%d %H%M%S')}.{extension}"
+    output_path = os.path.join(directory, file_name)
+    failed = []
+    try:
+        writer = get_merged_writer() if merge else zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED)
+        # spawn, so every worker opens its own database connection instead of sharing the job's
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(invoices)) or 1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_pdf_worker,
+            initargs=(frappe.local.site, frappe.local.sites_path, user),
+        ) as pool:
+            futures = {pool.submit(render_invoice_pdf, name, directory): name for name in invoices}
+            for done, future in enumerate(as_completed(futures), 1):
+                sales_invoice = futures[future]
+                try:
+                    path = future.result()
+                except Exception:
+                    failed.append(sales_invoice)
+                    frappe.log_error(
+                        f"Rental Invoice PDF failed for {sales_invoice}",
+                        reference_doctype="Sales Invoice",
+                        reference_name=sales_invoice,
+                    )
+                else:
+                    if merge:
+                        writer.append(path)
+                    else:
+                        writer.write(path, os.path.basename(path))
+                    os.remove(path)
+                frappe.publish_realtime(
+                    PROGRESS_EVENT,
+                    {"done": done, "total": len(invoices), "sales_invoice": sales_invoice},
+                    user=user,
+                )
+        if merge:
+            writer.write(output_path)
+        else:
+            writer.close()
+        file_url = save_output_file(output_path, file_name, billing_run)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    frappe.publish_realtime(
+        PROGRESS_EVENT,
+        {"done": len(invoices), "total": len(invoices), "file_url": file_url, "failed": failed},
+        user=user,
+    )
+    return file_url
+
+
+def get_merged_writer():
+    from pypdf import PdfWriter
+
+    return PdfWriter()
+
+
+def save_output_file(path, file_name, billing_run=None):
+    """Move the output into the private files and register it, without reading it into memory"""
+    file_name = f"{frappe.generate_hash(length=6)}-{file_name}"
+    shutil.move(path, frappe.get_site_path("private", "files", file_name))
+    file_doc = frappe.get_doc(
+        {
+            "doctype": "File",
+            "file_name": file_name,
+            "file_url": f"/private/files/{file_name}",
+            "is_private": 1,
+            "attached_to_doctype": "Rental Billing Run" if billing_run else None,
+            "attached_to_name": billing_run,
+        }
+    )
+    file_doc.flags.ignore_permissions = True
+    file_doc.insert()
+    frappe.db.commit()
+    return file_doc.file_url
@@ -0,0 +1,118 @@
+import click
+from frappe.commands import get_site, pass_context
+
+
+@click.command("rebuild-rental-ledger")
+@click.option("--sales-order", help="Only rebuild the entries of this Sales Order")
+@pass_context
+def rebuild_ledger(context, sales_order=None):
+    """Rebuild Rental Ledger Entries from submitted Rental Deliveries and Rental Returns"""
+    import frappe
+
+    from erplex_rental.rental_ledger import build_rental_snapshots, rebuild_rental_ledger
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        entries = rebuild_rental_ledger(sales_order)
+        frappe.db.commit()
+        click.echo(f"Created {entries} Rental Ledger Entries")
+        click.echo(f"Created {build_rental_snapshots()} Rental Qty Snapshots")
+    finally:
+        frappe.destroy()
+
+
+@click.command("recompute-rental-orders")
+@click.option("--sales-order", help="Only recompute this Sales Order")
+@pass_context
+def recompute_orders(context, sales_order=None):
+    """Recompute delivered / returned qty, deposit and status of rental Sales Orders from their vouchers"""
+    import frappe
+
+    from erplex_rental.main import update_so
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        filters = {"docstatus": 1, "order_type": "Rental"}
+        if sales_order:
+            filters["name"] = sales_order
+        orders = frappe.get_all("Sales Order", filters=filters, pluck="name")
+        for order in orders:
+            update_so(order)
+            frappe.db.commit()
+        click.echo(f"Recomputed {len(orders)} Sales Orders")
+    finally:
+        frappe.destroy()
+
+
+@click.command("benchmark-rental-delivery-refresh")
+@click.option("--rows", multiple=True, type=int, default=(1, 50, 500), help="Delivery rows to refresh per run")
+@pass_context
+def benchmark_delivery_refresh(context, rows):
+    """Compare the row-by-row and batched Rental Delivery refresh on submitted deliveries (changes are rolled back)"""
+    import frappe
+
+    from erplex_rental.billing import BillingStats
+    from erplex_rental.erplex_rental.doctype.rental_return.rental_return import (
+        update_rental_delivery_status,
+        update_rental_delivery_status_by_row,
+    )
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        deliveries = frappe.db.sql(
+            """Select parent, count(*) from `tabRental Delivery Item`
+        where docstatus = 1 and parenttype = 'Rental Delivery' group by parent order by count(*) desc"""
+        )
+        for size in rows:
+            names, total = [], 0
+            for delivery, count in deliveries:
+                if total >= size:
+                    break
+                names.append(delivery)
+                total += count
+            stats = BillingStats(f"delivery refresh {total} rows")
+            with stats.track():
+                with stats.phase("by row"):
+                    for delivery in names:
+                        update_rental_delivery_status_by_row(delivery)
+                frappe.db.rollback()
+                with stats.phase("batched"):
+                    update_rental_delivery_status(names)
+                frappe.db.rollback()
+            click.echo(f"{total} rows in {len(names)} deliveries: {stats.phases}")
+    finally:
+        frappe.destroy()
+
+
+@click.command("export-rental-movements")
+@click.option("--output", required=True, help="File to write, .csv or .xlsx")
+@click.option("--changed-since", help="Only vouchers modified since this timestamp, cancelled ones included")
+@click.option("--company", help="Only vouchers of this company")
+@pass_context
+def export_movements(context, output, changed_since=None, company=None):
+    """Write every Rental Delivery and Rental Return item row to a CSV or XLSX file"""
+    import frappe
+
+    from erplex_rental.movement_export import iter_csv, iter_rental_movements, iter_xlsx
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        rows = iter_rental_movements(changed_since, company)
+        if output.endswith(".xlsx"):
+            with open(output, "wb") as f:
+                for chunk in iter_xlsx(rows):
+                    f.write(chunk)
+        else:
+            with open(output, "w", newline="") as f:
+                for chunk in iter_csv(rows):
+                    f.write(chunk)
+        click.echo(f"Exported rental movements to {output}")
+    finally:
+        frappe.destroy()
+
+
+commands = [rebuild_ledger, recompute_orders, benchmark_delivery_refresh, export_movements]
@@ -0,0 +1,166 @@
+import frappe
+from frappe.utils import cint, flt, getdate, now_datetime, today
+
+from erplex_rental.accrual import accrue_rental_lines, get_per_day_rate
+
+# orders accrued per transaction by the daily job
+ACCRUAL_BATCH_SIZE = 200
+ACCRUAL_FIELDS = (
+    "name",
+    "creation",
+    "modified",
+    "owner",
+    "modified_by",
+    "sales_order",
+    "so_detail",
+    "item_code",
+    "from_date",
+    "to_date",
+    "qty_days",
+    "per_day_rate",
+    "amount",
+)
+
+
+def is_daily_accrual_enabled():
+    return cint(frappe.db.get_single_value("Rental Settings", "daily_accrual"))
+
+
+def get_accrued_upto(so_details):
+    """Day each Sales Order Item has been accrued up to (not including), as {so_detail: date}"""
+    from erplex_rental.billing import chunked
+
+    accrued_upto = {}
+    for names in chunked(set(so_details)):
+        accrued_upto.update(
+            frappe.db.sql(
+                """Select so_detail, MAX(to_date) from `tabRental Accrual`
+            where so_detail in %(so_details)s group by so_detail""",
+                {"so_details": tuple(names)},
+            )
+        )
+    return {so_detail: getdate(to_date) for so_detail, to_date in accrued_upto.items()}
+
+
+def accrue_order_items(order_items, accrual_date):
+    """Post the qty-days of order lines from where they were last accrued (or billed) up to the accrual date
+
+    `order_items` are rows of billing.get_rental_order_items. Lines with nothing on rent in the period
+    get no row, so they are simply accrued from the same day again next time.
+    """
+    from erplex_rental.billing import get_billing_start_date
+
+    accrual_date = getdate(accrual_date)
+    accrued_upto = get_accrued_upto(soi.so_detail for soi in order_items)
+    lines = []
+    for soi in order_items:
+        start_date = getdate(get_billing_start_date(soi))
+        if soi.so_detail in accrued_upto:
+            start_date = max(start_date, accrued_upto[soi.so_detail])
+        if start_date < accrual_date:
+            lines.append(frappe._dict(soi, start_date=start_date))
+    accruals = accrue_rental_lines(lines, accrual_date)
+
+    timestamp, user = now_datetime(), frappe.session.user
+    values = []
+    for line in lines:
+        qty_days = flt(accruals[line.so_detail].qty_days)
+        if qty_days <= 0:
+            continue
+        per_day_rate = get_per_day_rate(line.rate)
+        values.append(
+            (
+                frappe.generate_hash(),
+                timestamp,
+                timestamp,
+                user,
+                user,
+                line.sales_order,
+                line.so_detail,
+                line.item_code,
+                line.start_date,
+                accrual_date,
+                qty_days,
+                per_day_rate,
+                flt(per_day_rate * qty_days, 2),
+            )
+        )
+    if values:
+        frappe.db.bulk_insert("Rental Accrual", ACCRUAL_FIELDS, values)
+    return len(values)
+
+
+def accrue_daily_rentals(accrual_date=None):
+    """Daily job: accrue the qty-days of every queued rental order up to today, a small batch per commit"""
+    from erplex_rental.billing import chunked, get_rental_order_items
+
+    if not is_daily_accrual_enabled():
+        return 0
+    accrual_date = getdate(accrual_date or today())
+    orders = frappe.db.sql_list("""Select sales_order from `tabRental Billing Queue` order by sales_order""")
+    created = 0
+    for names in chunked(orders, ACCRUAL_BATCH_SIZE):
+        created += accrue_order_items(get_rental_order_items(names), accrual_date)
+        frappe.db.commit()
+    return created
+
+
+def get_accrued_invoice_lines(order_items, billing_date):
+    """Invoice lines per Sales Order from the uninvoiced accruals, as {sales_order: [lines]}
+
+    The days since the last daily run are accrued first, so the month-end step only sums up what
+    the daily job already computed.
+    """
+    from erplex_rental.billing import chunked, get_billing_start_date
+
+    billing_date = getdate(billing_date)
+    accrue_order_items(order_items, billing_date)
+    accrued = {}
+    for rows in chunked(order_items):
+        for so_detail, qty_days in frappe.db.sql(
+            """Select ra.so_detail, SUM(ra.qty_days) from `tabRental Accrual` ra
+        inner join `tabSales Order` so on so.name = ra.sales_order
+        where ra.so_detail in %(so_details)s and ra.sales_invoice is null and ra.to_date <= %(billing_date)s
+        and ra.from_date >= ifnull(so.custom_last_billed_date, so.transaction_date)
+        group by ra.so_detail""",
+            {"so_details": tuple(soi.so_detail for soi in rows), "billing_date": billing_date},
+        ):
+            accrued[so_detail] = flt(qty_days)
+    invoice_lines = {}
+    for soi in order_items:
+        lines = invoice_lines.setdefault(soi.sales_order, [])
+        if accrued.get(soi.so_detail, 0) <= 0:
+            continue
+        lines.append(
+            frappe._dict(
+                {
+                    "item_code": soi.item_code,
+                    "qty": accrued[soi.so_detail],
+                    "rate": get_per_day_rate(soi.rate),
+                    "sales_order": soi.sales_order,
+                    "so_detail": soi.so_detail,
+                    "start_date": get_billing_start_date(soi),
+                }
+            )
+        )
+    return invoice_lines
+
+
+def mark_accruals_invoiced(lines, sales_invoice, billing_date):
+    """Link the accruals billed by an invoice to it"""
+    frappe.db.sql(
+        """Update `tabRental Accrual` set sales_invoice = %(sales_invoice)s
+    where so_detail in %(so_details)s and sales_invoice is null and to_date <= %(billing_date)s""",
+        {
+            "sales_invoice": sales_invoice,
+            "so_details": tuple(line.so_detail for line in lines),
+            "billing_date": getdate(billing_date),
+        },
+    )
+
+
+def release_invoice_accruals(doc, method=None):
+    """Sales Invoice doc event: accruals of a cancelled or deleted invoice become billable again"""
+    frappe.db.sql(
+        """Update `tabRental Accrual` set sales_invoice = null where sales_invoice = %s""", doc.name
+    )
@@ -6,6 +6,7 @@ from frappe.model.document import Document
 from frappe.utils import flt, today, nowtime
 from erpnext.stock.utils import get_stock_balance
 from erplex_rental.utils import remove_linked_transactions 
+from erplex_rental.item_cache import get_item_attributes
 
 
 class ChangeInventory(Document):
@@ -27,8 +28,10 @@ class ChangeInventory(Document):
         #     frappe.throw("Source Rate must be greater than 0")
 
         # Get item details
-        item_doc = frappe.get_doc("Item", self.source_item)
-        self.source_item_name = item_doc.item_name
+        item = get_item_attributes([self.source_item]).get(self.source_item)
+        if not item:
+            frappe.throw(f"Item {self.source_item} not found", frappe.DoesNotExistError)
+        self.source_item_name = item.item_name
 
         # # Calculate source amount
         # self.source_amount = flt(self.source_qty * self.source_rate, 2)
@@ -38,6 +41,7 @@ class ChangeInventory(Document):
         if not self.target_items:
             frappe.throw("At least one target item is required")
 
+        item_attributes = get_item_attributes(item.item_code for item in self.target_items)
         for item in self.target_items:
             if not item.item_code:
                 frappe.throw("Item Code is required for all target items")
@@ -50,7 +54,9 @@ class ChangeInventory(Document):
             #     frappe.throw("Rate must be greater than 0 for all target items")
 
             # Get item details
-            item_doc = frappe.get_doc("Item", item.item_code)
+            item_doc = item_attributes.get(item.item_code)
+            if not item_doc:
+                frappe.throw(f"Item {item.item_code} not found", frappe.DoesNotExistError)
             item.item_name = item_doc.item_name
             item.description = item_doc.description
 
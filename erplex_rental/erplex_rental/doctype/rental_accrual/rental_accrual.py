@@ -0,0 +1,13 @@
+# Copyright (c) 2025, ERPlexSolutions and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class RentalAccrual(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Rental Accrual", ["so_detail", "to_date"])
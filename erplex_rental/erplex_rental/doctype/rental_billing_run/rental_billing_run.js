@@ -0,0 +1,40 @@
+// Copyright (c) 2025, ERPlexSolutions and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on("Rental Billing Run", {
+	refresh: function (frm) {
+		frm.disable_save();
+		if (["Failed", "Partially Failed"].includes(frm.doc.status)) {
+			frm.add_custom_button(__("Resume"), function () {
+				frm.call("resume").then(() => frm.reload_doc());
+			});
+			frm.add_custom_button(__("Retry Failed Orders"), function () {
+				frm.call("resume", { retry_failed: 1 }).then(() => frm.reload_doc());
+			});
+		}
+		if (frm.doc.invoiced_orders && ["Completed", "Partially Failed"].includes(frm.doc.status)) {
+			frm.add_custom_button(__("Invoice PDFs (Zip)"), () => render_invoice_pdfs(frm, 0), __("Print"));
+			frm.add_custom_button(__("Invoice PDFs (Merged)"), () => render_invoice_pdfs(frm, 1), __("Print"));
+		}
+	},
+});
+
+function render_invoice_pdfs(frm, merge) {
+	frappe.realtime.off("rental_invoice_pdfs_progress");
+	frappe.realtime.on("rental_invoice_pdfs_progress", (data) => {
+		frappe.show_progress(__("Rendering Invoice PDFs"), data.done, data.total);
+		if (data.file_url) {
+			frappe.hide_progress();
+			frappe.realtime.off("rental_invoice_pdfs_progress");
+			frm.reload_doc();
+			window.open(data.file_url);
+		}
+	});
+	frappe.call({
+		method: "erplex_rental.bulk_print.enqueue_rental_invoice_pdfs",
+		args: { billing_run: frm.doc.name, merge: merge },
+		callback: (r) => {
+			frappe.show_alert(__("Rendering {0} invoices in the background", [r.message.invoices]));
+		},
+	});
+}
@@ -0,0 +1,17 @@
+# Copyright (c) 2025, ERPlexSolutions and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class RentalBillingRun(Document):
+	@frappe.whitelist()
+	def resume(self, retry_failed=0):
+		"""Continue the run from its checkpoint"""
+		from erplex_rental.billing import resume_billing_run
+
+		frappe.only_for(("Accounts Manager", "System Manager"))
+		self.check_permission("write")
+
+		resume_billing_run(self.name, retry_failed)
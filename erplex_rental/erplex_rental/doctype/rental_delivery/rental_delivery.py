@@ -5,7 +5,8 @@ import frappe
 from frappe.model.document import Document
 from frappe.utils import today, nowtime, flt
 from erplex_rental.utils import remove_linked_transactions, get_total_returned_qty, get_total_delivered_qty
-from erplex_rental.main import update_so
+from erplex_rental.main import update_so_from_voucher
+from erplex_rental.rental_ledger import make_rental_ledger_entries
 
 
 class RentalDelivery(Document):
@@ -46,9 +47,7 @@ class RentalDelivery(Document):
     def on_submit(self):
         self.status = "Delivered"
         self.create_stock_entry()
-        self.update_sales_order()
-    
-    def after_submit(self):
+        make_rental_ledger_entries(self)
         self.update_sales_order()
 
     def create_stock_entry(self):
@@ -83,15 +82,11 @@ class RentalDelivery(Document):
         # self.ignore_linked_doctypes = ("Stock Entry")
         self.status = "Cancelled"
         remove_linked_transactions("Stock Entry", "rental_delivery", self.name)
-        self.update_sales_order()
+        make_rental_ledger_entries(self, cancel=True)
+        self.update_sales_order(cancel=True)
 
-    def after_cancel(self):
-        self.update_sales_order()
-
-    def update_sales_order(self):
-        orders = list(set([row.sales_order for row in self.items]))
-        for order in orders:
-            update_so(order)
+    def update_sales_order(self, cancel=False):
+        update_so_from_voucher(self, cancel)
 
 @frappe.whitelist()
 def create_rental_delivery(source_name, target_doc=None):
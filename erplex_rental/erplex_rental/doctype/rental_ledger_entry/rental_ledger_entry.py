@@ -0,0 +1,15 @@
+# Copyright (c) 2025, ERPlexSolutions and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class RentalLedgerEntry(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Rental Ledger Entry", ["sales_order", "item_code", "posting_date"])
+	frappe.db.add_index("Rental Ledger Entry", ["so_detail", "posting_date", "posting_time"])
+	frappe.db.add_index("Rental Ledger Entry", ["voucher_type", "voucher_no"])
@@ -0,0 +1,16 @@
+// Copyright (c) 2025, ERPlexSolutions and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on("Rental Purchase Billing Run", {
+	refresh: function (frm) {
+		frm.disable_save();
+		if (["Failed", "Partially Failed"].includes(frm.doc.status)) {
+			frm.add_custom_button(__("Resume"), function () {
+				frm.call("resume").then(() => frm.reload_doc());
+			});
+			frm.add_custom_button(__("Retry Failed Orders"), function () {
+				frm.call("resume", { retry_failed: 1 }).then(() => frm.reload_doc());
+			});
+		}
+	},
+});
@@ -0,0 +1,14 @@
+# Copyright (c) 2025, ERPlexSolutions and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class RentalQtySnapshot(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Rental Qty Snapshot", ["sales_order", "snapshot_date"])
+	frappe.db.add_index("Rental Qty Snapshot", ["so_detail", "snapshot_date"])
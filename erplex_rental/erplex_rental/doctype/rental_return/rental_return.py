@@ -8,6 +8,11 @@ from erplex_rental.utils import (
     remove_linked_transactions,
     get_total_returned_qty,
 )
+from erplex_rental.rental_ledger import make_rental_ledger_entries
+from erplex_rental.main import update_so_from_voucher
+from erplex_rental.item_cache import get_item_attributes
+
+DELIVERY_UPDATE_CHUNK_SIZE = 500
 
 
 class RentalReturn(Document):
@@ -87,10 +92,9 @@ class RentalReturn(Document):
             self.create_return_stock_entry()
         if self.total_damaged_qty > 0:
             self.create_damaged_stock_entry()
+        make_rental_ledger_entries(self)
         self.update_rental_delivery()
-
-    def after_submit(self):
-        self.update_rental_delivery()
+        update_so_from_voucher(self)
 
     def create_return_stock_entry(self):
         """Create stock entry to move items from rented warehouse back to main warehouse"""
@@ -145,49 +149,118 @@ class RentalReturn(Document):
         stock_entry.submit()
 
     def update_rental_delivery(self):
-        deliveries = list(set([row.rental_delivery for row in self.items]))
-        for delivery in deliveries:
-            rental_delivery = frappe.get_doc("Rental Delivery", delivery)
-            for rd_item in rental_delivery.items:
-                rd_item.returned_qty = get_total_returned_qty(
-                    rd_item.sales_order,
-                    rd_item.sales_order_detail,
-                    rental_delivery.name,
-                    rd_item.name,
-                )
-                rd_item.pending_qty = flt(rd_item.qty) - flt(rd_item.returned_qty)
-                if rd_item.pending_qty <= 0:
-                    rd_item.return_status = "Fully Returned"
-                elif rd_item.returned_qty > 0:
-                    rd_item.return_status = "Partially Returned"
-                else:
-                    rd_item.return_status = "Not Returned"
-                rd_item.db_update()
-            all_returned = all(
-                item.return_status == "Fully Returned" for item in rental_delivery.items
-            )
-            any_returned = any(
-                item.return_status in ["Partially Returned", "Fully Returned"]
-                for item in rental_delivery.items
-            )
-            if all_returned:
-                rental_delivery.status = "Returned"
-            elif any_returned:
-                rental_delivery.status = "Partially Returned"
-            else:
-                rental_delivery.status = "Delivered"
-            rental_delivery.db_update()
-            rental_delivery.update_sales_order()
+        update_rental_delivery_status(list(set([row.rental_delivery for row in self.items])))
 
     def before_cancel(self):
         self.status = "Cancelled"
 
     def on_cancel(self):
         remove_linked_transactions("Stock Entry", "rental_return", self.name)
+        make_rental_ledger_entries(self, cancel=True)
         self.update_rental_delivery()
+        update_so_from_voucher(self, cancel=True)
 
-    def after_cancel(self):
-        self.update_rental_delivery()
+
+def get_return_status(qty, returned_qty):
+    pending_qty = flt(qty) - flt(returned_qty)
+    if pending_qty <= 0:
+        return "Fully Returned"
+    if flt(returned_qty) > 0:
+        return "Partially Returned"
+    return "Not Returned"
+
+
+def update_rental_delivery_status(deliveries):
+    """Refresh returned / pending qty and return status of Rental Deliveries from their submitted returns
+
+    Returned qty of every delivery row comes from one aggregate query keyed by rental_delivery_detail,
+    and the rows and their parents are written with one update per chunk and one per status.
+    """
+    if isinstance(deliveries, str):
+        deliveries = [deliveries]
+    if not deliveries:
+        return
+    rows = frappe.db.sql(
+        """Select rdi.name, rdi.parent, rdi.qty,
+        IFNULL(SUM(rri.return_qty + rri.maintenance_qty + rri.damaged_qty), 0) as returned_qty
+    from `tabRental Delivery Item` rdi left join `tabRental Return Item` rri
+        on rri.rental_delivery_detail = rdi.name and rri.docstatus = 1
+    where rdi.parenttype = 'Rental Delivery' and rdi.parent in %(deliveries)s
+    group by rdi.name, rdi.parent, rdi.qty""",
+        {"deliveries": tuple(deliveries)},
+        as_dict=True,
+    )
+    parent_statuses = {}
+    for row in rows:
+        row.pending_qty = flt(row.qty) - flt(row.returned_qty)
+        row.return_status = get_return_status(row.qty, row.returned_qty)
+        parent_statuses.setdefault(row.parent, set()).add(row.return_status)
+
+    for start in range(0, len(rows), DELIVERY_UPDATE_CHUNK_SIZE):
+        update_delivery_items(rows[start : start + DELIVERY_UPDATE_CHUNK_SIZE])
+
+    deliveries_by_status = {}
+    for delivery, statuses in parent_statuses.items():
+        if statuses == {"Fully Returned"}:
+            status = "Returned"
+        elif statuses & {"Partially Returned", "Fully Returned"}:
+            status = "Partially Returned"
+        else:
+            status = "Delivered"
+        deliveries_by_status.setdefault(status, []).append(delivery)
+    for status, names in deliveries_by_status.items():
+        frappe.db.sql(
+            """Update `tabRental Delivery` set status = %s where name in %s""", (status, tuple(names))
+        )
+
+
+def update_delivery_items(rows):
+    cases = " ".join(["when %s then %s"] * len(rows))
+    values = []
+    for fieldname in ("returned_qty", "pending_qty", "return_status"):
+        values += [value for row in rows for value in (row.name, row[fieldname])]
+    frappe.db.sql(
+        f"""Update `tabRental Delivery Item` set
+        returned_qty = (case name {cases} end),
+        pending_qty = (case name {cases} end),
+        return_status = (case name {cases} end)
+    where name in %s""",
+        (*values, tuple(row.name for row in rows)),
+    )
+
+
+def update_rental_delivery_status_by_row(delivery):
+    """Row-by-row refresh of one Rental Delivery, kept as the baseline for bench benchmark-rental-delivery-refresh"""
+    rental_delivery = frappe.get_doc("Rental Delivery", delivery)
+    for rd_item in rental_delivery.items:
+        rd_item.returned_qty = get_total_returned_qty(
+            rd_item.sales_order,
+            rd_item.sales_order_detail,
+            rental_delivery.name,
+            rd_item.name,
+        )
+        rd_item.pending_qty = flt(rd_item.qty) - flt(rd_item.returned_qty)
+        if rd_item.pending_qty <= 0:
+            rd_item.return_status = "Fully Returned"
+        elif rd_item.returned_qty > 0:
+            rd_item.return_status = "Partially Returned"
+        else:
+            rd_item.return_status = "Not Returned"
+        rd_item.db_update()
+    all_returned = all(
+        item.return_status == "Fully Returned" for item in rental_delivery.items
+    )
+    any_returned = any(
+        item.return_status in ["Partially Returned", "Fully Returned"]
+        for item in rental_delivery.items
+    )
+    if all_returned:
+        rental_delivery.status = "Returned"
+    elif any_returned:
+        rental_delivery.status = "Partially Returned"
+    else:
+        rental_delivery.status = "Delivered"
+    rental_delivery.db_update()
 
 
 @frappe.whitelist()
@@ -201,17 +274,19 @@ def create_rental_return(source_name, target_doc=None):
         if source.status == "Returned":
             frappe.throw("All items have already been returned")
 
+    item_attributes = {}
+
     def update_item(source, target, source_parent):
+        if not item_attributes:
+            item_attributes.update(get_item_attributes(row.item_code for row in source_parent.items))
         if flt(source.pending_qty) > 0:
             target.delivered_qty = source.qty
             target.return_qty = source.pending_qty
             target.damaged_qty = 0
             target.rate = source.rate
-            target.maintenance_rate, target.damaged_rate = frappe.db.get_value(
-                "Item",
-                source.item_code,
-                ["custom_maintenance_charge", "custom_damage_charge"],
-            ) or [0, 0]
+            item = item_attributes.get(source.item_code) or frappe._dict()
+            target.maintenance_rate = flt(item.custom_maintenance_charge)
+            target.damaged_rate = flt(item.custom_damage_charge)
             target.amount = flt(source.pending_qty * source.rate, 2)
             target.sales_order = source.sales_order
             target.sales_order_detail = source.sales_order_detail
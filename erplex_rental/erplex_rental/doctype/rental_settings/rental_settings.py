@@ -4,8 +4,13 @@
 import frappe
 from frappe.model.document import Document
 
+DEFAULTS_CACHE_KEY = "rental_settings_defaults"
+
 
 class RentalSettings(Document):
+    def on_update(self):
+        clear_defaults_cache()
+
     def validate(self):
         for row in self.defaults:
             if row.rented_warehouse and row.rental_source_warehouse:
@@ -44,22 +49,62 @@ def get_rental_settings():
     return settings
 
 
+def build_defaults_index():
+    """Rental defaults of every company in Rental Settings, keyed by company"""
+    index = {}
+    for row in frappe.get_all(
+        "Rental Settings Defaults",
+        filters={"parent": "Rental Settings", "parenttype": "Rental Settings"},
+        fields=[
+            "company",
+            "rental_cost_center",
+            "rental_income_account",
+            "security_deposit_account",
+            "rented_warehouse",
+            "rental_source_warehouse",
+            "maintenance_warehouse",
+        ],
+        order_by="idx",
+    ):
+        # the last row of a company wins, as it did when scanning the table
+        index[row.company] = {
+            "cost_center": row.rental_cost_center,
+            "income_account": row.rental_income_account,
+            "security_deposit_account": row.security_deposit_account,
+            "rented_warehouse": row.rented_warehouse,
+            "source_warehouse": row.rental_source_warehouse,
+            "maintenance_warehouse": row.maintenance_warehouse,
+        }
+    return index
+
+
+def get_defaults_index():
+    return frappe.cache.get_value(DEFAULTS_CACHE_KEY, generator=build_defaults_index)
+
+
+def clear_defaults_cache():
+    frappe.cache.delete_value(DEFAULTS_CACHE_KEY)
+
+
+def warm_defaults_cache(bootinfo=None):
+    get_defaults_index()
+
+
 @frappe.whitelist()
 def get_default_warehouses(company):
-    warehouses = frappe._dict()
     """Get default warehouses for rental operations"""
-    settings = frappe.get_single("Rental Settings")
-    warehouse_row = None
-    for w in settings.defaults:
-        if w.company == company:
-            warehouse_row = w
-    if warehouse_row:
-        warehouses = {
-            "rented_warehouse": warehouse_row.rented_warehouse,
-            "source_warehouse": warehouse_row.rental_source_warehouse,
-            "maintenance_warehouse": warehouse_row.maintenance_warehouse,
-        }
-    if (not warehouse_row) and (settings.auto_create_warehouses) and (company):
+    defaults = get_defaults_index().get(company)
+    if defaults:
+        return frappe._dict(
+            {
+                "rented_warehouse": defaults["rented_warehouse"],
+                "source_warehouse": defaults["source_warehouse"],
+                "maintenance_warehouse": defaults["maintenance_warehouse"],
+            }
+        )
+    warehouses = frappe._dict()
+    if company and frappe.db.get_single_value("Rental Settings", "auto_create_warehouses"):
+        settings = frappe.get_single("Rental Settings")
         warehouses = create_missing_warehouses(company, warehouses, settings)
         settings.append(
             "defaults",
@@ -76,24 +121,8 @@ def get_default_warehouses(company):
 
 @frappe.whitelist()
 def get_defaults(company):
-    defaults = frappe._dict()
-    settings = frappe.get_single("Rental Settings")
-    defaults_row = None
-    for d in settings.defaults:
-        if d.company == company:
-            defaults_row = d
-    if defaults_row:
-        defaults = frappe._dict(
-            {
-                "cost_center": defaults_row.rental_cost_center,
-                "income_account": defaults_row.rental_income_account,
-                "security_deposit_account": defaults_row.security_deposit_account,
-                "rented_warehouse": defaults_row.rented_warehouse,
-                "source_warehouse": defaults_row.rental_source_warehouse,
-                "maintenance_warehouse": defaults_row.maintenance_warehouse,
-            }
-        )
-    return defaults
+    """Rental defaults of a company, as a copy the caller may change without touching the cache"""
+    return frappe._dict(get_defaults_index().get(company) or {})
 
 
 def create_missing_warehouses(company, warehouses, settings):
@@ -26,6 +26,24 @@ frappe.query_reports["MRF Report"] = {
 					}
 				};
 			}
+		},
+		{
+			"fieldname": "movements_per_page",
+			"label": __("Movements per Page"),
+			"fieldtype": "Int",
+			"description": __("Show this many deliveries and returns of each type at a time, 0 for all")
+		},
+		{
+			"fieldname": "page",
+			"label": __("Page"),
+			"fieldtype": "Int",
+			"default": 1,
+			"depends_on": "eval:doc.movements_per_page > 0"
+		},
+		{
+			"fieldname": "totals_only",
+			"label": __("Totals Only"),
+			"fieldtype": "Check"
 		}
 	]
 };
@@ -1,81 +1,98 @@
 # Copyright (c) 2025, ERPlexSolutions and contributors
 # For license information, please see license.txt
 
+from collections import defaultdict
+
 import frappe
-from frappe.utils import flt, cstr
+from frappe.utils import cint, flt, cstr, format_datetime, now_datetime
+
+# (fieldname prefix, column label, total fieldname) of each movement column group, in column order
+MOVEMENT_TYPES = (
+    ("delivery", "Delivery", "total_delivered_qty"),
+    ("return", "Return", "total_returned_qty"),
+    ("maintenance_return", "Maintenance", "total_maintenance_qty"),
+    ("damaged_return", "Damaged", "total_damaged_qty"),
+)
+TOTAL_LABELS = {
+    "total_delivered_qty": "Total Delivered QTY",
+    "total_returned_qty": "Total Returned QTY",
+    "total_maintenance_qty": "Total Maintenance QTY",
+    "total_damaged_qty": "Total Damaged QTY",
+}
+MRF_CACHE_KEY = "mrf_report"
+# filters that change the result of an order; the cache holds one result per combination
+CACHE_FILTERS = ("movements_per_page", "page", "totals_only")
 
 
 def execute(filters=None):
-    columns, data = [], []
+    filters = frappe._dict(filters or {})
     if not filters.get("sales_order"):
         frappe.throw("Please select a Sales Order")
-    so = frappe.get_doc("Sales Order", filters.get("sales_order"))
+    cache_name, cache_key = get_cache_key(filters)
+    result = frappe.cache.hget(cache_name, cache_key)
+    if not result:
+        result = frappe._dict(zip(("columns", "data", "message"), get_result(filters), strict=True))
+        result.computed_at = now_datetime()
+        frappe.cache.hset(cache_name, cache_key, result)
+    message = f"Computed at {format_datetime(result.computed_at)}"
+    if result.message:
+        message = f"{result.message}<br>{message}"
+    return result.columns, result.data, message
+
+
+def get_cache_key(filters):
+    """Redis hash of a Sales Order's cached results, and the field of the given filters in it"""
+    return (
+        f"{MRF_CACHE_KEY}|{filters.sales_order}",
+        "|".join(cstr(cint(filters.get(fieldname))) for fieldname in CACHE_FILTERS),
+    )
+
+
+def clear_mrf_report_cache(doc, method=None):
+    """Doc event: drop the cached results of the orders a Rental Delivery, Rental Return or Sales Order touches
+
+    Cleared again after commit, so a refresh that ran before the transaction committed cannot leave
+    its stale result behind.
+    """
+    if doc.doctype == "Sales Order":
+        sales_orders = {doc.name}
+    else:
+        sales_orders = {row.sales_order for row in doc.items if row.sales_order}
+    if not sales_orders:
+        return
+
+    def clear():
+        for sales_order in sales_orders:
+            frappe.cache.delete_value(f"{MRF_CACHE_KEY}|{sales_order}")
+
+    clear()
+    frappe.db.after_commit.add(clear)
+
+
+def get_result(filters):
+    so = get_sales_order(filters.get("sales_order"))
     validate_sales_order(so)
-    deliveries_data, deliveries = get_deliveries(so)
-    returns_data, returns, maintenance_returns, damaged_returns = get_returns(so)
-    columns = get_columns(deliveries, returns, maintenance_returns, damaged_returns)
+    vouchers, item_movements = get_movements(so.name)
+    page, message = get_page(vouchers, filters)
+    columns = get_columns(page)
+    visible = {column["fieldname"] for column in columns}
+
     HeaderRow = {"description": so.customer}
     SubHeaderRow = {"description": date_to_user(so.transaction_date)}
-    for d in deliveries:
-        d_id, d_date = d
-        HeaderRow[f"delivery_{frappe.scrub(d_id)}"] = d_id
-        SubHeaderRow[f"delivery_{frappe.scrub(d_id)}"] = date_to_user(d_date)
-    for r in returns:
-        r_id, r_date = r
-        HeaderRow[f"return_{frappe.scrub(r_id)}"] = r_id
-        SubHeaderRow[f"return_{frappe.scrub(r_id)}"] = date_to_user(r_date)
-    for mr in maintenance_returns:
-        mr_id, mr_date = mr
-        HeaderRow[f"maintenance_return_{frappe.scrub(mr_id)}"] = mr_id
-        SubHeaderRow[f"maintenance_return_{frappe.scrub(mr_id)}"] = date_to_user(
-            mr_date
-        )
-    for dr in damaged_returns:
-        dr_id, dr_date = dr
-        HeaderRow[f"damaged_return_{frappe.scrub(dr_id)}"] = dr_id
-        SubHeaderRow[f"damaged_return_{frappe.scrub(dr_id)}"] = date_to_user(dr_date)
-    data.append(HeaderRow)
-    data.append(SubHeaderRow)
-    data.append({})
-    for soi in so.items:
+    for prefix, _, _ in MOVEMENT_TYPES:
+        for _, name, posting_date in page[prefix]:
+            HeaderRow[get_fieldname(prefix, name)] = name
+            SubHeaderRow[get_fieldname(prefix, name)] = date_to_user(posting_date)
+    data = [HeaderRow, SubHeaderRow, {}]
+    for soi in get_sales_order_items(so.name):
+        movements = item_movements.get(soi.item_code, {})
         row = {
             "description": f"{soi.item_code}: {soi.item_name}",
             "order_qty": soi.qty,
-            "balance_return": 0,
-            "balance_delivery": 0,
-            "total_delivered_qty": 0,
-            "total_damaged_qty": 0,
-            "total_returned_qty": 0,
-            "total_maintenance_qty": 0,
         }
-        for dd in deliveries_data:
-            if dd.item_code == soi.item_code:
-                k = f"delivery_{frappe.scrub(dd.name)}"
-                if k not in row:
-                    row[k] = 0
-                row[k] += flt(dd.qty)
-                row["total_delivered_qty"] += flt(dd.qty)
-        for rd in returns_data:
-            if rd.item_code == soi.item_code:
-                if flt(rd.return_qty) > 0:
-                    k = f"return_{frappe.scrub(rd.name)}"
-                    if k not in row:
-                        row[k] = 0
-                    row[k] += flt(rd.return_qty)
-                    row["total_returned_qty"] += flt(rd.return_qty)
-                if flt(rd.maintenance_qty) > 0:
-                    k = f"maintenance_return_{frappe.scrub(rd.name)}"
-                    if k not in row:
-                        row[k] = 0
-                    row[k] += flt(rd.maintenance_qty)
-                    row["total_maintenance_qty"] += flt(rd.maintenance_qty)
-                if flt(rd.damaged_qty) > 0:
-                    k = f"damaged_return_{frappe.scrub(rd.name)}"
-                    if k not in row:
-                        row[k] = 0
-                    row[k] += flt(rd.damaged_qty)
-                    row["total_damaged_qty"] += flt(rd.damaged_qty)
-
+        for _, _, total_field in MOVEMENT_TYPES:
+            row[total_field] = movements.get(total_field, 0)
+        row.update({fieldname: qty for fieldname, qty in movements.items() if fieldname in visible})
         row["balance_delivery"] = row.get("order_qty") - row.get("total_delivered_qty")
         row["balance_return"] = row.get("total_delivered_qty") - (
             row.get("total_returned_qty")
@@ -83,13 +100,36 @@ def execute(filters=None):
             + row.get("total_damaged_qty")
         )
         data.append(row)
-    return columns, data
+    return columns, data, message
 
 
 def date_to_user(date_str):
     return "-".join(reversed(cstr(date_str).split("-")))
 
 
+def get_fieldname(prefix, name):
+    return f"{prefix}_{frappe.scrub(name)}"
+
+
+def get_sales_order(sales_order):
+    """Sales Order header fields, without loading its child tables"""
+    return frappe.db.get_value(
+        "Sales Order",
+        sales_order,
+        ["name", "customer", "transaction_date", "docstatus", "order_type"],
+        as_dict=True,
+    )
+
+
+def get_sales_order_items(sales_order):
+    return frappe.get_all(
+        "Sales Order Item",
+        filters={"parent": sales_order, "parenttype": "Sales Order"},
+        fields=["item_code", "item_name", "qty"],
+        order_by="idx",
+    )
+
+
 def validate_sales_order(so):
     if not so:
         frappe.throw("Sales Order not found")
@@ -99,161 +139,134 @@ def validate_sales_order(so):
         return frappe.throw("Sales Order is not a Rental Order")
 
 
-def get_deliveries(so):
-    ids = []
-    unique_ids = []
-    data = (
-        frappe.db.sql(
-            f"""Select rd.name, rd.posting_date, rdi.item_code, rdi.qty
-	from `tabRental Delivery` rd inner join `tabRental Delivery Item` rdi on rd.name = rdi.parent  
-	where rd.docstatus = 1 and rdi.sales_order = '{so.name}' order by rd.posting_date """,
-            as_dict=1,
-        )
-        or []
-    )
-    for d in data:
-        if d.name not in unique_ids:
-            unique_ids.append(d.name) 
-            ids.append([d.name, d.posting_date])
-    return data, ids
-
-
-def get_returns(so):
-    return_unique_ids = []
-    maintenance_unique_ids = []
-    damaged_unique_ids = []
-    return_ids = []
-    maintenance_ids = []
-    damaged_ids = []
-    data = (
-        frappe.db.sql(
-            f"""Select rr.name, rr.posting_date, rri.item_code, rri.return_qty, rri.maintenance_qty, rri.damaged_qty
-	from `tabRental Return` rr inner join `tabRental Return Item` rri on rr.name = rri.parent  
-	where rr.docstatus = 1 and rri.sales_order = '{so.name}' order by rr.posting_date """,
-            as_dict=1,
-        )
-        or []
-    )
-    for d in data:
-        if d.name not in return_unique_ids and flt(d.return_qty) > 0:
-            return_unique_ids.append(d.name)
-            return_ids.append([d.name, d.posting_date])
-        if d.name not in maintenance_unique_ids and flt(d.maintenance_qty) > 0:
-            maintenance_unique_ids.append(d.name)
-            maintenance_ids.append([d.name, d.posting_date])
-        if d.name not in damaged_unique_ids and flt(d.damaged_qty) > 0:
-            damaged_unique_ids.append(d.name)
-            damaged_ids.append([d.name, d.posting_date])
-    return data, return_ids, maintenance_ids, damaged_ids
-
-
-def get_columns(deliveries, returns, maintenance_returns, damaged_returns):
-    columns = [
-        {
-            "fieldname": "art",
-            "label": "Art #",
-            "fieldtype": "Data",
-            "width": 100,
-        },
-        {
-            "fieldname": "description",
-            "label": "Description",
-            "fieldtype": "Data",
-            "width": 200,
-        },
-        {
-            "fieldname": "order_qty",
-            "label": "Order QTY",
-            "fieldtype": "Data",
-            "width": 150,
-        },
-    ]
-    for idx, delivery in enumerate(deliveries):
-        idxxx = idx + 1
-        columns.append(
-            {
-                "fieldname": f"delivery_{frappe.scrub(delivery[0])}",
-                "label": f"Delivery {idxxx}",
-                "fieldtype": "Data",
-                "width": 150,
-            }
-        )
-    columns.append(
-        {
-            "fieldname": "total_delivered_qty",
-            "label": "Total Delivered QTY",
-            "fieldtype": "Data",
-            "width": 150,
-        }
-    )
-    columns.append(
-        {
-            "fieldname": "balance_delivery",
-            "label": "Balance for Delivery",
-            "fieldtype": "Data",
-            "width": 150,
-        }
+def get_movements(sales_order):
+    """Movement vouchers of the order and the per item quantities, indexed in a single pass
+
+    Returns ({prefix: {voucher: posting_date}}, {item_code: {fieldname: qty}}). The voucher dicts keep
+    the posting date order of the queries, and each item holds its qty per voucher column and its totals.
+    """
+    vouchers = {prefix: {} for prefix, _, _ in MOVEMENT_TYPES}
+    item_movements = defaultdict(lambda: defaultdict(float))
+
+    def add_movement(prefix, total_field, d, qty):
+        vouchers[prefix].setdefault(d.name, d.posting_date)
+        movements = item_movements[d.item_code]
+        movements[get_fieldname(prefix, d.name)] += qty
+        movements[total_field] += qty
+
+    for d in get_deliveries(sales_order):
+        add_movement("delivery", "total_delivered_qty", d, flt(d.qty))
+    for d in get_returns(sales_order):
+        if flt(d.return_qty) > 0:
+            add_movement("return", "total_returned_qty", d, flt(d.return_qty))
+        if flt(d.maintenance_qty) > 0:
+            add_movement("maintenance_return", "total_maintenance_qty", d, flt(d.maintenance_qty))
+        if flt(d.damaged_qty) > 0:
+            add_movement("damaged_return", "total_damaged_qty", d, flt(d.damaged_qty))
+    return vouchers, item_movements
+
+
+def get_deliveries(sales_order):
+    return frappe.db.sql(
+        """Select rd.name, rd.posting_date, rdi.item_code, sum(rdi.qty) as qty
+	from `tabRental Delivery` rd inner join `tabRental Delivery Item` rdi on rd.name = rdi.parent
+	where rd.docstatus = 1 and rdi.sales_order = %s
+	group by rd.name, rd.posting_date, rdi.item_code
+	order by rd.posting_date, rd.name""",
+        sales_order,
+        as_dict=1,
     )
-    for idx, _return in enumerate(returns):
-        idxxx = idx + 1
-        columns.append(
-            {
-                "fieldname": f"return_{frappe.scrub(_return[0])}",
-                "label": f"Return {idxxx}",
-                "fieldtype": "Data",
-                "width": 150,
-            }
-        )
-    columns.append(
-        {
-            "fieldname": "total_returned_qty",
-            "label": "Total Returned QTY",
-            "fieldtype": "Data",
-            "width": 150,
-        }
+
+
+def get_returns(sales_order):
+    return frappe.db.sql(
+        """Select rr.name, rr.posting_date, rri.item_code, sum(rri.return_qty) as return_qty,
+	sum(rri.maintenance_qty) as maintenance_qty, sum(rri.damaged_qty) as damaged_qty
+	from `tabRental Return` rr inner join `tabRental Return Item` rri on rr.name = rri.parent
+	where rr.docstatus = 1 and rri.sales_order = %s
+	group by rr.name, rr.posting_date, rri.item_code
+	order by rr.posting_date, rr.name""",
+        sales_order,
+        as_dict=1,
     )
-    for idx, maintenance_return in enumerate(maintenance_returns):
-        idxxx = idx + 1
-        columns.append(
-            {
-                "fieldname": f"maintenance_return_{frappe.scrub(maintenance_return[0])}",
-                "label": f"Maintenance {idxxx}",
+
+
+def get_page(vouchers, filters):
+    """Movement columns to show, {prefix: [(number, voucher, posting_date)]}, and a paging message
+
+    With Movements per Page set, page n shows the nth slice of every movement group, so a large order
+    is browsed a few columns at a time while the totals and balances still cover all movements.
+    """
+    per_page = cint(filters.get("movements_per_page"))
+    if cint(filters.get("totals_only")):
+        return {prefix: [] for prefix in vouchers}, None
+    if per_page <= 0:
+        start, end = 0, None
+    else:
+        start = (max(cint(filters.get("page")), 1) - 1) * per_page
+        end = start + per_page
+    page = {
+        prefix: [
+            (number, name, posting_date)
+            for number, (name, posting_date) in enumerate(list(vouchers[prefix].items())[start:end], start + 1)
+        ]
+        for prefix in vouchers
+    }
+    message = None
+    if per_page > 0:
+        pages = max(1, *((len(group) + per_page - 1) // per_page for group in vouchers.values()))
+        message = f"Page {start // per_page + 1} of {pages}: movements {start + 1} to {end} of each type"
+    return page, message
+
+
+def get_columns(page):
+    return list(iter_columns(page))
+
+
+def iter_columns(page):
+    """Column metadata, built only for the movement columns on the page"""
+    yield {
+        "fieldname": "art",
+        "label": "Art #",
+        "fieldtype": "Data",
+        "width": 100,
+    }
+    yield {
+        "fieldname": "description",
+        "label": "Description",
+        "fieldtype": "Data",
+        "width": 200,
+    }
+    yield {
+        "fieldname": "order_qty",
+        "label": "Order QTY",
+        "fieldtype": "Data",
+        "width": 150,
+    }
+    for prefix, label, total_field in MOVEMENT_TYPES:
+        for number, name, _ in page[prefix]:
+            yield {
+                "fieldname": get_fieldname(prefix, name),
+                "label": f"{label} {number}",
                 "fieldtype": "Data",
                 "width": 150,
             }
-        )
-    columns.append(
-        {
-            "fieldname": "total_maintenance_qty",
-            "label": "Total Maintenance QTY",
+        yield {
+            "fieldname": total_field,
+            "label": TOTAL_LABELS[total_field],
             "fieldtype": "Data",
             "width": 150,
         }
-    )
-    for idx, damaged_return in enumerate(damaged_returns):
-        idxxx = idx + 1
-        columns.append(
-            {
-                "fieldname": f"damaged_return_{frappe.scrub(damaged_return[0])}",
-                "label": f"Damaged {idxxx}",
+        if prefix == "delivery":
+            yield {
+                "fieldname": "balance_delivery",
+                "label": "Balance for Delivery",
                 "fieldtype": "Data",
                 "width": 150,
             }
-        )
-    columns.append(
-        {
-            "fieldname": "total_damaged_qty",
-            "label": "Total Damaged QTY",
-            "fieldtype": "Data",
-            "width": 150,
-        }
-    )
-    columns.append(
-        {
-            "fieldname": "balance_return",
-            "label": "Balance for Return",
-            "fieldtype": "Data",
-            "width": 150,
-        }
-    )
-    return columns
+    yield {
+        "fieldname": "balance_return",
+        "label": "Balance for Return",
+        "fieldtype": "Data",
+        "width": 150,
+    }
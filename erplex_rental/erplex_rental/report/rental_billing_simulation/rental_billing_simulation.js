@@ -0,0 +1,65 @@
+// Copyright (c) 2025, ERPlexSolutions and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Rental Billing Simulation"] = {
+	"filters": [
+		{
+			"fieldname": "company",
+			"label": __("Company"),
+			"fieldtype": "Link",
+			"options": "Company",
+			"reqd": 1,
+			"default": frappe.defaults.get_user_default("Company")
+		},
+		{
+			"fieldname": "from_date",
+			"label": __("From Date"),
+			"fieldtype": "Date",
+			"reqd": 1,
+			"default": frappe.datetime.month_start(frappe.datetime.add_months(frappe.datetime.get_today(), -1))
+		},
+		{
+			"fieldname": "to_date",
+			"label": __("To Date"),
+			"fieldtype": "Date",
+			"reqd": 1,
+			"default": frappe.datetime.month_start(frappe.datetime.get_today())
+		},
+		{
+			"fieldname": "customer",
+			"label": __("Customer"),
+			"fieldtype": "Link",
+			"options": "Customer"
+		},
+		{
+			"fieldname": "group_by",
+			"label": __("Group By"),
+			"fieldtype": "Select",
+			"options": "Sales Order\nCustomer\nCompany",
+			"default": "Sales Order"
+		},
+		{
+			"fieldname": "days_per_month",
+			"label": __("Days per Month"),
+			"fieldtype": "Float",
+			"default": 30
+		},
+		{
+			"fieldname": "minimum_days",
+			"label": __("Minimum Days"),
+			"fieldtype": "Int"
+		},
+		{
+			"fieldname": "weekly_rate",
+			"label": __("Weekly Rate (x Monthly Rate)"),
+			"fieldtype": "Float"
+		}
+	],
+	"formatter": function(value, row, column, data, default_formatter) {
+		value = default_formatter(value, row, column, data);
+		if (column.fieldname == "difference" && data && data.difference) {
+			value = "<span style='color:" + (data.difference < 0 ? "red" : "green") + "'>" + value + "</span>";
+		}
+		return value;
+	}
+};
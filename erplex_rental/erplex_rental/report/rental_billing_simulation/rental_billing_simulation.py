@@ -0,0 +1,107 @@
+# Copyright (c) 2025, ERPlexSolutions and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.utils import flt
+
+from erplex_rental.billing_simulation import run_billing_simulation
+
+AMOUNT_FIELDS = ("billed_amount", "current_amount", "simulated_amount", "difference")
+
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    result = run_billing_simulation(filters)
+    group_by = filters.get("group_by") or "Sales Order"
+    data = {"Customer": result.customers, "Company": result.companies}.get(group_by, result.orders)
+    return get_columns(group_by), data, get_message(result), None, get_report_summary(result)
+
+
+def get_message(result):
+    pricing = result.pricing
+    message = f"Simulated {result.from_date} to {result.to_date}, per-day rate = monthly rate / {flt(pricing.days_per_month)}"
+    if pricing.minimum_days:
+        message += f", at least {pricing.minimum_days} days of the peak qty on rent"
+    if pricing.weekly_rate:
+        message += f", billed in whole weeks at {flt(pricing.weekly_rate)} x monthly rate"
+    return message + ". No documents are created."
+
+
+def get_report_summary(result):
+    """Order count and the amount totals of each currency, never added up across currencies"""
+    totals = {}
+    for row in result.companies:
+        currency_totals = totals.setdefault(row.currency, dict.fromkeys(AMOUNT_FIELDS, 0))
+        for field in AMOUNT_FIELDS:
+            currency_totals[field] = flt(currency_totals[field] + row[field], 2)
+    summary = [{"value": len(result.orders), "label": "Orders", "datatype": "Int"}]
+    for currency in sorted(totals, key=lambda currency: currency or ""):
+        suffix = f" ({currency})" if len(totals) > 1 else ""
+        for field, label in (
+            ("billed_amount", "Billed"),
+            ("current_amount", "Current Pricing"),
+            ("simulated_amount", "Simulated"),
+            ("difference", "Difference"),
+        ):
+            value = totals[currency][field]
+            entry = {"value": value, "label": label + suffix, "datatype": "Currency", "currency": currency}
+            if field == "difference":
+                entry["indicator"] = "Red" if value < 0 else "Green"
+            summary.append(entry)
+    return summary
+
+
+def get_columns(group_by):
+    columns = [
+        {
+            "fieldname": "company",
+            "label": "Company",
+            "fieldtype": "Link",
+            "options": "Company",
+            "width": 160,
+        },
+    ]
+    if group_by != "Company":
+        columns.append(
+            {
+                "fieldname": "customer",
+                "label": "Customer",
+                "fieldtype": "Link",
+                "options": "Customer",
+                "width": 160,
+            }
+        )
+    if group_by == "Sales Order":
+        columns.insert(
+            0,
+            {
+                "fieldname": "sales_order",
+                "label": "Sales Order",
+                "fieldtype": "Link",
+                "options": "Sales Order",
+                "width": 160,
+            },
+        )
+        columns.append({"fieldname": "lines", "label": "Simulated Lines", "fieldtype": "Int", "width": 100})
+    else:
+        columns.append({"fieldname": "orders", "label": "Orders", "fieldtype": "Int", "width": 100})
+    columns += [
+        {"fieldname": "currency", "label": "Currency", "fieldtype": "Link", "options": "Currency", "hidden": 1},
+        {"fieldname": "qty_days", "label": "Qty Days", "fieldtype": "Float", "width": 120},
+    ]
+    for fieldname, label in (
+        ("billed_amount", "Billed Amount"),
+        ("current_amount", "Current Pricing"),
+        ("simulated_amount", "Simulated Amount"),
+        ("difference", "Difference"),
+    ):
+        columns.append(
+            {
+                "fieldname": fieldname,
+                "label": label,
+                "fieldtype": "Currency",
+                "options": "currency",
+                "width": 140,
+            }
+        )
+    return columns
@@ -0,0 +1,72 @@
+// Copyright (c) 2025, ERPlexSolutions and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Rental Position"] = {
+	"filters": [
+		{
+			"fieldname": "company",
+			"label": __("Company"),
+			"fieldtype": "Link",
+			"options": "Company",
+			"reqd": 1,
+			"default": frappe.defaults.get_user_default("Company")
+		},
+		{
+			"fieldname": "as_on_date",
+			"label": __("As On Date"),
+			"fieldtype": "Date",
+			"reqd": 1,
+			"default": frappe.datetime.get_today()
+		},
+		{
+			"fieldname": "customer",
+			"label": __("Customer"),
+			"fieldtype": "Link",
+			"options": "Customer"
+		},
+		{
+			"fieldname": "project",
+			"label": __("Project"),
+			"fieldtype": "Link",
+			"options": "Project"
+		},
+		{
+			"fieldname": "sales_order",
+			"label": __("Sales Order"),
+			"fieldtype": "Link",
+			"options": "Sales Order",
+			"get_query": function() {
+				return {
+					filters: {
+						"docstatus": 1,
+						"company": frappe.query_report.get_filter_value("company"),
+						"order_type": "Rental",
+					}
+				};
+			}
+		},
+		{
+			"fieldname": "open_orders_only",
+			"label": __("Open Orders Only"),
+			"fieldtype": "Check",
+			"default": 1
+		},
+		{
+			"fieldname": "on_rent_only",
+			"label": __("On Rent Only"),
+			"fieldtype": "Check"
+		},
+		{
+			"fieldname": "order_subtotals",
+			"label": __("Subtotal per Order"),
+			"fieldtype": "Check"
+		}
+	],
+	"formatter": function(value, row, column, data, default_formatter) {
+		value = default_formatter(value, row, column, data);
+		if (data && data.is_total_row) {
+			value = "<b>" + value + "</b>";
+		}
+		return value;
+	}
+};
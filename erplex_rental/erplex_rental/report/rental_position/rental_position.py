@@ -0,0 +1,175 @@
+# Copyright (c) 2025, ERPlexSolutions and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.utils import cint, flt, getdate, today
+
+from erplex_rental.item_cache import get_item_attributes
+
+QTY_FIELDS = (
+    "order_qty",
+    "delivered_qty",
+    "balance_delivery",
+    "returned_qty",
+    "maintenance_qty",
+    "damaged_qty",
+    "balance_qty",
+)
+
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    filters.as_on_date = getdate(filters.get("as_on_date") or today())
+    return get_columns(filters), get_data(filters)
+
+
+def get_order_conditions(filters):
+    """Sales Order conditions shared by the grouped queries, so no order list is ever passed around"""
+    conds = " so.docstatus = 1 and so.order_type = 'Rental' and so.company = %(company)s "
+    if filters.get("customer"):
+        conds += " and so.customer = %(customer)s "
+    if filters.get("project"):
+        conds += " and so.project = %(project)s "
+    if filters.get("sales_order"):
+        conds += " and so.name = %(sales_order)s "
+    if cint(filters.get("open_orders_only")):
+        conds += " and so.status not in ('Completed', 'Closed') "
+    return conds
+
+
+def get_positions(filters):
+    """Ordered, delivered and returned qty per (sales_order, item_code), from three grouped queries"""
+    conds = get_order_conditions(filters)
+    positions = {}
+    for row in frappe.db.sql(
+        f"""Select so.name as sales_order, so.customer, so.project, soi.item_code, SUM(soi.qty) as order_qty
+    from `tabSales Order` so inner join `tabSales Order Item` soi on soi.parent = so.name
+    where {conds}
+    group by so.name, so.customer, so.project, soi.item_code
+    order by so.customer, so.name, MIN(soi.idx)""",
+        filters,
+        as_dict=True,
+    ):
+        positions[(row.sales_order, row.item_code)] = row
+
+    for row in frappe.db.sql(
+        f"""Select rdi.sales_order, rdi.item_code, SUM(rdi.qty) as delivered_qty
+    from `tabRental Delivery` rd inner join `tabRental Delivery Item` rdi on rdi.parent = rd.name
+    inner join `tabSales Order` so on so.name = rdi.sales_order
+    where rd.docstatus = 1 and rd.posting_date <= %(as_on_date)s and {conds}
+    group by rdi.sales_order, rdi.item_code""",
+        filters,
+        as_dict=True,
+    ):
+        if (row.sales_order, row.item_code) in positions:
+            positions[(row.sales_order, row.item_code)].delivered_qty = flt(row.delivered_qty)
+
+    for row in frappe.db.sql(
+        f"""Select rri.sales_order, rri.item_code, SUM(rri.return_qty) as returned_qty,
+        SUM(rri.maintenance_qty) as maintenance_qty, SUM(rri.damaged_qty) as damaged_qty
+    from `tabRental Return` rr inner join `tabRental Return Item` rri on rri.parent = rr.name
+    inner join `tabSales Order` so on so.name = rri.sales_order
+    where rr.docstatus = 1 and rr.posting_date <= %(as_on_date)s and {conds}
+    group by rri.sales_order, rri.item_code""",
+        filters,
+        as_dict=True,
+    ):
+        if (row.sales_order, row.item_code) in positions:
+            positions[(row.sales_order, row.item_code)].update(
+                returned_qty=flt(row.returned_qty),
+                maintenance_qty=flt(row.maintenance_qty),
+                damaged_qty=flt(row.damaged_qty),
+            )
+    return positions
+
+
+def get_data(filters):
+    positions = get_positions(filters)
+    items = get_item_attributes(item_code for _, item_code in positions)
+    data, subtotal, total = [], None, get_total_row("Total")
+    for row in positions.values():
+        row.item_name = (items.get(row.item_code) or {}).get("item_name")
+        for field in ("delivered_qty", "returned_qty", "maintenance_qty", "damaged_qty"):
+            row[field] = flt(row.get(field))
+        row.order_qty = flt(row.order_qty)
+        row.balance_delivery = row.order_qty - row.delivered_qty
+        row.balance_qty = row.delivered_qty - row.returned_qty - row.maintenance_qty - row.damaged_qty
+        if cint(filters.get("on_rent_only")) and not row.balance_qty:
+            continue
+
+        if cint(filters.get("order_subtotals")) and (not subtotal or subtotal.sales_order != row.sales_order):
+            if subtotal:
+                data.append(subtotal)
+            subtotal = get_total_row(f"Total {row.sales_order}", row.sales_order)
+        data.append(row)
+        for field in QTY_FIELDS:
+            total[field] += row[field]
+            if subtotal:
+                subtotal[field] += row[field]
+    if subtotal:
+        data.append(subtotal)
+    if data:
+        data.append(total)
+    return data
+
+
+def get_total_row(label, sales_order=None):
+    row = frappe._dict({field: 0 for field in QTY_FIELDS})
+    row.update(item_code=label, sales_order=sales_order, is_total_row=1)
+    return row
+
+
+def get_columns(filters):
+    columns = [
+        {
+            "fieldname": "sales_order",
+            "label": "Sales Order",
+            "fieldtype": "Link",
+            "options": "Sales Order",
+            "width": 160,
+        },
+        {
+            "fieldname": "customer",
+            "label": "Customer",
+            "fieldtype": "Link",
+            "options": "Customer",
+            "width": 160,
+        },
+        {
+            "fieldname": "project",
+            "label": "Project",
+            "fieldtype": "Link",
+            "options": "Project",
+            "width": 120,
+        },
+        {
+            "fieldname": "item_code",
+            "label": "Item",
+            "fieldtype": "Data",
+            "width": 140,
+        },
+        {
+            "fieldname": "item_name",
+            "label": "Item Name",
+            "fieldtype": "Data",
+            "width": 180,
+        },
+    ]
+    for fieldname, label in (
+        ("order_qty", "Order QTY"),
+        ("delivered_qty", "Delivered QTY"),
+        ("balance_delivery", "Balance for Delivery"),
+        ("returned_qty", "Returned QTY"),
+        ("maintenance_qty", "Maintenance QTY"),
+        ("damaged_qty", "Damaged QTY"),
+        ("balance_qty", "On Rent QTY"),
+    ):
+        columns.append(
+            {
+                "fieldname": fieldname,
+                "label": label,
+                "fieldtype": "Float",
+                "width": 120,
+            }
+        )
+    return columns
@@ -28,7 +28,8 @@ app_license = "mit"
 
 # include js in doctype views
 doctype_js = {
-    "Sales Order": "public/js/sales_order.js",
+    "Sales Order": ["public/js/sales_order.js", "public/js/rental_availability.js"],
+    "Quotation": ["public/js/quotation.js", "public/js/rental_availability.js"],
     "Request for Quotation": "public/js/purchase_common.js",
     "Supplier Quotation": "public/js/purchase_common.js",
     "Purchase Order": "public/js/purchase_common.js",
@@ -115,10 +116,30 @@ doc_events = {
     "Sales Invoice": {
         "validate": "erplex_rental.main.sales_invoice_validate",
         "on_submit": "erplex_rental.main.sales_invoice_on_submit",
-        "on_cancel": "erplex_rental.main.sales_invoice_on_cancel",
+        "on_cancel": [
+            "erplex_rental.main.sales_invoice_on_cancel",
+            "erplex_rental.pdf_cache.clear_document_pdfs",
+            "erplex_rental.daily_accrual.release_invoice_accruals",
+        ],
+        "on_update_after_submit": "erplex_rental.pdf_cache.clear_document_pdfs",
+        "on_trash": "erplex_rental.daily_accrual.release_invoice_accruals",
+    },
+    "Delivery Note": {
+        "on_cancel": "erplex_rental.pdf_cache.clear_document_pdfs",
+        "on_update_after_submit": "erplex_rental.pdf_cache.clear_document_pdfs",
     },
     "Sales Order": {
         "validate": "erplex_rental.main.sales_order_validate",
+        "on_cancel": "erplex_rental.erplex_rental.report.mrf_report.mrf_report.clear_mrf_report_cache",
+        "on_update_after_submit": "erplex_rental.erplex_rental.report.mrf_report.mrf_report.clear_mrf_report_cache",
+    },
+    "Rental Delivery": {
+        "on_submit": "erplex_rental.erplex_rental.report.mrf_report.mrf_report.clear_mrf_report_cache",
+        "on_cancel": "erplex_rental.erplex_rental.report.mrf_report.mrf_report.clear_mrf_report_cache",
+    },
+    "Rental Return": {
+        "on_submit": "erplex_rental.erplex_rental.report.mrf_report.mrf_report.clear_mrf_report_cache",
+        "on_cancel": "erplex_rental.erplex_rental.report.mrf_report.mrf_report.clear_mrf_report_cache",
     },
     "Supplier Quotation": {
         "validate": "erplex_rental.main.supplier_quotation_validate",
@@ -128,16 +149,42 @@ doc_events = {
     },
     "Purchase Receipt": {
         "validate": "erplex_rental.main.purchase_receipt_validate",
+        "on_cancel": "erplex_rental.pdf_cache.clear_document_pdfs",
+        "on_update_after_submit": "erplex_rental.pdf_cache.clear_document_pdfs",
     },
     "Purchase Invoice": {
         "validate": "erplex_rental.main.purchase_invoice_validate",
     },
+    "Item": {
+        "on_update": "erplex_rental.item_cache.clear_item_cache",
+        "on_trash": "erplex_rental.item_cache.clear_item_cache",
+        "after_rename": "erplex_rental.item_cache.clear_item_cache",
+    },
+    "Print Format": {
+        "on_update": "erplex_rental.pdf_cache.clear_print_format_pdfs",
+        "on_trash": "erplex_rental.pdf_cache.clear_print_format_pdfs",
+    },
 }
 
+# Boot
+# ----
+
+boot_session = "erplex_rental.erplex_rental.doctype.rental_settings.rental_settings.warm_defaults_cache"
+
 # Scheduled Tasks
 # ---------------
 
-scheduler_events = {"monthly": ["erplex_rental.utils.create_monthly_rental_invoice"]}
+scheduler_events = {
+    "daily": [
+        "erplex_rental.rental_ledger.build_rental_snapshots",
+        "erplex_rental.daily_accrual.accrue_daily_rentals",
+        "erplex_rental.pdf_cache.evict_pdf_cache",
+    ],
+    "monthly": [
+        "erplex_rental.billing.enqueue_monthly_rental_billing",
+        "erplex_rental.purchase_billing.enqueue_monthly_rental_purchase_billing",
+    ],
+}
 
 # Testing
 # -------
@@ -147,9 +194,9 @@ scheduler_events = {"monthly": ["erplex_rental.utils.create_monthly_rental_invoi
 # Overriding Methods
 # ------------------------------
 #
-# override_whitelisted_methods = {
-# 	"frappe.desk.doctype.event.event.get_events": "erplex_rental.event.get_events"
-# }
+override_whitelisted_methods = {
+    "frappe.utils.print_format.download_pdf": "erplex_rental.pdf_cache.download_pdf"
+}
 #
 # each overriding function accepts a `data` argument;
 # generated from the base implementation of the doctype dashboard,
@@ -166,6 +213,7 @@ scheduler_events = {"monthly": ["erplex_rental.utils.create_monthly_rental_invoi
 # -----------------------------------------------------------
 
 # ignore_links_on_delete = ["Communication", "ToDo"]
+ignore_links_on_delete = ["Rental Billing Run", "Rental Accrual", "Rental Purchase Billing Run"]
 
 # Request Events
 # ----------------
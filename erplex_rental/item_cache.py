@@ -0,0 +1,39 @@
+import frappe
+from frappe.utils import flt
+
+ITEM_CACHE_KEY = "rental_item_attributes"
+ITEM_CACHE_FIELDS = ("item_name", "description", "custom_maintenance_charge", "custom_damage_charge")
+
+
+def get_item_attributes(item_codes):
+    """Item master fields used by the rental doctypes, {item_code: attributes} for the given item codes
+
+    Cached items are read through the cache wrapper, which keeps them for the rest of the request,
+    and the rest come from one Item query, so a long document costs one query like a short one.
+    """
+    item_codes = list({item_code for item_code in item_codes if item_code})
+    if not item_codes:
+        return {}
+    attributes = {}
+    for item_code in item_codes:
+        cached = frappe.cache.hget(ITEM_CACHE_KEY, item_code)
+        if cached is not None:
+            attributes[item_code] = cached
+    missing = [item_code for item_code in item_codes if item_code not in attributes]
+    if missing:
+        for item in frappe.get_all(
+            "Item", filters={"name": ["in", missing]}, fields=["name", *ITEM_CACHE_FIELDS]
+        ):
+            item_code = item.pop("name")
+            item.custom_maintenance_charge = flt(item.custom_maintenance_charge)
+            item.custom_damage_charge = flt(item.custom_damage_charge)
+            attributes[item_code] = item
+            frappe.cache.hset(ITEM_CACHE_KEY, item_code, item)
+    return attributes
+
+
+def clear_item_cache(doc, method=None, old_name=None, *args):
+    """Item doc event: drop the cached attributes of the item (and of its old name on rename)"""
+    frappe.cache.hdel(ITEM_CACHE_KEY, doc.name)
+    if old_name:
+        frappe.cache.hdel(ITEM_CACHE_KEY, old_name)
@@ -1,23 +1,29 @@
 import frappe
-from frappe.utils import flt
+from frappe.utils import flt, getdate
+from erplex_rental.billing import (
+    enqueue_completed_rental_invoice,
+    get_billing_settings,
+    get_consolidation_keys,
+)
 from erplex_rental.utils import (
-    update_last_billed_date_in_so,
+    update_last_billed_dates_in_so,
     get_total_returned_qty,
     get_total_delivered_qty,
     get_last_billed_date,
     get_total_deposit_used,
-    create_unbilled_completed_rental_invoices,
     get_last_rental_return,
 )
+from erplex_rental.recompute import queue_recompute
+from erplex_rental.billing_queue import queue_rental_billing
 
 
 def update_so(so_name):
+    """Recompute the rental counters of a Sales Order from its submitted vouchers (repair tool)"""
     so = frappe.get_doc("Sales Order", so_name)
     so.custom_last_billed_date = get_last_billed_date(so_name)
     so.custom_remaining_security_deposit = flt(so.custom_security_deposit) - flt(
         get_total_deposit_used(so_name)
     )
-    so.status = "To Deliver"
     for soi in so.items:
         custom_rental_delivered_qty = get_total_delivered_qty(so.name, soi.name)
         if custom_rental_delivered_qty > soi.qty:
@@ -36,36 +42,143 @@ def update_so(so_name):
             )
         soi.custom_rental_returned_qty = custom_rental_returned_qty
         soi.db_update()
-    so.custom_all_rental_delivered = all(
-        soi.custom_rental_delivered_qty == soi.qty for soi in so.items
-    )
-    if so.custom_all_rental_delivered:
-        so.status = "To Bill"
-        if sum(soi.custom_rental_returned_qty for soi in so.items) == so.total_qty:
-            so.status = "Completed"
     so.db_update()
-    if so.status == "Completed":
-        create_unbilled_completed_rental_invoices(so.name)
+    update_so_status(so_name)
+
+
+def get_voucher_deltas(doc, cancel=False):
+    """Signed delivered / returned qty per Sales Order Item and deposit used, per Sales Order of a Rental Delivery or Rental Return"""
+    sign = -1 if cancel else 1
+    orders = {}
+    for row in doc.items:
+        order = orders.setdefault(row.sales_order, frappe._dict(rows={}, deposit_used=0))
+        delta = order.rows.setdefault(
+            row.sales_order_detail, frappe._dict(delivered_qty=0, returned_qty=0)
+        )
+        if doc.doctype == "Rental Delivery":
+            delta.delivered_qty += sign * flt(row.qty)
+        else:
+            delta.returned_qty += sign * (
+                flt(row.return_qty) + flt(row.maintenance_qty) + flt(row.damaged_qty)
+            )
+            order.deposit_used += sign * (flt(row.maintenance_amount) + flt(row.damaged_amount))
+    return orders
+
+
+def update_so_from_voucher(doc, cancel=False):
+    """Apply the movements of a submitted / cancelled Rental Delivery or Rental Return to its Sales Orders"""
+    for so_name, order in get_voucher_deltas(doc, cancel).items():
+        apply_so_deltas(so_name, order.rows, order.deposit_used)
+
+
+def apply_so_deltas(so_name, deltas, deposit_used=0):
+    """Add signed delivered / returned qty to the affected Sales Order Items under a row lock"""
+    so = frappe.db.sql(
+        """Select name, custom_remaining_security_deposit from `tabSales Order` where name = %s for update""",
+        so_name,
+        as_dict=True,
+    )[0]
+    items = frappe.db.sql(
+        """Select name, qty, custom_rental_delivered_qty, custom_rental_returned_qty
+    from `tabSales Order Item` where parent = %s and name in %s for update""",
+        (so_name, tuple(deltas)),
+        as_dict=True,
+    )
+    for soi in items:
+        delta = deltas[soi.name]
+        custom_rental_delivered_qty = flt(soi.custom_rental_delivered_qty) + delta.delivered_qty
+        if custom_rental_delivered_qty > soi.qty:
+            frappe.throw(
+                f"Cannot Deliver more than Ordered Qty, Total Remaining Qty to Deliver is {soi.qty - flt(soi.custom_rental_delivered_qty)}"
+            )
+        custom_rental_returned_qty = flt(soi.custom_rental_returned_qty) + delta.returned_qty
+        if custom_rental_returned_qty > soi.qty:
+            frappe.throw(
+                f"Cannot Return more than Ordered Qty, Total Remaining Qty to Deliver is {soi.qty - flt(soi.custom_rental_returned_qty)}"
+            )
+        frappe.db.set_value(
+            "Sales Order Item",
+            soi.name,
+            {
+                "custom_rental_delivered_qty": custom_rental_delivered_qty,
+                "custom_rental_returned_qty": custom_rental_returned_qty,
+            },
+            update_modified=False,
+        )
+    if any(delta.delivered_qty > 0 or delta.returned_qty < 0 for delta in deltas.values()):
+        # stock went (back) on rent, so the order has to be billed from now on
+        queue_rental_billing([so_name], "On Rent", advance=False)
+    if deposit_used:
+        frappe.db.set_value(
+            "Sales Order",
+            so_name,
+            "custom_remaining_security_deposit",
+            flt(so.custom_remaining_security_deposit) - deposit_used,
+            update_modified=False,
+        )
+    queue_recompute(sales_orders=[so_name])
+
+
+def update_so_status(so_name):
+    """Set the rental status of a Sales Order from its item counters"""
+    so = frappe.db.sql(
+        """Select so.name, so.total_qty, so.custom_remaining_security_deposit,
+        SUM(soi.custom_rental_delivered_qty != soi.qty) as pending_items,
+        SUM(soi.custom_rental_returned_qty) as returned_qty
+    from `tabSales Order` so inner join `tabSales Order Item` soi on so.name = soi.parent
+    where so.name = %s group by so.name""",
+        so_name,
+        as_dict=True,
+    )[0]
+    custom_all_rental_delivered = not so.pending_items
+    status = "To Deliver"
+    if custom_all_rental_delivered:
+        status = "To Bill"
+        if flt(so.returned_qty) == flt(so.total_qty):
+            status = "Completed"
+    frappe.db.set_value(
+        "Sales Order",
+        so_name,
+        {"status": status, "custom_all_rental_delivered": custom_all_rental_delivered},
+        update_modified=False,
+    )
+    if status == "Completed":
+        queue_rental_billing([so_name], "Completed")
+        enqueue_completed_rental_invoice(so_name)
         frappe.db.set_value(
             "Rental Return",
-            get_last_rental_return(so.name),
+            get_last_rental_return(so_name),
             "total_security_deposit_returned",
             so.custom_remaining_security_deposit,
         )
-    frappe.db.commit()
 
 
-def is_rental_invoice(self):
-    has_rental_order = False
-    for item in self.items:
-        if item.sales_order:
-            order_type = frappe.db.get_value(
-                "Sales Order", item.sales_order, "order_type"
+def get_order_types(doctype, names, fieldname="order_type"):
+    """Order type of the given linked documents, fetched in one query and memoized for the request"""
+    if not hasattr(frappe.local, "rental_order_types"):
+        frappe.local.rental_order_types = {}
+    cache = frappe.local.rental_order_types.setdefault((doctype, fieldname), {})
+    missing = list({name for name in names if name and name not in cache})
+    if missing:
+        cache.update({name: None for name in missing})
+        cache.update(
+            frappe.get_all(
+                doctype, filters={"name": ["in", missing]}, fields=["name", fieldname], as_list=True
             )
-            if order_type == "Rental":
-                has_rental_order = True
-                break
-    return has_rental_order
+        )
+    return {name: cache[name] for name in names if name}
+
+
+def validate_linked_order_types(self, link_field, doctype, label):
+    """All linked documents must have the same Order Type as this document"""
+    order_types = get_order_types(doctype, [row.get(link_field) for row in self.items], "custom_order_type")
+    if any(order_type != self.custom_order_type for order_type in order_types.values()):
+        frappe.throw(f"All {label} must be of the '{self.custom_order_type}' Order Type.")
+
+
+def is_rental_invoice(self):
+    order_types = get_order_types("Sales Order", [item.sales_order for item in self.items])
+    return "Rental" in order_types.values()
 
 
 def sales_invoice_validate(self, method=None):
@@ -74,31 +187,41 @@ def sales_invoice_validate(self, method=None):
         if len(orders) < 1:
             frappe.throw("At least one Sales Order is required for this Rental Invoice")
         if len(orders) > 1:
-            frappe.throw("Rental Invoice cannot have multiple Sales Orders")
+            validate_consolidated_orders(orders)
         if self.update_stock:
             frappe.throw("Stock Update is not allowed for Rental Invoice")
 
 
+def validate_consolidated_orders(orders):
+    """Several Sales Orders may share a Rental Invoice only with consolidated invoicing, and only for one customer and project"""
+    if not get_billing_settings().consolidate:
+        frappe.throw("Rental Invoice cannot have multiple Sales Orders")
+    if len(set(get_consolidation_keys(orders).values())) > 1:
+        frappe.throw(
+            "A consolidated Rental Invoice can only bill Sales Orders of one company, customer, currency and project"
+        )
+
+
 def sales_invoice_on_submit(self, method=None):
     if is_rental_invoice(self):
         orders = list(set([row.sales_order for row in self.items]))
-        update_last_billed_date_in_so(orders[0])
-        update_so(orders[0])
+        update_last_billed_dates_in_so(orders)
+        queue_recompute(sales_orders=orders)
 
 
 def sales_invoice_on_cancel(self, method=None):
     if is_rental_invoice(self):
         orders = list(set([row.sales_order for row in self.items]))
-        last_billed_date = frappe.db.get_value(
-            "Sales Order", orders[0], "custom_last_billed_date"
+        last_billed_dates = frappe.get_all(
+            "Sales Order", filters={"name": ["in", orders]}, pluck="custom_last_billed_date"
         )
-        if last_billed_date:
-            if last_billed_date > self.posting_date:
-                frappe.throw(
-                    "This Sales Invoice cannot be cancelled as this is not the latest Invoice"
-                )
-        update_last_billed_date_in_so(orders[0])
-        update_so(orders[0])
+        if any(date and getdate(date) > getdate(self.posting_date) for date in last_billed_dates):
+            frappe.throw(
+                "This Sales Invoice cannot be cancelled as this is not the latest Invoice"
+            )
+        update_last_billed_dates_in_so(orders)
+        queue_rental_billing(orders, "Invoice Cancelled")
+        queue_recompute(sales_orders=orders)
 
 def sales_order_validate(self, method=None):
     if self.order_type == "Rental":
@@ -110,6 +233,9 @@ def sales_order_validate(self, method=None):
             frappe.throw("Please set Cost Center in Rental Settings")
         self.set_warehouse = data.source_warehouse
         self.cost_center = data.cost_center
+        if self.docstatus == 1 and frappe.db.get_single_value("Rental Settings", "prevent_overbooking"):
+            from erplex_rental.availability import validate_availability
+            validate_availability(self)
 
 
 def set_purchase_rental_defaluts(self):
@@ -124,10 +250,7 @@ def set_purchase_rental_defaluts(self):
         self.cost_center = data.cost_center
 
 def supplier_quotation_validate(self, method=None):
-    for row in self.items:
-        if row.request_for_quotation:
-            if self.custom_order_type != frappe.db.get_value("Request for Quotation", row.request_for_quotation, "custom_order_type"):
-                frappe.throw(f"All Requests for Quotations must be of the '{self.custom_order_type}' Order Type.")
+    validate_linked_order_types(self, "request_for_quotation", "Request for Quotation", "Requests for Quotations")
     if self.custom_order_type == "Rental":
         from erplex_rental.erplex_rental.doctype.rental_settings.rental_settings import get_defaults
         data = get_defaults(self.company)
@@ -137,22 +260,13 @@ def supplier_quotation_validate(self, method=None):
 
 
 def purchase_order_validate(self, method=None):
-    for row in self.items:
-        if row.supplier_quotation:
-            if self.custom_order_type != frappe.db.get_value("Supplier Quotation", row.supplier_quotation, "custom_order_type"):
-                frappe.throw(f"All Supplier Quotations must be of the '{self.custom_order_type}' Order Type.")
+    validate_linked_order_types(self, "supplier_quotation", "Supplier Quotation", "Supplier Quotations")
     set_purchase_rental_defaluts(self)
 
 def purchase_receipt_validate(self, method=None):
-    for row in self.items:
-        if row.purchase_order:
-            if self.custom_order_type != frappe.db.get_value("Purchase Order", row.purchase_order, "custom_order_type"):
-                frappe.throw(f"All Purchase Orders must be of the '{self.custom_order_type}' Order Type.")
+    validate_linked_order_types(self, "purchase_order", "Purchase Order", "Purchase Orders")
     set_purchase_rental_defaluts(self)
 
 def purchase_invoice_validate(self, method=None):
-    for row in self.items:
-        if row.purchase_order:
-            if self.custom_order_type != frappe.db.get_value("Purchase Order", row.purchase_order, "custom_order_type"):
-                frappe.throw(f"All Purchase Orders must be of the '{self.custom_order_type}' Order Type.")
+    validate_linked_order_types(self, "purchase_order", "Purchase Order", "Purchase Orders")
     set_purchase_rental_defaluts(self)
\ No newline at end of file
@@ -0,0 +1,174 @@
+import csv
+import io
+import os
+import tempfile
+
+import frappe
+from frappe.utils import get_datetime, now_datetime
+from werkzeug.wrappers import Response
+
+EXPORT_BATCH_SIZE = 5000
+# rows per XLSX worksheet, below the format's limit of 1,048,576
+XLSX_SHEET_ROWS = 1000000
+XLSX_CHUNK_SIZE = 1024 * 1024
+EXPORT_COLUMNS = (
+    "voucher_type",
+    "voucher_no",
+    "docstatus",
+    "company",
+    "customer",
+    "posting_date",
+    "posting_time",
+    "modified",
+    "voucher_detail_no",
+    "idx",
+    "sales_order",
+    "sales_order_detail",
+    "item_code",
+    "delivered_qty",
+    "return_qty",
+    "maintenance_qty",
+    "damaged_qty",
+    "on_rent_qty",
+)
+# delivered, returned, maintenance and damaged qty columns of each voucher type's item table
+VOUCHER_QTY_COLUMNS = {
+    "Rental Delivery": ("c.qty", "0", "0", "0"),
+    "Rental Return": ("0", "c.return_qty", "c.maintenance_qty", "c.damaged_qty"),
+}
+
+
+def iter_rental_movements(changed_since=None, company=None, batch_size=EXPORT_BATCH_SIZE):
+    """Every Rental Delivery and Rental Return item row as a list of EXPORT_COLUMNS values
+
+    Walks the vouchers by (modified, name) keyset, reading one batch of vouchers and their rows at a
+    time, so memory stays flat however many rows there are. With changed_since only vouchers modified
+    since then are read, cancelled ones included so an incremental load can reverse them.
+    """
+    for voucher_type in VOUCHER_QTY_COLUMNS:
+        yield from iter_voucher_movements(voucher_type, changed_since, company, batch_size)
+
+
+def iter_voucher_movements(voucher_type, changed_since=None, company=None, batch_size=EXPORT_BATCH_SIZE):
+    delivered, returned, maintenance, damaged = VOUCHER_QTY_COLUMNS[voucher_type]
+    conds = " and docstatus in (1, 2) " if changed_since else " and docstatus = 1 "
+    if company:
+        conds += " and company = %(company)s "
+    params = {
+        "company": company,
+        "modified": get_datetime(changed_since) if changed_since else get_datetime("1900-01-01"),
+        "name": "",
+        "batch_size": batch_size,
+    }
+    while True:
+        vouchers = frappe.db.sql(
+            f"""Select name, modified from `tab{voucher_type}`
+        where (modified > %(modified)s or (modified = %(modified)s and name > %(name)s)) {conds}
+        order by modified, name limit %(batch_size)s""",
+            params,
+        )
+        if not vouchers:
+            return
+        yield from frappe.db.sql(
+            f"""Select %(voucher_type)s, p.name, p.docstatus, p.company, p.customer, p.posting_date,
+            p.posting_time, p.modified, c.name, c.idx, c.sales_order, c.sales_order_detail, c.item_code,
+            {delivered}, {returned}, {maintenance}, {damaged},
+            {delivered} - ({returned}) - ({maintenance}) - ({damaged})
+        from `tab{voucher_type}` p inner join `tab{voucher_type} Item` c on c.parent = p.name
+        where p.name in %(vouchers)s
+        order by p.modified, p.name, c.idx""",
+            {"voucher_type": voucher_type, "vouchers": tuple(name for name, _ in vouchers)},
+        )
+        params["name"], params["modified"] = vouchers[-1]
+        if len(vouchers) < batch_size:
+            return
+
+
+def iter_csv(rows):
+    """CSV text of the rows, one chunk per batch of lines"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_xlsx(rows):
+    """XLSX file of the rows, written row by row to a scratch file and then streamed from disk
+
+    Nothing is yielded until the whole workbook is built, so this is for the bench command only;
+    over HTTP a large export would time out before the first byte.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet, sheet_rows = None, XLSX_SHEET_ROWS
+    for row in rows:
+        if sheet_rows == XLSX_SHEET_ROWS:
+            sheet = workbook.create_sheet(f"Movements {len(workbook.worksheets) + 1}")
+            sheet.append(EXPORT_COLUMNS)
+            sheet_rows = 0
+        sheet.append(row)
+        sheet_rows += 1
+    if sheet is None:
+        workbook.create_sheet("Movements 1").append(EXPORT_COLUMNS)
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        workbook.save(path)
+        with open(path, "rb") as f:
+            while chunk := f.read(XLSX_CHUNK_SIZE):
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+def stream_with_site(iter_output, *args):
+    """Run an output generator while the response is sent, on its own connection
+
+    The request's database connection is closed before the response body is iterated, so the
+    generator connects to the site again for as long as it runs.
+    """
+    site, sites_path, user = frappe.local.site, frappe.local.sites_path, frappe.session.user
+
+    def generate():
+        frappe.init(site=site, sites_path=sites_path)
+        frappe.connect()
+        frappe.set_user(user)
+        try:
+            yield from iter_output(*args)
+        finally:
+            frappe.destroy()
+
+    return generate()
+
+
+@frappe.whitelist()
+def export_rental_movements(file_format="CSV", changed_since=None, company=None):
+    """Stream all rental movements (or the ones changed since a timestamp) as a CSV download
+
+    CSV is written batch by batch as the rows are read. XLSX needs the whole workbook before it can
+    be sent, so it is only offered by the `export-rental-movements` bench command.
+    """
+    frappe.has_permission("Rental Delivery", "export", throw=True)
+    frappe.has_permission("Rental Return", "export", throw=True)
+    if file_format != "CSV":
+        frappe.throw("Only CSV can be streamed, use the export-rental-movements bench command for XLSX")
+
+    def iter_output():
+        for chunk in iter_csv(iter_rental_movements(changed_since, company)):
+            yield chunk.encode()
+
+    file_name = f"Rental Movements {now_datetime().strftime('%Y-%m-%d %H%M%S')}.csv"
+    return Response(
+        stream_with_site(iter_output),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{file_name}"'},
+        direct_passthrough=True,
+    )
@@ -0,0 +1,35 @@
+import frappe
+from frappe.utils import getdate
+from frappe.utils.fixtures import sync_fixtures
+
+from erplex_rental.billing import set_rental_statement
+
+
+def execute():
+    """Store the rental statement on invoices billed before it was materialized"""
+    # fixtures are synced after the patches, and the rental period fields come from them
+    sync_fixtures("erplex_rental")
+    invoices = frappe.get_all(
+        "Sales Invoice",
+        filters={"docstatus": 1, "custom_rental_period_from": ["is", "set"]},
+        pluck="name",
+    )
+    for name in invoices:
+        si_doc = frappe.get_doc("Sales Invoice", name)
+        if si_doc.custom_rental_statement:
+            continue
+        lines = [
+            frappe._dict(
+                item_code=row.item_code,
+                sales_order=row.sales_order,
+                so_detail=row.so_detail,
+                rate=row.rate,
+                start_date=getdate(si_doc.custom_rental_period_from),
+            )
+            for row in si_doc.items
+            if row.so_detail
+        ]
+        set_rental_statement(si_doc, lines, si_doc.custom_rental_period_to)
+        for row in si_doc.custom_rental_statement:
+            row.docstatus = si_doc.docstatus
+            row.db_insert()
@@ -0,0 +1,5 @@
+from erplex_rental.billing_queue import rebuild_billing_queue
+
+
+def execute():
+    rebuild_billing_queue()
@@ -0,0 +1,5 @@
+from erplex_rental.rental_ledger import rebuild_rental_ledger
+
+
+def execute():
+    rebuild_rental_ledger()
@@ -0,0 +1,192 @@
+import glob
+import hashlib
+import os
+import shutil
+
+import frappe
+from frappe.translate import print_language
+from frappe.utils import cint, flt
+from frappe.www.printview import validate_print_permission
+
+CACHED_PRINT_FORMATS = ("Rental Invoice", "Delivery Note v1", "Hire Return Note")
+PDF_CACHE_DIR = "rental_pdf_cache"
+PDF_CACHE_SIZE_MB = 500
+PDF_CACHE_STATS_KEY = "rental_pdf_cache_stats"
+PDF_CACHE_BYTES_KEY = "rental_pdf_cache_bytes"
+
+
+def hash_value(*values):
+    return hashlib.sha1("|".join(str(value) for value in values).encode()).hexdigest()
+
+
+def get_cache_dir():
+    return frappe.get_site_path("private", PDF_CACHE_DIR)
+
+
+def get_document_dir(doctype, name):
+    return os.path.join(get_cache_dir(), hash_value(doctype, name))
+
+
+def get_cache_settings():
+    settings = frappe.db.get_value(
+        "Rental Settings", "Rental Settings", ["enable_pdf_cache", "pdf_cache_size_mb"], as_dict=True
+    ) or frappe._dict()
+    return frappe._dict(
+        enabled=cint(settings.enable_pdf_cache),
+        size_mb=cint(settings.pdf_cache_size_mb) or PDF_CACHE_SIZE_MB,
+    )
+
+
+def is_cacheable(doc, print_format):
+    """Only submitted documents printed with the rental print formats never change under the same key"""
+    return doc.docstatus == 1 and print_format in CACHED_PRINT_FORMATS and get_cache_settings().enabled
+
+
+def get_letterhead_hash(doc, letterhead=None, no_letterhead=0):
+    if cint(no_letterhead):
+        return "none"
+    letterhead = letterhead or doc.get("letter_head") or frappe.db.get_value("Letter Head", {"is_default": 1})
+    if not letterhead:
+        return "none"
+    letterhead = frappe.get_cached_doc("Letter Head", letterhead)
+    return hash_value(letterhead.name, letterhead.modified, letterhead.content, letterhead.footer)
+
+
+def get_pdf_path(doc, print_format, letterhead=None, no_letterhead=0):
+    """Cache file of a rendering, addressed by everything that can change its content"""
+    key = hash_value(
+        doc.doctype,
+        doc.name,
+        print_format,
+        frappe.db.get_value("Print Format", print_format, "modified"),
+        doc.modified,
+        get_letterhead_hash(doc, letterhead, no_letterhead),
+        frappe.local.lang,
+    )
+    # the print format hash prefix lets an edited print format drop its files across documents
+    return os.path.join(get_document_dir(doc.doctype, doc.name), f"{hash_value(print_format)}-{key}.pdf")
+
+
+def get_cached_pdf(doc, print_format, letterhead=None, no_letterhead=0):
+    """PDF of a submitted document from the disk cache, rendered and stored on a miss"""
+    path = get_pdf_path(doc, print_format, letterhead, no_letterhead)
+    try:
+        with open(path, "rb") as f:
+            pdf = f.read()
+        # the modification time is the recency used for eviction
+        os.utime(path)
+        count_lookup("hits")
+        return pdf
+    except FileNotFoundError:
+        count_lookup("misses")
+
+    pdf = frappe.get_print(
+        doc.doctype,
+        doc.name,
+        print_format,
+        doc=doc,
+        as_pdf=True,
+        letterhead=letterhead,
+        no_letterhead=no_letterhead,
+    )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{frappe.generate_hash(length=8)}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(pdf)
+    os.replace(tmp_path, path)
+    count_stored_bytes(len(pdf))
+    return pdf
+
+
+def count_stored_bytes(size):
+    """Add a stored PDF to the running cache size and evict in the background once it is over the limit
+
+    The counter only grows between evictions, so removed files are picked up by the next full scan,
+    which runs daily and whenever the counter passes the limit.
+    """
+    total = frappe.cache.incrby(frappe.cache.make_key(PDF_CACHE_BYTES_KEY), size)
+    if total > get_cache_settings().size_mb * 1024 * 1024:
+        frappe.enqueue(
+            "erplex_rental.pdf_cache.evict_pdf_cache",
+            queue="long",
+            job_id="rental_pdf_cache_eviction",
+            deduplicate=True,
+        )
+
+
+def evict_pdf_cache(size_mb=None):
+    """Remove the least recently used PDFs until the cache fits its size limit and reset the size counter"""
+    limit = (size_mb or get_cache_settings().size_mb) * 1024 * 1024
+    files = []
+    for root, _, names in os.walk(get_cache_dir()):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    frappe.cache.set(frappe.cache.make_key(PDF_CACHE_BYTES_KEY), total)
+
+
+def count_lookup(result):
+    frappe.cache.hincrby(frappe.cache.make_key(PDF_CACHE_STATS_KEY), result, 1)
+
+
+@frappe.whitelist()
+def get_pdf_cache_stats():
+    frappe.only_for("System Manager")
+    hits, misses = (
+        cint(value) for value in frappe.cache.hmget(frappe.cache.make_key(PDF_CACHE_STATS_KEY), ["hits", "misses"])
+    )
+    files = glob.glob(os.path.join(get_cache_dir(), "*", "*.pdf"))
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": flt(hits / (hits + misses) * 100, 2) if hits + misses else 0,
+        "files": len(files),
+        "size_mb": flt(sum(os.path.getsize(path) for path in files) / 1024 / 1024, 2),
+    }
+
+
+def clear_document_pdfs(doc, method=None):
+    """Doc event: drop the cached PDFs of a cancelled or updated document"""
+    shutil.rmtree(get_document_dir(doc.doctype, doc.name), ignore_errors=True)
+
+
+def clear_print_format_pdfs(doc, method=None):
+    """Print Format doc event: drop every PDF rendered with the edited print format"""
+    if doc.name not in CACHED_PRINT_FORMATS:
+        return
+    for path in glob.glob(os.path.join(get_cache_dir(), "*", f"{hash_value(doc.name)}-*.pdf")):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+@frappe.whitelist(allow_guest=True)
+def download_pdf(doctype, name, format=None, doc=None, no_letterhead=0, language=None, letterhead=None):
+    """frappe.utils.print_format.download_pdf, served from the PDF cache for submitted rental documents"""
+    from frappe.utils.print_format import download_pdf as render_pdf
+
+    if doc:
+        return render_pdf(doctype, name, format, doc, no_letterhead, language, letterhead)
+    doc = frappe.get_doc(doctype, name)
+    if not is_cacheable(doc, format):
+        return render_pdf(doctype, name, format, doc, no_letterhead, language, letterhead)
+    validate_print_permission(doc)
+    with print_language(language):
+        pdf = get_cached_pdf(doc, format, letterhead, no_letterhead)
+    frappe.local.response.filename = "{name}.pdf".format(name=name.replace(" ", "-").replace("/", "-"))
+    frappe.local.response.filecontent = pdf
+    frappe.local.response.type = "pdf"
@@ -0,0 +1,9 @@
+frappe.ui.form.on('Quotation', {
+    refresh: function (frm) {
+        if (frm.doc.docstatus === 0 && frm.doc.order_type == "Rental") {
+            frm.add_custom_button(__('Check Rental Availability'), function () {
+                show_rental_availability(frm, frm.doc.transaction_date);
+            });
+        }
+    },
+});
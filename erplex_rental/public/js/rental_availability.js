@@ -0,0 +1,48 @@
+function show_rental_availability(frm, from_date) {
+    frappe.db.get_single_value('Rental Settings', 'default_rental_period').then((period) => {
+        let to_date = frappe.datetime.add_days(frappe.datetime.add_months(from_date, cint(period) || 1), -1);
+        frappe.prompt([
+            { fieldname: 'from_date', label: __('From Date'), fieldtype: 'Date', reqd: 1, default: from_date },
+            { fieldname: 'to_date', label: __('Rental End Date'), fieldtype: 'Date', reqd: 1, default: to_date },
+        ], (values) => {
+            get_rental_availability(frm, values.from_date, values.to_date);
+        }, __('Check Rental Availability'));
+    });
+}
+
+function get_rental_availability(frm, from_date, to_date) {
+    let requested = {};
+    (frm.doc.items || []).forEach((row) => {
+        if (row.item_code) {
+            requested[row.item_code] = (requested[row.item_code] || 0) + flt(row.qty);
+        }
+    });
+    frappe.call({
+        method: 'erplex_rental.availability.get_rental_availability',
+        args: {
+            company: frm.doc.company,
+            item_codes: Object.keys(requested),
+            from_date: from_date,
+            to_date: to_date,
+            exclude_sales_order: frm.doc.doctype == "Sales Order" ? frm.doc.name : null
+        },
+        callback: function (r) {
+            let rows = Object.keys(r.message || {}).map((item_code) => {
+                let item = r.message[item_code];
+                let color = item.available < requested[item_code] ? "red" : "green";
+                return `<tr><td>${item_code}</td><td>${requested[item_code]}</td><td>${item.in_stock}</td>
+                    <td>${item.on_rent}</td><td>${item.incoming}</td><td>${item.reserved}</td>
+                    <td style="color: ${color}">${item.available}</td></tr>`;
+            });
+            frappe.msgprint({
+                title: __('Rental Availability from {0} to {1}', [
+                    frappe.datetime.str_to_user(from_date), frappe.datetime.str_to_user(to_date)
+                ]),
+                message: `<table class="table table-bordered"><tr><th>${__('Item')}</th><th>${__('Requested')}</th>
+                    <th>${__('In Stock')}</th><th>${__('On Rent')}</th><th>${__('Incoming')}</th>
+                    <th>${__('Reserved')}</th><th>${__('Available')}</th></tr>${rows.join('')}</table>`,
+                wide: true
+            });
+        }
+    });
+}
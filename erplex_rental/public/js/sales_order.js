@@ -3,6 +3,11 @@ frappe.ui.form.on('Sales Order', {
         if (frm.doc.__islocal === 1 && frm.doc.order_type == "Rental") {
             get_rental_data(frm)
         }
+        if (frm.doc.docstatus === 0 && frm.doc.order_type == "Rental") {
+            frm.add_custom_button(__('Check Rental Availability'), function () {
+                show_rental_availability(frm, frm.doc.delivery_date || frm.doc.transaction_date);
+            });
+        }
         if (frm.doc.docstatus === 1 && frm.doc.order_type == "Rental") {
             frappe.run_serially([
                 () => frappe.timeout(2),
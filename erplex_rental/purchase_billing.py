@@ -0,0 +1,369 @@
+import time
+
+import frappe
+import numpy as np
+from erpnext.buying.doctype.purchase_order.purchase_order import make_purchase_invoice
+from frappe.utils import cint, flt, getdate, now_datetime, today
+
+from erplex_rental.accrual import compute_qty_days, get_per_day_rate, to_days
+from erplex_rental.billing import BILLING_JOB_TIMEOUT, BillingStats, chunked, get_billing_settings
+
+PURCHASE_BILLING_SAVEPOINT = "rental_purchase_billing_order"
+
+
+def get_purchase_billing_orders(billing_date=None, orders=None):
+    """Rental Purchase Orders with supplier hire to bill up to the billing date
+
+    An order is due when one of its lines is still on hire or was received or returned after the
+    order's last billed date (the posting date of its latest Purchase Invoice, or the order date).
+    """
+    conds = ""
+    if orders:
+        conds += " and po.name in %(orders)s "
+    return frappe.db.sql_list(
+        f"""Select po.name from `tabPurchase Order` po
+    left join (Select pii.purchase_order, MAX(pi.posting_date) as last_billed_date
+        from `tabPurchase Invoice` pi inner join `tabPurchase Invoice Item` pii on pi.name = pii.parent
+        where pi.docstatus = 1 and pii.purchase_order is not null group by pii.purchase_order
+    ) billed on billed.purchase_order = po.name
+    where po.custom_order_type = 'Rental' and po.docstatus = 1 {conds}
+    and exists (Select 1 from `tabPurchase Receipt` pr inner join `tabPurchase Receipt Item` pri on pr.name = pri.parent
+        where pr.docstatus = 1 and pri.purchase_order = po.name and pr.posting_date < %(billing_date)s
+        group by pri.purchase_order_item
+        having SUM(pri.qty) > 0 or MAX(pr.posting_date) >= ifnull(billed.last_billed_date, po.transaction_date))
+    order by po.name""",
+        {"billing_date": getdate(billing_date), "orders": tuple(orders or ())},
+    )
+
+
+def get_purchase_order_items(orders):
+    data = []
+    for names in chunked(set(orders)):
+        data += (
+            frappe.db.sql(
+                """Select po.name as purchase_order, po.transaction_date, poi.name as po_detail, poi.item_code, poi.rate
+        from `tabPurchase Order` po inner join `tabPurchase Order Item` poi on po.name = poi.parent
+        where po.name in %(orders)s order by po.name, poi.idx""",
+                {"orders": tuple(names)},
+                as_dict=True,
+            )
+            or []
+        )
+    return data
+
+
+def get_last_purchase_billed_dates(orders):
+    """Posting date of the latest submitted Purchase Invoice of each Purchase Order, as {purchase_order: date}"""
+    billed = {}
+    for names in chunked(set(orders)):
+        billed.update(
+            frappe.db.sql(
+                """Select pii.purchase_order, MAX(pi.posting_date)
+            from `tabPurchase Invoice` pi inner join `tabPurchase Invoice Item` pii on pi.name = pii.parent
+            where pi.docstatus = 1 and pii.purchase_order in %(orders)s group by pii.purchase_order""",
+                {"orders": tuple(names)},
+            )
+        )
+    return billed
+
+
+def get_hire_events(orders, billing_date):
+    """Qty received (positive) and returned (negative) per Purchase Order Item and day, before the billing date"""
+    events = []
+    for names in chunked(set(orders)):
+        events += frappe.db.sql(
+            """Select pri.purchase_order_item, pr.posting_date, SUM(pri.qty)
+        from `tabPurchase Receipt` pr inner join `tabPurchase Receipt Item` pri on pr.name = pri.parent
+        where pr.docstatus = 1 and pri.purchase_order in %(orders)s and pr.posting_date < %(billing_date)s
+        group by pri.purchase_order_item, pr.posting_date""",
+            {"orders": tuple(names), "billing_date": billing_date},
+        )
+    return events
+
+
+def compute_purchase_invoice_lines(orders, billing_date=None):
+    """Invoice lines per rental Purchase Order, as {purchase_order: [lines]}
+
+    Each Purchase Order Item is charged its qty-days on hire between the order's last billed date
+    (or order date) and the billing date, with receipts and returns read as one grouped query and
+    all lines priced in a single pass of the billing kernel. Lines carry the qty-days as qty and the
+    per-day rate as rate, like the Sales Invoices of rental orders.
+    """
+    billing_date = getdate(billing_date)
+    order_items = get_purchase_order_items(orders)
+    if not order_items:
+        return {}
+    billed = get_last_purchase_billed_dates(orders)
+    for poi in order_items:
+        poi.start_date = getdate(billed.get(poi.purchase_order) or poi.transaction_date)
+
+    positions = {poi.po_detail: idx for idx, poi in enumerate(order_items)}
+    events = [event for event in get_hire_events(orders, billing_date) if event[0] in positions]
+    qty_days = compute_qty_days(
+        to_days(poi.start_date for poi in order_items),
+        np.full(len(order_items), billing_date.toordinal(), dtype=np.int64),
+        np.fromiter((positions[po_detail] for po_detail, _, _ in events), dtype=np.int64),
+        to_days(posting_date for _, posting_date, _ in events),
+        np.fromiter((flt(qty) for _, _, qty in events), dtype=np.float64),
+    )
+
+    invoice_lines = {}
+    for idx, poi in enumerate(order_items):
+        lines = invoice_lines.setdefault(poi.purchase_order, [])
+        if flt(qty_days[idx]) <= 0:
+            continue
+        lines.append(
+            frappe._dict(
+                {
+                    "item_code": poi.item_code,
+                    "qty": flt(qty_days[idx]),
+                    "rate": get_per_day_rate(poi.rate),
+                    "purchase_order": poi.purchase_order,
+                    "po_detail": poi.po_detail,
+                    "start_date": poi.start_date,
+                }
+            )
+        )
+    return invoice_lines
+
+
+def make_rental_purchase_invoice(purchase_order, lines, billing_date=None):
+    pi_doc = make_purchase_invoice(purchase_order)
+    pi_doc.update_stock = 0
+    pi_doc.set_posting_time = 1
+    pi_doc.posting_date = getdate(billing_date)
+    pi_doc.custom_order_type = "Rental"
+    pi_doc.items = []
+    for line in lines:
+        pi_doc.append(
+            "items",
+            {
+                "item_code": line.item_code,
+                "qty": line.qty,
+                "rate": line.rate,
+                "purchase_order": line.purchase_order,
+                "po_detail": line.po_detail,
+            },
+        )
+    pi_doc.flags.ignore_permissions = True
+    pi_doc.run_method("set_missing_values")
+    pi_doc.run_method("calculate_taxes_and_totals")
+    pi_doc.save()
+    return pi_doc
+
+
+def claim_rental_purchase_order(purchase_order, billing_date=None):
+    """Lock the Purchase Order row and check nobody billed it for this period yet"""
+    frappe.db.get_value("Purchase Order", purchase_order, "name", for_update=True)
+    return not frappe.db.sql(
+        """Select pi.name
+    from `tabPurchase Invoice` pi inner join `tabPurchase Invoice Item` pii on pi.name = pii.parent
+    where pi.docstatus < 2 and pii.purchase_order = %(purchase_order)s and pi.posting_date >= %(billing_date)s
+    limit 1""",
+        {"purchase_order": purchase_order, "billing_date": getdate(billing_date)},
+    )
+
+
+def create_rental_purchase_invoices(orders=None, billing_date=None, recorder=None):
+    """Bill supplier hire of rental Purchase Orders from their last billed date up to the billing date
+
+    Each order runs under a savepoint. Without a recorder every order is committed on its own and
+    errors propagate; with one, a failing order is rolled back and logged and commits happen once
+    per batch.
+    """
+    billing_date = getdate(billing_date)
+    stats = BillingStats("purchase")
+    with stats.track():
+        with stats.phase("fetch"):
+            if orders is None:
+                orders = get_purchase_billing_orders(billing_date)
+        with stats.phase("compute"):
+            invoice_lines = compute_purchase_invoice_lines(orders, billing_date)
+        stats.orders = len(orders)
+        with stats.phase("invoice"):
+            for purchase_order, lines in invoice_lines.items():
+                started = time.monotonic()
+                frappe.db.savepoint(PURCHASE_BILLING_SAVEPOINT)
+                try:
+                    status, purchase_invoice = "Nothing to Bill", None
+                    if lines:
+                        if claim_rental_purchase_order(purchase_order, billing_date):
+                            purchase_invoice = make_rental_purchase_invoice(purchase_order, lines, billing_date).name
+                            status = "Invoiced"
+                            stats.invoices += 1
+                            stats.lines += len(lines)
+                        else:
+                            status = "Skipped"
+                            stats.skipped += 1
+                except Exception:
+                    if not recorder:
+                        raise
+                    frappe.db.rollback(save_point=PURCHASE_BILLING_SAVEPOINT)
+                    stats.failed += 1
+                    recorder.record(
+                        purchase_order, "Failed", time.monotonic() - started, error=frappe.get_traceback()
+                    )
+                    continue
+                if recorder:
+                    recorder.record(purchase_order, status, time.monotonic() - started, purchase_invoice)
+                else:
+                    frappe.db.commit()
+            if recorder:
+                recorder.flush()
+    return stats.summary()
+
+
+class PurchaseBillingRunRecorder:
+    """Writes per-order outcomes to a Rental Purchase Billing Run, with a commit every `batch_size` orders"""
+
+    def __init__(self, run, batch_size=None, retry_failed=False):
+        self.run = run
+        self.batch_size = cint(batch_size) or get_billing_settings().batch_size
+        self.statuses = ("Pending", "Failed") if retry_failed else ("Pending",)
+        self.pending = []
+
+    def record(self, purchase_order, status, duration, purchase_invoice=None, error=None):
+        self.pending.append(
+            {
+                "run": self.run,
+                "purchase_order": purchase_order,
+                "status": status,
+                "duration": flt(duration, 3),
+                "purchase_invoice": purchase_invoice,
+                "error": error,
+            }
+        )
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        for row in self.pending:
+            frappe.db.sql(
+                """Update `tabRental Purchase Billing Run Order`
+            set status = %(status)s, duration = %(duration)s, purchase_invoice = %(purchase_invoice)s, error = %(error)s
+            where parent = %(run)s and purchase_order = %(purchase_order)s""",
+                row,
+            )
+        statuses = [row["status"] for row in self.pending]
+        frappe.db.sql(
+            """Update `tabRental Purchase Billing Run`
+        set checkpoint = checkpoint + %(processed)s, invoiced_orders = invoiced_orders + %(invoiced)s,
+            skipped_orders = skipped_orders + %(skipped)s, failed_orders = failed_orders + %(failed)s
+        where name = %(run)s""",
+            {
+                "run": self.run,
+                "processed": len(statuses),
+                "invoiced": statuses.count("Invoiced"),
+                "skipped": statuses.count("Skipped"),
+                "failed": statuses.count("Failed"),
+            },
+        )
+        self.pending = []
+        frappe.db.commit()
+
+    def pending_orders(self):
+        return frappe.db.sql_list(
+            """Select purchase_order from `tabRental Purchase Billing Run Order`
+        where parent = %(run)s and status in %(statuses)s order by idx""",
+            {"run": self.run, "statuses": self.statuses},
+        )
+
+    def close(self):
+        """Orders the engine found nothing to bill for are done as well"""
+        self.flush()
+        for purchase_order in self.pending_orders():
+            self.record(purchase_order, "Nothing to Bill", 0)
+        self.flush()
+
+
+def enqueue_monthly_rental_purchase_billing(billing_date=None):
+    """Log a Rental Purchase Billing Run for the rental Purchase Orders due for billing and bill it on the long queue"""
+    billing_date = getdate(billing_date or today())
+    orders = get_purchase_billing_orders(billing_date)
+    run = frappe.new_doc("Rental Purchase Billing Run")
+    run.update(
+        {
+            "billing_date": billing_date,
+            "status": "Queued",
+            "batch_size": get_billing_settings().batch_size,
+            "started_at": now_datetime(),
+            "total_orders": len(orders),
+        }
+    )
+    for purchase_order in orders:
+        run.append("orders", {"purchase_order": purchase_order, "status": "Pending"})
+    run.flags.ignore_permissions = True
+    run.insert()
+    if not orders:
+        run.db_set({"status": "Completed", "finished_at": now_datetime()})
+    frappe.db.commit()
+    if orders:
+        enqueue_purchase_billing_run(run.name)
+    return run.name
+
+
+def enqueue_purchase_billing_run(run, retry_failed=False):
+    frappe.enqueue(
+        "erplex_rental.purchase_billing.run_purchase_billing",
+        queue="long",
+        timeout=BILLING_JOB_TIMEOUT,
+        job_id=f"rental_purchase_billing::{run}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        run=run,
+        retry_failed=retry_failed,
+    )
+
+
+def run_purchase_billing(run, retry_failed=False):
+    billing_date, batch_size = frappe.db.get_value(
+        "Rental Purchase Billing Run", run, ["billing_date", "batch_size"]
+    )
+    recorder = PurchaseBillingRunRecorder(run, batch_size, retry_failed)
+    orders = recorder.pending_orders()
+    if retry_failed:
+        # failed orders are counted again once their retry is recorded
+        failed = len(orders) - len(PurchaseBillingRunRecorder(run, batch_size).pending_orders())
+        frappe.db.sql(
+            """Update `tabRental Purchase Billing Run` set failed_orders = failed_orders - %(failed)s,
+            checkpoint = checkpoint - %(failed)s where name = %(run)s""",
+            {"run": run, "failed": failed},
+        )
+    frappe.db.set_value("Rental Purchase Billing Run", run, {"status": "Running", "finished_at": None})
+    frappe.db.commit()
+    try:
+        summary = create_rental_purchase_invoices(orders, billing_date, recorder)
+        recorder.close()
+    except Exception:
+        frappe.db.rollback()
+        frappe.db.set_value("Rental Purchase Billing Run", run, {"status": "Failed", "finished_at": now_datetime()})
+        frappe.db.commit()
+        raise
+    failed_orders = frappe.db.get_value("Rental Purchase Billing Run", run, "failed_orders")
+    frappe.db.set_value(
+        "Rental Purchase Billing Run",
+        run,
+        {
+            "status": "Partially Failed" if failed_orders else "Completed",
+            "finished_at": now_datetime(),
+            "invoiced_lines": summary["lines"],
+            "queries": summary["queries"],
+            "seconds": summary["seconds"],
+            "stats": frappe.as_json(summary),
+        },
+    )
+    frappe.db.commit()
+
+
+def resume_purchase_billing_run(run, retry_failed=False):
+    """Re-enqueue a run that still has orders after the checkpoint"""
+    retry_failed = cint(retry_failed)
+    statuses = ("Pending", "Failed") if retry_failed else ("Pending",)
+    if not frappe.db.exists(
+        "Rental Purchase Billing Run Order", {"parent": run, "status": ["in", statuses]}
+    ):
+        frappe.throw("All orders of this Rental Purchase Billing Run have been processed")
+    frappe.db.set_value("Rental Purchase Billing Run", run, "status", "Queued")
+    enqueue_purchase_billing_run(run, retry_failed)
@@ -0,0 +1,65 @@
+import frappe
+
+RECOMPUTE_JOB_TIMEOUT = 600
+
+
+def get_recompute_queue():
+    """Sales Orders marked dirty in the current request"""
+    return getattr(frappe.local, "rental_recompute_queue", None)
+
+
+def queue_recompute(sales_orders=()):
+    """Recompute the status of the given Sales Orders once, after the current transaction commits
+
+    Rental Deliveries are not deferred: a Rental Return refreshes their returned / pending qty in
+    the same transaction, so returns are always mapped from current figures.
+    """
+    queue = get_recompute_queue()
+    if queue is None:
+        queue = frappe.local.rental_recompute_queue = frappe._dict(sales_orders=[])
+        frappe.db.after_commit.add(flush_recompute_queue)
+        frappe.db.after_rollback.add(clear_recompute_queue)
+    for sales_order in sales_orders:
+        if sales_order not in queue.sales_orders:
+            queue.sales_orders.append(sales_order)
+
+
+def clear_recompute_queue():
+    frappe.local.rental_recompute_queue = None
+
+
+def flush_recompute_queue():
+    queue = get_recompute_queue()
+    clear_recompute_queue()
+    if not queue or not queue.sales_orders:
+        return
+    frappe.enqueue(
+        "erplex_rental.recompute.process_recompute_queue",
+        queue="short",
+        timeout=RECOMPUTE_JOB_TIMEOUT,
+        now=frappe.flags.in_test,
+        sales_orders=queue.sales_orders,
+    )
+
+
+def process_recompute_queue(sales_orders=()):
+    """Refresh each Sales Order once, committing one at a time"""
+    from erplex_rental.main import update_so_status
+
+    for sales_order in sales_orders:
+        run_recompute(update_so_status, "Sales Order", sales_order)
+
+
+def run_recompute(method, doctype, names):
+    """Run a recompute for one document or a batch of them, logging the failure instead of raising"""
+    try:
+        method(names)
+        frappe.db.commit()
+    except Exception:
+        frappe.db.rollback()
+        batch = not isinstance(names, str)
+        frappe.log_error(
+            f"Rental recompute failed for {doctype} {', '.join(names) if batch else names}",
+            reference_doctype=doctype,
+            reference_name=None if batch else names,
+        )
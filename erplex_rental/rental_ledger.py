@@ -0,0 +1,388 @@
+import frappe
+from frappe.utils import add_months, flt, get_first_day, getdate, now_datetime
+
+LEDGER_FIELDS = (
+    "name",
+    "creation",
+    "modified",
+    "owner",
+    "modified_by",
+    "sales_order",
+    "so_detail",
+    "item_code",
+    "posting_date",
+    "posting_time",
+    "voucher_type",
+    "voucher_no",
+    "voucher_detail_no",
+    "qty",
+    "qty_after_transaction",
+    "is_cancelled",
+)
+SNAPSHOT_FIELDS = (
+    "name",
+    "creation",
+    "modified",
+    "owner",
+    "modified_by",
+    "sales_order",
+    "so_detail",
+    "item_code",
+    "snapshot_date",
+    "qty",
+)
+# keep IN (...) lists to a sane size when snapshotting every rental order
+SNAPSHOT_CHUNK_SIZE = 500
+
+
+def get_voucher_movements(doc):
+    """Signed on-rent qty per row of a Rental Delivery or Rental Return"""
+    movements = []
+    for row in doc.items:
+        if doc.doctype == "Rental Delivery":
+            qty = flt(row.qty)
+        else:
+            qty = -(flt(row.return_qty) + flt(row.maintenance_qty) + flt(row.damaged_qty))
+        if qty:
+            movements.append(
+                frappe._dict(
+                    sales_order=row.sales_order,
+                    so_detail=row.sales_order_detail,
+                    item_code=row.item_code,
+                    voucher_detail_no=row.name,
+                    qty=qty,
+                )
+            )
+    return movements
+
+
+def get_balances_before(so_details, posting_date, posting_time):
+    """On-rent qty of each Sales Order Item up to (and including) the given posting date and time"""
+    if not so_details:
+        return {}
+    data = frappe.db.sql(
+        """Select so_detail, qty_after_transaction from (
+        Select so_detail, qty_after_transaction,
+        ROW_NUMBER() OVER (PARTITION BY so_detail ORDER BY posting_date DESC, posting_time DESC, creation DESC) as row_no
+        from `tabRental Ledger Entry`
+        where is_cancelled = 0 and so_detail in %(so_details)s
+        and timestamp(posting_date, posting_time) <= timestamp(%(posting_date)s, %(posting_time)s)
+    ) last_entry where row_no = 1""",
+        {"so_details": tuple(so_details), "posting_date": posting_date, "posting_time": posting_time},
+    )
+    return {so_detail: flt(balance) for so_detail, balance in data}
+
+
+def shift_later_balances(deltas, posting_date, posting_time):
+    """Carry a backdated change into the running balance of the later entries"""
+    deltas = {so_detail: delta for so_detail, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    case = " ".join(["when %s then %s"] * len(deltas))
+    values = [value for item in deltas.items() for value in item]
+    frappe.db.sql(
+        f"""Update `tabRental Ledger Entry`
+    set qty_after_transaction = qty_after_transaction + (case so_detail {case} else 0 end)
+    where is_cancelled = 0 and so_detail in %s
+    and timestamp(posting_date, posting_time) > timestamp(%s, %s)""",
+        (*values, tuple(deltas), posting_date, posting_time),
+    )
+
+
+def make_rental_ledger_entries(doc, cancel=False):
+    """Post (or reverse on cancel) the on-rent movements of a Rental Delivery / Rental Return"""
+    movements = get_voucher_movements(doc)
+    deltas = {}
+    for row in movements:
+        deltas[row.so_detail] = deltas.get(row.so_detail, 0) + row.qty
+
+    if cancel:
+        frappe.db.sql(
+            """Update `tabRental Ledger Entry` set is_cancelled = 1, modified = %s, modified_by = %s
+        where voucher_type = %s and voucher_no = %s""",
+            (now_datetime(), frappe.session.user, doc.doctype, doc.name),
+        )
+        shift_later_balances(
+            {so_detail: -delta for so_detail, delta in deltas.items()}, doc.posting_date, doc.posting_time
+        )
+        invalidate_rental_snapshots({row.sales_order for row in movements}, doc.posting_date)
+        invalidate_rental_accruals(deltas, doc.posting_date)
+        return
+
+    balances = get_balances_before(deltas.keys(), doc.posting_date, doc.posting_time)
+    entries = []
+    for row in movements:
+        balances[row.so_detail] = balances.get(row.so_detail, 0) + row.qty
+        row.update(
+            posting_date=doc.posting_date,
+            posting_time=doc.posting_time,
+            voucher_type=doc.doctype,
+            voucher_no=doc.name,
+            qty_after_transaction=balances[row.so_detail],
+        )
+        entries.append(row)
+    shift_later_balances(deltas, doc.posting_date, doc.posting_time)
+    insert_ledger_entries(entries)
+    invalidate_rental_snapshots({row.sales_order for row in movements}, doc.posting_date)
+    invalidate_rental_accruals(deltas, doc.posting_date)
+
+
+def insert_ledger_entries(entries):
+    timestamp, user = now_datetime(), frappe.session.user
+    values = [
+        (
+            frappe.generate_hash(),
+            timestamp,
+            timestamp,
+            user,
+            user,
+            row.sales_order,
+            row.so_detail,
+            row.item_code,
+            row.posting_date,
+            row.posting_time,
+            row.voucher_type,
+            row.voucher_no,
+            row.voucher_detail_no,
+            row.qty,
+            row.qty_after_transaction,
+            0,
+        )
+        for row in entries
+    ]
+    frappe.db.bulk_insert("Rental Ledger Entry", LEDGER_FIELDS, values)
+
+
+def get_on_rent_qty(sales_order=None, item_code=None, date=None, so_detail=None):
+    """Qty on rent before the given date (all time when no date is given)"""
+    conds = ""
+    if sales_order:
+        conds += " and sales_order = %(sales_order)s "
+    if item_code:
+        conds += " and item_code = %(item_code)s "
+    if so_detail:
+        conds += " and so_detail = %(so_detail)s "
+    if date:
+        conds += " and posting_date < %(date)s "
+    return flt(
+        frappe.db.sql(
+            f"""Select SUM(qty) from `tabRental Ledger Entry` where is_cancelled = 0 {conds}""",
+            {"sales_order": sales_order, "item_code": item_code, "so_detail": so_detail, "date": date},
+        )[0][0]
+    )
+
+
+def get_rental_movements(sales_order=None, item_code=None, from_date=None, to_date=None):
+    """Ledger entries of a period in posting order, as name (voucher), posting_date and signed qty"""
+    conds = ""
+    if sales_order:
+        conds += " and sales_order = %(sales_order)s "
+    if item_code:
+        conds += " and item_code = %(item_code)s "
+    if from_date:
+        conds += " and posting_date >= %(from_date)s "
+    if to_date:
+        conds += " and posting_date <= %(to_date)s "
+    return (
+        frappe.db.sql(
+            f"""Select voucher_no as name, voucher_type, posting_date, qty, so_detail, qty_after_transaction
+        from `tabRental Ledger Entry` where is_cancelled = 0 {conds}
+        order by posting_date, posting_time, creation""",
+            {"sales_order": sales_order, "item_code": item_code, "from_date": from_date, "to_date": to_date},
+            as_dict=True,
+        )
+        or []
+    )
+
+
+def get_submitted_movements(sales_order=None):
+    """Signed on-rent qty of every submitted Rental Delivery and Rental Return row, in posting order per item"""
+    conds = " and c.sales_order = %(sales_order)s " if sales_order else ""
+    return frappe.db.sql(
+        f"""Select 'Rental Delivery' as voucher_type, p.name as voucher_no, c.name as voucher_detail_no,
+        c.sales_order, c.sales_order_detail as so_detail, c.item_code, p.posting_date, p.posting_time,
+        p.creation, c.idx, c.qty
+    from `tabRental Delivery` p inner join `tabRental Delivery Item` c on p.name = c.parent
+    where p.docstatus = 1 {conds}
+    union all
+    Select 'Rental Return' as voucher_type, p.name as voucher_no, c.name as voucher_detail_no,
+        c.sales_order, c.sales_order_detail as so_detail, c.item_code, p.posting_date, p.posting_time,
+        p.creation, c.idx, -1*(c.return_qty+c.maintenance_qty+c.damaged_qty) as qty
+    from `tabRental Return` p inner join `tabRental Return Item` c on p.name = c.parent
+    where p.docstatus = 1 {conds}
+    order by so_detail, posting_date, posting_time, creation, idx""",
+        {"sales_order": sales_order},
+        as_dict=True,
+    )
+
+
+def rebuild_rental_ledger(sales_order=None):
+    """Recreate the Rental Ledger from submitted Rental Deliveries and Rental Returns"""
+    if sales_order:
+        frappe.db.delete("Rental Ledger Entry", {"sales_order": sales_order})
+        frappe.db.delete("Rental Qty Snapshot", {"sales_order": sales_order})
+    else:
+        frappe.db.truncate("Rental Ledger Entry")
+        frappe.db.truncate("Rental Qty Snapshot")
+    balances, entries = {}, []
+    for row in get_submitted_movements(sales_order):
+        if not flt(row.qty):
+            continue
+        balances[row.so_detail] = balances.get(row.so_detail, 0) + flt(row.qty)
+        row.qty_after_transaction = balances[row.so_detail]
+        entries.append(row)
+    insert_ledger_entries(entries)
+    return len(entries)
+
+
+def invalidate_rental_snapshots(sales_orders, posting_date):
+    """Drop the snapshots a backdated movement made stale; the next snapshot run rebuilds them
+
+    Snapshots are dropped for the whole Sales Order, so every snapshot date left holds all of its items.
+    """
+    if sales_orders:
+        frappe.db.sql(
+            """Delete from `tabRental Qty Snapshot` where sales_order in %s and snapshot_date > %s""",
+            (tuple(sales_orders), posting_date),
+        )
+
+
+def invalidate_rental_accruals(so_details, posting_date):
+    """Drop the uninvoiced daily accruals a backdated movement made stale; the next accrual run redoes them"""
+    if so_details:
+        frappe.db.sql(
+            """Delete from `tabRental Accrual`
+        where so_detail in %s and to_date > %s and sales_invoice is null""",
+            (tuple(so_details), posting_date),
+        )
+
+
+def get_on_rent_balances(sales_orders, date, item_code=None):
+    """Qty on rent of every Sales Order Item of the orders before the date, as {so_detail: qty}
+
+    Reads each order's nearest snapshot on or before the date and adds the movements posted since.
+    """
+    if not sales_orders:
+        return {}
+    params = {"sales_orders": tuple(set(sales_orders)), "date": getdate(date), "item_code": item_code}
+    item_cond = " and {0}.item_code = %(item_code)s " if item_code else ""
+    last_snapshots = """Select sales_order, MAX(snapshot_date) as snapshot_date from `tabRental Qty Snapshot`
+        where sales_order in %(sales_orders)s and snapshot_date <= %(date)s group by sales_order"""
+    balances = {}
+    for so_detail, qty in frappe.db.sql(
+        f"""Select s.so_detail, s.qty from `tabRental Qty Snapshot` s
+    inner join ({last_snapshots}) last_snapshot
+        on last_snapshot.sales_order = s.sales_order and last_snapshot.snapshot_date = s.snapshot_date
+    where 1=1 {item_cond.format("s")}""",
+        params,
+    ):
+        balances[so_detail] = flt(qty)
+    for so_detail, qty in frappe.db.sql(
+        f"""Select l.so_detail, SUM(l.qty) from `tabRental Ledger Entry` l
+    left join ({last_snapshots}) last_snapshot on last_snapshot.sales_order = l.sales_order
+    where l.is_cancelled = 0 and l.sales_order in %(sales_orders)s and l.posting_date < %(date)s
+    and (last_snapshot.snapshot_date is null or l.posting_date >= last_snapshot.snapshot_date) {item_cond.format("l")}
+    group by l.so_detail""",
+        params,
+    ):
+        balances[so_detail] = balances.get(so_detail, 0) + flt(qty)
+    return balances
+
+
+def as_of(sales_order, item_code=None, date=None):
+    """Qty of an item (or the whole order) on rent before the date, from the monthly snapshots"""
+    if not date:
+        return get_on_rent_qty(sales_order, item_code)
+    return flt(sum(get_on_rent_balances([sales_order], date, item_code).values()))
+
+
+def get_orders_to_snapshot(snapshot_upto):
+    """Orders with movements after their latest snapshot"""
+    return frappe.db.sql_list(
+        """Select distinct l.sales_order from `tabRental Ledger Entry` l
+    left join (Select sales_order, MAX(snapshot_date) as snapshot_date from `tabRental Qty Snapshot`
+        group by sales_order) last_snapshot on last_snapshot.sales_order = l.sales_order
+    where l.is_cancelled = 0 and l.posting_date < %(snapshot_upto)s
+    and (last_snapshot.snapshot_date is null or l.posting_date >= last_snapshot.snapshot_date)""",
+        {"snapshot_upto": snapshot_upto},
+    )
+
+
+def build_rental_snapshots(snapshot_upto=None):
+    """Write the monthly closing on-rent qty of every order with new movements, up to the given month start
+
+    Incremental: an order starts from its latest snapshot and gets one snapshot per month that had
+    movements, covering all its items (including ones that just went to zero), so any snapshot date of
+    an order is a complete opening position.
+    """
+    snapshot_upto = get_first_day(snapshot_upto or now_datetime())
+    orders = get_orders_to_snapshot(snapshot_upto)
+    created = 0
+    for start in range(0, len(orders), SNAPSHOT_CHUNK_SIZE):
+        chunk = orders[start : start + SNAPSHOT_CHUNK_SIZE]
+        created += snapshot_orders(chunk, snapshot_upto)
+        frappe.db.commit()
+    return created
+
+
+def snapshot_orders(orders, snapshot_upto):
+    names = tuple(orders)
+    balances = {}
+    for row in frappe.db.sql(
+        """Select s.sales_order, s.so_detail, s.item_code, s.qty from `tabRental Qty Snapshot` s
+    inner join (Select sales_order, MAX(snapshot_date) as snapshot_date from `tabRental Qty Snapshot`
+        where sales_order in %(orders)s group by sales_order) last_snapshot
+        on last_snapshot.sales_order = s.sales_order and last_snapshot.snapshot_date = s.snapshot_date""",
+        {"orders": names},
+        as_dict=True,
+    ):
+        if flt(row.qty):
+            balances.setdefault(row.sales_order, {})[row.so_detail] = [row.item_code, flt(row.qty)]
+
+    movements = {}
+    for row in frappe.db.sql(
+        """Select l.sales_order, l.so_detail, l.item_code, DATE_FORMAT(l.posting_date, '%%Y-%%m-01') as month,
+        SUM(l.qty) as qty
+    from `tabRental Ledger Entry` l
+    left join (Select sales_order, MAX(snapshot_date) as snapshot_date from `tabRental Qty Snapshot`
+        where sales_order in %(orders)s group by sales_order) last_snapshot on last_snapshot.sales_order = l.sales_order
+    where l.is_cancelled = 0 and l.sales_order in %(orders)s and l.posting_date < %(snapshot_upto)s
+    and (last_snapshot.snapshot_date is null or l.posting_date >= last_snapshot.snapshot_date)
+    group by l.sales_order, l.so_detail, l.item_code, month""",
+        {"orders": names, "snapshot_upto": snapshot_upto},
+        as_dict=True,
+    ):
+        movements.setdefault(row.sales_order, {}).setdefault(getdate(row.month), []).append(row)
+
+    timestamp, user = now_datetime(), frappe.session.user
+    values = []
+    for sales_order, months in movements.items():
+        balance = balances.get(sales_order, {})
+        for month in sorted(months):
+            changed = set()
+            for row in months[month]:
+                item = balance.setdefault(row.so_detail, [row.item_code, 0])
+                item[1] += flt(row.qty)
+                changed.add(row.so_detail)
+            snapshot_date = add_months(month, 1)
+            for so_detail, (item_code, qty) in list(balance.items()):
+                if qty or so_detail in changed:
+                    values.append(
+                        (
+                            frappe.generate_hash(),
+                            timestamp,
+                            timestamp,
+                            user,
+                            user,
+                            sales_order,
+                            so_detail,
+                            item_code,
+                            snapshot_date,
+                            qty,
+                        )
+                    )
+                if not qty:
+                    del balance[so_detail]
+    if values:
+        frappe.db.bulk_insert("Rental Qty Snapshot", SNAPSHOT_FIELDS, values)
+    return len(values)
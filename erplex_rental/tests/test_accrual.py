@@ -0,0 +1,102 @@
+# Copyright (c) 2025, ERPlexSolutions and Contributors
+# See license.txt
+
+import frappe
+import numpy as np
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import getdate
+
+from erplex_rental.accrual import build_rental_statement, compute_qty_days, to_days
+
+# January 2025 as the half-open period [Jan 1, Feb 1): 31 days
+FROM_DATE, TO_DATE = "2025-01-01", "2025-02-01"
+
+
+def get_qty_days(events, from_date=FROM_DATE, to_date=TO_DATE):
+    """Qty-days of one line from (posting_date, qty) events"""
+    return compute_qty_days(
+        to_days([from_date]),
+        to_days([to_date]),
+        np.zeros(len(events), dtype=np.int64),
+        to_days(posting_date for posting_date, _ in events),
+        np.fromiter((qty for _, qty in events), dtype=np.float64),
+    )[0]
+
+
+def get_events(*events):
+    return [
+        frappe._dict(name=f"EV-{idx}", posting_date=posting_date, qty=qty)
+        for idx, (posting_date, qty) in enumerate(events)
+    ]
+
+
+class TestComputeQtyDays(FrappeTestCase):
+    def test_opening_balance_accrues_the_whole_period(self):
+        self.assertEqual(get_qty_days([("2024-12-31", 5)]), 5 * 31)
+
+    def test_event_before_the_start_counts_from_the_start(self):
+        self.assertEqual(get_qty_days([("2024-11-20", 5), ("2024-12-10", -2)]), 3 * 31)
+
+    def test_return_on_the_first_day_accrues_nothing(self):
+        self.assertEqual(get_qty_days([("2024-12-31", 5), ("2025-01-01", -5)]), 0)
+
+    def test_return_on_the_last_day_stops_before_it(self):
+        # on rent Jan 1 to Jan 30, back on Jan 31
+        self.assertEqual(get_qty_days([("2024-12-31", 5), ("2025-01-31", -5)]), 5 * 30)
+
+    def test_delivery_on_the_last_day_accrues_one_day(self):
+        self.assertEqual(get_qty_days([("2025-01-31", 5)]), 5)
+
+    def test_event_on_or_after_the_end_accrues_nothing(self):
+        self.assertEqual(get_qty_days([("2025-02-01", 5), ("2025-02-10", 5)]), 0)
+
+    def test_backdated_event_gives_the_same_qty_days_in_any_order(self):
+        events = [("2024-12-31", 5), ("2025-01-20", -3), ("2025-01-10", 4)]
+        expected = 5 * 31 - 3 * 12 + 4 * 22
+        self.assertEqual(get_qty_days(events), expected)
+        self.assertEqual(get_qty_days(events[::-1]), expected)
+
+    def test_lines_accrue_their_own_periods(self):
+        qty_days = compute_qty_days(
+            to_days(["2025-01-01", "2025-01-15", "2025-01-01"]),
+            to_days(["2025-02-01", "2025-02-01", "2025-01-11"]),
+            np.array([1, 0, 1, 0], dtype=np.int64),
+            to_days(["2025-01-05", "2025-01-01", "2025-01-25", "2025-01-20"]),
+            np.array([2, 3, -2, 1], dtype=np.float64),
+        )
+        # line 0 holds 3 all month plus 1 from Jan 20, line 1 holds the 2 delivered on Jan 5 from its
+        # Jan 15 start until the Jan 25 return, line 2 has no events
+        self.assertEqual(qty_days.tolist(), [3 * 31 + 1 * 12, 2 * 10, 0])
+
+
+class TestRentalStatement(FrappeTestCase):
+    def assertStatementAddsUp(self, statement):
+        rows_total = statement.opening.amount + sum(row.amount for row in statement.rows)
+        self.assertAlmostEqual(rows_total, statement.total_amount, places=2)
+
+    def test_statement_with_an_opening_balance(self):
+        statement = build_rental_statement(get_events(("2024-12-20", 5)), FROM_DATE, TO_DATE, 10)
+        self.assertEqual(statement.opening.posting_date, getdate(FROM_DATE))
+        self.assertEqual((statement.opening.qty, statement.opening.days), (5, 31))
+        self.assertEqual(statement.rows, [])
+        self.assertEqual((statement.qty_days, statement.total_qty, statement.total_amount), (155, 5, 1550))
+        self.assertStatementAddsUp(statement)
+
+    def test_statement_rows_of_a_return_on_the_first_and_last_day(self):
+        events = get_events(("2024-12-20", 8), ("2025-01-01", -3), ("2025-01-31", -5))
+        statement = build_rental_statement(events, FROM_DATE, TO_DATE, 10)
+        self.assertEqual(
+            [(row.posting_date, row.qty, row.days, row.amount) for row in statement.rows],
+            [(getdate("2025-01-01"), -3, 31, -930), (getdate("2025-01-31"), -5, 1, -50)],
+        )
+        self.assertEqual((statement.opening.qty, statement.opening.amount), (8, 2480))
+        self.assertEqual((statement.qty_days, statement.total_qty), (150, 0))
+        self.assertStatementAddsUp(statement)
+
+    def test_statement_of_a_backdated_event_adds_up(self):
+        events = get_events(("2024-12-31", 5), ("2025-01-20", -3), ("2025-01-10", 4), ("2024-12-05", 2))
+        statement = build_rental_statement(events, FROM_DATE, TO_DATE, 3.33)
+        self.assertEqual(statement.opening.qty, 7)
+        self.assertEqual(statement.qty_days, 7 * 31 - 3 * 12 + 4 * 22)
+        self.assertEqual(statement.total_amount, round(3.33 * statement.qty_days, 2))
+        self.assertStatementAddsUp(statement)
@@ -0,0 +1,71 @@
+# Copyright (c) 2025, ERPlexSolutions and Contributors
+# See license.txt
+
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, getdate, today
+
+from erplex_rental.availability import AvailabilityIndex, get_booking_end
+
+
+def day(offset):
+    return add_days(today(), offset)
+
+
+def get_index(in_stock=10, events=()):
+    """Index of (days from today, qty) events"""
+    return AvailabilityIndex(
+        in_stock,
+        0,
+        [getdate(day(offset)).toordinal() for offset, _ in events],
+        [qty for _, qty in events],
+    )
+
+
+class TestAvailabilityIndex(FrappeTestCase):
+    def setUp(self):
+        # 4 booked from day 5, back on the shelf on day 15
+        self.index = get_index(10, [(5, -4), (15, 4)])
+
+    def test_window_ending_the_day_before_a_booking(self):
+        self.assertEqual(self.index.available(day(0), day(4)), 10)
+
+    def test_booking_on_the_last_day_of_the_window(self):
+        self.assertEqual(self.index.available(day(0), day(5)), 6)
+
+    def test_booking_on_the_first_day_of_the_window(self):
+        self.assertEqual(self.index.available(day(5), day(14)), 6)
+
+    def test_return_on_the_last_day_still_counts_the_days_before(self):
+        self.assertEqual(self.index.available(day(14), day(15)), 6)
+
+    def test_return_on_the_first_day_of_the_window(self):
+        self.assertEqual(self.index.available(day(15), day(20)), 10)
+
+    def test_window_after_every_event(self):
+        self.assertEqual(self.index.available(day(30), day(40)), 10)
+
+    def test_past_from_date_counts_from_today(self):
+        self.assertEqual(self.index.available(day(-10), day(4)), 10)
+
+    def test_open_window_is_the_lowest_future_level(self):
+        self.assertEqual(self.index.available(day(0)), 6)
+        self.assertEqual(self.index.available(day(15)), 10)
+
+    def test_figures(self):
+        self.assertEqual((self.index.in_stock, self.index.incoming, self.index.reserved), (10, 4, 4))
+
+    def test_bookings_come_back_at_their_end(self):
+        index = self.index.with_bookings([(day(10), day(20), 8)])
+        self.assertEqual(index.available(day(0)), -2)
+        self.assertEqual(index.available(day(0), day(9)), 6)
+        self.assertEqual(index.available(day(16), day(19)), 2)
+        self.assertEqual(index.available(day(20)), 10)
+
+    def test_past_booking_goes_out_today(self):
+        index = get_index(10).with_bookings([(day(-5), day(3), 4)])
+        self.assertEqual(index.available(day(0), day(2)), 6)
+        self.assertEqual(index.available(day(3)), 10)
+
+    def test_booking_end_is_a_rental_period_from_today_at_the_earliest(self):
+        self.assertEqual(get_booking_end("2099-01-10", 2), getdate("2099-03-10"))
+        self.assertEqual(get_booking_end(day(-40), 1), get_booking_end(day(0), 1))
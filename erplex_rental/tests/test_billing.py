@@ -0,0 +1,178 @@
+# Copyright (c) 2025, ERPlexSolutions and Contributors
+# See license.txt
+
+from unittest.mock import MagicMock, call, patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import getdate
+
+from erplex_rental import billing
+
+
+class FakeInvoice:
+    """Stands in for the Sales Invoice that make_sales_invoice maps from the order"""
+
+    def __init__(self):
+        self.name = "SINV-TEST-0001"
+        self.items = []
+        self.flags = frappe._dict()
+
+    def append(self, table, row):
+        getattr(self, table).append(frappe._dict(row))
+
+    def run_method(self, method):
+        pass
+
+    def save(self):
+        pass
+
+
+def get_order_item(so_detail, rate=300, last_billed_date="2025-01-01"):
+    return frappe._dict(
+        sales_order="SO-TEST-0001",
+        transaction_date=getdate("2024-12-15"),
+        custom_last_billed_date=getdate(last_billed_date),
+        so_detail=so_detail,
+        item_code=f"ITEM-{so_detail}",
+        rate=rate,
+    )
+
+
+def get_ledger_events(lines, end_date):
+    """Delivered 10 on Jan 10 and returned 4 on Jan 20 on SOI-1, no movements on SOI-2"""
+    return [
+        frappe._dict(so_detail="SOI-1", name="RD-0001", posting_date=getdate("2025-01-10"), qty=10),
+        frappe._dict(so_detail="SOI-1", name="RR-0001", posting_date=getdate("2025-01-20"), qty=-4),
+    ]
+
+
+class TestRentalInvoice(FrappeTestCase):
+    def setUp(self):
+        patches = [
+            patch("erplex_rental.billing.is_daily_accrual_enabled", return_value=False),
+            patch("erplex_rental.accrual.get_ledger_events", side_effect=get_ledger_events),
+            patch("erplex_rental.billing.make_sales_invoice", side_effect=lambda sales_order: FakeInvoice()),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_invoice_lines_bill_qty_days_on_rent(self):
+        order_items = [get_order_item("SOI-1"), get_order_item("SOI-2")]
+        invoice_lines = billing.compute_invoice_lines(order_items, "2025-02-01")
+
+        # SOI-2 had nothing on rent in the period and gets no line
+        self.assertEqual(len(invoice_lines["SO-TEST-0001"]), 1)
+        line = invoice_lines["SO-TEST-0001"][0]
+        # 10 x 22 days from Jan 10, less 4 x 12 days from Jan 20 up to Feb 1
+        self.assertEqual(line.qty, 172)
+        self.assertEqual(line.rate, 10)
+        self.assertEqual(line.so_detail, "SOI-1")
+        self.assertEqual(line.start_date, getdate("2025-01-01"))
+
+    def test_invoice_adds_up_to_its_rental_statement(self):
+        lines = billing.compute_invoice_lines([get_order_item("SOI-1")], "2025-02-01")["SO-TEST-0001"]
+        si_doc = billing.make_rental_invoice("SO-TEST-0001", lines, "2025-02-01")
+
+        self.assertEqual(si_doc.posting_date, getdate("2025-02-01"))
+        self.assertEqual(si_doc.custom_rental_period_from, getdate("2025-01-01"))
+        self.assertEqual(si_doc.custom_rental_period_to, getdate("2025-02-01"))
+        self.assertEqual(
+            [(row.item_code, row.qty, row.rate, row.so_detail) for row in si_doc.items],
+            [("ITEM-SOI-1", 172, 10, "SOI-1")],
+        )
+        statement = si_doc.custom_rental_statement
+        self.assertEqual(
+            [(row.row_type, row.qty, row.days, row.amount) for row in statement],
+            [
+                ("Opening", 0, 31, 0),
+                ("Movement", 10, 22, 2200),
+                ("Movement", -4, 12, -480),
+                ("Total", 6, None, 1720),
+            ],
+        )
+        self.assertEqual(statement[-1].amount, sum(row.qty * row.rate for row in si_doc.items))
+
+
+class TestClaimRentalOrder(FrappeTestCase):
+    def test_claim_locks_the_order_and_refuses_a_billed_period(self):
+        with (
+            patch.object(frappe.db, "get_value") as get_value,
+            patch.object(frappe.db, "sql", return_value=[("SINV-0001",)]) as sql,
+        ):
+            self.assertFalse(billing.claim_rental_order("SO-TEST-0001", "2025-02-01"))
+        get_value.assert_called_once_with("Sales Order", "SO-TEST-0001", "name", for_update=True)
+        self.assertEqual(
+            sql.call_args.args[1], {"sales_order": "SO-TEST-0001", "billing_date": getdate("2025-02-01")}
+        )
+
+    def test_claim_an_unbilled_period(self):
+        with patch.object(frappe.db, "get_value"), patch.object(frappe.db, "sql", return_value=()):
+            self.assertTrue(billing.claim_rental_order("SO-TEST-0001", "2025-02-01"))
+
+
+class TestCreateRentalInvoices(FrappeTestCase):
+    def setUp(self):
+        self.invoiced = []
+        patches = [
+            patch("erplex_rental.billing.get_billing_settings", return_value=frappe._dict(consolidate=0)),
+            patch("erplex_rental.billing.is_daily_accrual_enabled", return_value=False),
+            patch("erplex_rental.billing.make_rental_invoice", side_effect=self.make_rental_invoice),
+            patch.object(frappe.db, "savepoint"),
+            patch.object(frappe.db, "rollback"),
+            patch.object(frappe.db, "commit"),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make_rental_invoice(self, sales_order, lines, billing_date=None):
+        if sales_order == "SO-FAIL":
+            raise frappe.ValidationError("Invoice failed")
+        self.invoiced.append(sales_order)
+        return frappe._dict(name=f"SINV-{sales_order}")
+
+    def get_invoice_lines(self, *orders):
+        return {
+            sales_order: [frappe._dict(sales_order=sales_order, so_detail=f"{sales_order}-1", qty=10, rate=5)]
+            for sales_order in orders
+        }
+
+    def test_billed_order_is_skipped(self):
+        stats, recorder = billing.BillingStats("test"), MagicMock()
+        claimed = {"SO-NEW": True, "SO-BILLED": False}
+        with patch("erplex_rental.billing.claim_rental_order", side_effect=lambda so, date: claimed[so]):
+            billing.create_rental_invoices(
+                self.get_invoice_lines("SO-NEW", "SO-BILLED"), stats, "2025-02-01", recorder
+            )
+
+        self.assertEqual(self.invoiced, ["SO-NEW"])
+        self.assertEqual((stats.invoices, stats.skipped, stats.failed), (1, 1, 0))
+        statuses = {args.args[0]: (args.args[1], args.args[3]) for args in recorder.record.call_args_list}
+        self.assertEqual(statuses, {"SO-NEW": ("Invoiced", "SINV-SO-NEW"), "SO-BILLED": ("Skipped", None)})
+
+    def test_failed_order_is_rolled_back_to_its_savepoint(self):
+        stats, recorder = billing.BillingStats("test"), MagicMock()
+        with patch("erplex_rental.billing.claim_rental_order", return_value=True):
+            billing.create_rental_invoices(
+                self.get_invoice_lines("SO-FAIL", "SO-OK"), stats, "2025-02-01", recorder
+            )
+
+        self.assertEqual(self.invoiced, ["SO-OK"])
+        self.assertEqual((stats.invoices, stats.failed), (1, 1))
+        frappe.db.rollback.assert_called_once_with(save_point=billing.BILLING_SAVEPOINT)
+        self.assertEqual(frappe.db.savepoint.call_args_list, [call(billing.BILLING_SAVEPOINT)] * 2)
+        failed = recorder.record.call_args_list[0]
+        self.assertEqual(failed.args[:2], ("SO-FAIL", "Failed"))
+        self.assertIn("Invoice failed", failed.kwargs["error"])
+        # the batch is committed by the recorder, not per invoice
+        frappe.db.commit.assert_not_called()
+        recorder.flush.assert_called_once()
+
+    def test_failure_without_a_recorder_is_raised(self):
+        stats = billing.BillingStats("test")
+        with patch("erplex_rental.billing.claim_rental_order", return_value=True):
+            with self.assertRaises(frappe.ValidationError):
+                billing.create_rental_invoices(self.get_invoice_lines("SO-FAIL"), stats, "2025-02-01")
+        frappe.db.rollback.assert_not_called()
@@ -0,0 +1,41 @@
+# Copyright (c) 2025, ERPlexSolutions and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import getdate
+
+from erplex_rental.billing_queue import settle_billing_queue
+
+
+class TestSettleBillingQueue(FrappeTestCase):
+    def settle(self, orders, on_rent, unbilled, failed=()):
+        with (
+            patch("erplex_rental.billing_queue.get_orders_on_rent", return_value=set(on_rent)),
+            patch(
+                "erplex_rental.billing.get_unbilled_completed_orders",
+                return_value=[frappe._dict(sales_order=sales_order) for sales_order in unbilled],
+            ),
+            patch.object(frappe.db, "sql") as sql,
+            patch.object(frappe.db, "delete") as delete,
+        ):
+            settle_billing_queue(orders, "2025-02-01", failed)
+        rolled_over = set(sql.call_args.args[1]["orders"]) if sql.called else set()
+        dropped = set(delete.call_args.args[1]["sales_order"][1]) if delete.called else set()
+        return rolled_over, dropped, sql
+
+    def test_on_rent_orders_roll_over_and_billed_orders_drop_out(self):
+        rolled_over, dropped, sql = self.settle(["SO-1", "SO-2", "SO-3"], on_rent=["SO-1"], unbilled=["SO-3"])
+        self.assertEqual(rolled_over, {"SO-1"})
+        self.assertEqual(sql.call_args.args[1]["due_date"], getdate("2025-03-01"))
+        # SO-3 is completed but its invoice is still missing, so it stays due
+        self.assertEqual(dropped, {"SO-2"})
+
+    def test_failed_orders_stay_due(self):
+        rolled_over, dropped, _ = self.settle(
+            ["SO-1", "SO-2", "SO-3"], on_rent=["SO-1", "SO-2"], unbilled=[], failed={"SO-2"}
+        )
+        self.assertEqual(rolled_over, {"SO-1"})
+        self.assertEqual(dropped, {"SO-3"})
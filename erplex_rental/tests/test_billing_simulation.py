@@ -0,0 +1,88 @@
+# Copyright (c) 2025, ERPlexSolutions and Contributors
+# See license.txt
+
+import frappe
+import numpy as np
+from frappe.tests.utils import FrappeTestCase
+
+from erplex_rental.billing_simulation import get_peak_qty, get_pricing, get_totals, price_lines
+
+
+class TestPriceLines(FrappeTestCase):
+    def price(self, qty_days, peak_qty=(1, 1), rates=(300, 100), **pricing):
+        current, simulated = price_lines(
+            np.array(rates, dtype=np.float64),
+            np.array(qty_days, dtype=np.float64),
+            np.array(peak_qty, dtype=np.float64),
+            get_pricing(**pricing),
+        )
+        return current.tolist(), simulated.tolist()
+
+    def test_current_pricing_is_what_billing_charges(self):
+        # 300 / 30 = 10 a day, 100 / 30 = 3.33 a day
+        self.assertEqual(self.price([31, 10]), ([310, 33.3], [310, 33.3]))
+
+    def test_days_per_month(self):
+        _, simulated = self.price([31, 10], days_per_month=31)
+        # 300 / 31 = 9.68 a day, 100 / 31 = 3.23 a day
+        self.assertEqual(simulated, [300.08, 32.3])
+
+    def test_minimum_days_of_the_peak_qty(self):
+        _, simulated = self.price([31, 10], peak_qty=[1, 2], minimum_days=15)
+        # the second line is charged 15 days of its peak qty of 2
+        self.assertEqual(simulated, [310, 99.9])
+
+    def test_weekly_rate_bills_whole_weeks(self):
+        _, simulated = self.price([14, 15, 0], rates=[300, 300, 300], peak_qty=[1, 1, 0], weekly_rate=0.3)
+        # a week costs 0.3 x 300 = 90; 14 days are exactly 2 weeks and 15 days start a third
+        self.assertEqual(simulated, [180, 270, 0])
+
+
+class TestPeakQty(FrappeTestCase):
+    def test_peak_follows_the_events_in_day_order(self):
+        peak_qty = get_peak_qty(
+            3,
+            np.array([0, 2, 0, 2, 0], dtype=np.int64),
+            np.array([1, 0, 3, 6, 2], dtype=np.int64),
+            np.array([5, 4, 3, -4, -2], dtype=np.float64),
+        )
+        # line 0 goes 5, 3, 6 by day (summed in array order it would peak at 8), line 1 has no events,
+        # line 2 holds an opening qty of 4 until it is returned
+        self.assertEqual(peak_qty.tolist(), [6, 0, 4])
+
+    def test_lines_do_not_carry_each_others_qty(self):
+        peak_qty = get_peak_qty(
+            2,
+            np.array([0, 1, 1], dtype=np.int64),
+            np.array([1, 1, 2], dtype=np.int64),
+            np.array([10, -3, 2], dtype=np.float64),
+        )
+        self.assertEqual(peak_qty.tolist(), [10, 0])
+
+    def test_no_events(self):
+        peak_qty = get_peak_qty(2, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+        self.assertEqual(peak_qty.tolist(), [0, 0])
+
+
+class TestTotals(FrappeTestCase):
+    def test_totals_per_group(self):
+        orders = [
+            frappe._dict(
+                company="B", customer="C-1", currency="USD", qty_days=10, billed_amount=100,
+                current_amount=100, simulated_amount=120, difference=20,
+            ),
+            frappe._dict(
+                company="A", customer="C-2", currency="EUR", qty_days=5, billed_amount=50,
+                current_amount=50, simulated_amount=40, difference=-10,
+            ),
+            frappe._dict(
+                company="B", customer="C-3", currency="USD", qty_days=2.5, billed_amount=0.1,
+                current_amount=0.2, simulated_amount=0.2, difference=0.1,
+            ),
+        ]
+        totals = get_totals(orders, ("company", "currency"))
+        self.assertEqual(
+            [(row.company, row.currency, row.orders, row.qty_days, row.billed_amount, row.difference) for row in totals],
+            [("A", "EUR", 1, 5, 50, -10), ("B", "USD", 2, 12.5, 100.1, 20.1)],
+        )
+        self.assertNotIn("customer", totals[0])
@@ -0,0 +1,152 @@
+# Copyright (c) 2025, ERPlexSolutions and Contributors
+# See license.txt
+
+from unittest.mock import MagicMock, patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import getdate
+
+from erplex_rental import purchase_billing
+
+
+def get_order_items(orders):
+    return [
+        frappe._dict(
+            purchase_order="PO-1",
+            transaction_date=getdate("2024-12-01"),
+            po_detail="POI-1",
+            item_code="ITEM-1",
+            rate=600,
+        ),
+        frappe._dict(
+            purchase_order="PO-1",
+            transaction_date=getdate("2024-12-01"),
+            po_detail="POI-2",
+            item_code="ITEM-2",
+            rate=300,
+        ),
+        frappe._dict(
+            purchase_order="PO-2",
+            transaction_date=getdate("2025-01-05"),
+            po_detail="POI-3",
+            item_code="ITEM-1",
+            rate=300,
+        ),
+    ]
+
+
+def get_hire_events(orders, billing_date):
+    return [
+        # POI-1: 10 on hire since December, 4 returned on Jan 20
+        ("POI-1", getdate("2024-12-10"), 10),
+        ("POI-1", getdate("2025-01-20"), -4),
+        # POI-2 went back before the period
+        ("POI-2", getdate("2024-12-10"), 5),
+        ("POI-2", getdate("2024-12-20"), -5),
+        # POI-3 received on the order's first day and returned on the last day of the period
+        ("POI-3", getdate("2025-01-05"), 2),
+        ("POI-3", getdate("2025-01-31"), -2),
+        # a receipt of another order's item is ignored
+        ("POI-9", getdate("2025-01-10"), 7),
+    ]
+
+
+class TestPurchaseInvoiceLines(FrappeTestCase):
+    def test_lines_bill_qty_days_on_hire_since_the_last_invoice(self):
+        with (
+            patch("erplex_rental.purchase_billing.get_purchase_order_items", side_effect=get_order_items),
+            patch("erplex_rental.purchase_billing.get_hire_events", side_effect=get_hire_events),
+            patch(
+                "erplex_rental.purchase_billing.get_last_purchase_billed_dates",
+                return_value={"PO-1": getdate("2025-01-01")},
+            ),
+        ):
+            invoice_lines = purchase_billing.compute_purchase_invoice_lines(["PO-1", "PO-2"], "2025-02-01")
+
+        lines = {
+            line.po_detail: (line.qty, line.rate, line.start_date)
+            for lines in invoice_lines.values()
+            for line in lines
+        }
+        self.assertEqual(
+            lines,
+            {
+                # 10 x 31 days less 4 x 12 days from Jan 20, at 600 / 30 a day
+                "POI-1": (262, 20, getdate("2025-01-01")),
+                # never billed, so from the order date: 2 x 26 days from Jan 5 to Jan 31
+                "POI-3": (52, 10, getdate("2025-01-05")),
+            },
+        )
+        self.assertEqual(set(invoice_lines), {"PO-1", "PO-2"})
+
+
+class TestClaimRentalPurchaseOrder(FrappeTestCase):
+    def test_claim_refuses_a_billed_period(self):
+        with (
+            patch.object(frappe.db, "get_value") as get_value,
+            patch.object(frappe.db, "sql", return_value=[("PINV-0001",)]),
+        ):
+            self.assertFalse(purchase_billing.claim_rental_purchase_order("PO-1", "2025-02-01"))
+        get_value.assert_called_once_with("Purchase Order", "PO-1", "name", for_update=True)
+
+    def test_claim_an_unbilled_period(self):
+        with patch.object(frappe.db, "get_value"), patch.object(frappe.db, "sql", return_value=()):
+            self.assertTrue(purchase_billing.claim_rental_purchase_order("PO-1", "2025-02-01"))
+
+
+class TestCreateRentalPurchaseInvoices(FrappeTestCase):
+    def setUp(self):
+        self.invoiced = []
+        lines = {
+            purchase_order: [frappe._dict(purchase_order=purchase_order, po_detail=f"{purchase_order}-1")]
+            for purchase_order in ("PO-FAIL", "PO-OK", "PO-BILLED")
+        }
+        lines["PO-EMPTY"] = []
+        patches = [
+            patch("erplex_rental.purchase_billing.compute_purchase_invoice_lines", return_value=lines),
+            patch(
+                "erplex_rental.purchase_billing.claim_rental_purchase_order",
+                side_effect=lambda purchase_order, billing_date: purchase_order != "PO-BILLED",
+            ),
+            patch(
+                "erplex_rental.purchase_billing.make_rental_purchase_invoice",
+                side_effect=self.make_rental_purchase_invoice,
+            ),
+            patch.object(frappe.db, "savepoint"),
+            patch.object(frappe.db, "rollback"),
+            patch.object(frappe.db, "commit"),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make_rental_purchase_invoice(self, purchase_order, lines, billing_date=None):
+        if purchase_order == "PO-FAIL":
+            raise frappe.ValidationError("Invoice failed")
+        self.invoiced.append(purchase_order)
+        return frappe._dict(name=f"PINV-{purchase_order}")
+
+    def test_each_order_is_recorded_and_a_failure_rolled_back(self):
+        recorder = MagicMock()
+        orders = ["PO-FAIL", "PO-OK", "PO-BILLED", "PO-EMPTY"]
+        summary = purchase_billing.create_rental_purchase_invoices(orders, "2025-02-01", recorder)
+
+        self.assertEqual(self.invoiced, ["PO-OK"])
+        frappe.db.rollback.assert_called_once_with(save_point=purchase_billing.PURCHASE_BILLING_SAVEPOINT)
+        self.assertEqual(frappe.db.savepoint.call_count, 4)
+        frappe.db.commit.assert_not_called()
+        statuses = {args.args[0]: args.args[1] for args in recorder.record.call_args_list}
+        self.assertEqual(
+            statuses,
+            {"PO-FAIL": "Failed", "PO-OK": "Invoiced", "PO-BILLED": "Skipped", "PO-EMPTY": "Nothing to Bill"},
+        )
+        self.assertEqual(
+            (summary["invoices"], summary["skipped"], summary["failed"]),
+            (1, 1, 1),
+        )
+
+    def test_failure_without_a_recorder_is_raised(self):
+        with self.assertRaises(frappe.ValidationError):
+            purchase_billing.create_rental_purchase_invoices(["PO-FAIL"], "2025-02-01")
+        frappe.db.rollback.assert_not_called()
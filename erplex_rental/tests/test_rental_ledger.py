@@ -0,0 +1,90 @@
+# Copyright (c) 2025, ERPlexSolutions and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import get_datetime, getdate
+
+from erplex_rental.rental_ledger import (
+    get_on_rent_qty,
+    get_voucher_movements,
+    make_rental_ledger_entries,
+    rebuild_rental_ledger,
+)
+
+SALES_ORDER = "_Test Rental Ledger SO"
+SO_DETAIL = "_Test Rental Ledger SOI"
+
+
+class FakeVoucher:
+    """A submitted Rental Delivery or Rental Return with one row on the test order item"""
+
+    def __init__(self, doctype, name, posting_date, qty):
+        self.doctype = doctype
+        self.name = name
+        self.posting_date = getdate(posting_date)
+        self.posting_time = "10:00:00"
+        self.creation = get_datetime(f"{posting_date} 10:00:00")
+        row = frappe._dict(
+            name=f"{name}-1", sales_order=SALES_ORDER, sales_order_detail=SO_DETAIL, item_code="_Test Item"
+        )
+        if doctype == "Rental Delivery":
+            row.qty = qty
+        else:
+            row.update(return_qty=-qty, maintenance_qty=0, damaged_qty=0)
+        self.items = [row]
+
+    def as_movements(self):
+        """The rows rebuild_rental_ledger reads for this voucher"""
+        return [
+            frappe._dict(
+                row,
+                voucher_type=self.doctype,
+                voucher_no=self.name,
+                posting_date=self.posting_date,
+                posting_time=self.posting_time,
+                creation=self.creation,
+                idx=1,
+            )
+            for row in get_voucher_movements(self)
+        ]
+
+
+def get_balances():
+    return dict(
+        frappe.db.sql(
+            """Select voucher_detail_no, qty_after_transaction from `tabRental Ledger Entry`
+        where sales_order = %s and is_cancelled = 0""",
+            SALES_ORDER,
+        )
+    )
+
+
+class TestRentalLedger(FrappeTestCase):
+    def test_incremental_posting_matches_a_rebuild(self):
+        delivery = FakeVoucher("Rental Delivery", "_Test RD 1", "2025-01-10", 10)
+        rental_return = FakeVoucher("Rental Return", "_Test RR 1", "2025-01-20", -4)
+        backdated = FakeVoucher("Rental Delivery", "_Test RD 2", "2025-01-15", 5)
+
+        make_rental_ledger_entries(delivery)
+        make_rental_ledger_entries(rental_return)
+        self.assertEqual(get_balances(), {"_Test RD 1-1": 10, "_Test RR 1-1": 6})
+
+        # posted after the return but dated before it, so the return's balance moves up
+        make_rental_ledger_entries(backdated)
+        self.assertEqual(get_balances(), {"_Test RD 1-1": 10, "_Test RD 2-1": 15, "_Test RR 1-1": 11})
+
+        make_rental_ledger_entries(delivery, cancel=True)
+        incremental = get_balances()
+        self.assertEqual(incremental, {"_Test RD 2-1": 5, "_Test RR 1-1": 1})
+        self.assertEqual(get_on_rent_qty(SALES_ORDER), 1)
+
+        submitted = sorted(
+            backdated.as_movements() + rental_return.as_movements(), key=lambda row: row.posting_date
+        )
+        with patch("erplex_rental.rental_ledger.get_submitted_movements", return_value=submitted):
+            self.assertEqual(rebuild_rental_ledger(SALES_ORDER), 2)
+        self.assertEqual(get_balances(), incremental)
+        self.assertEqual(get_on_rent_qty(SALES_ORDER), 1)
@@ -1,6 +1,9 @@
 import frappe
 from frappe.utils import today, add_days, getdate, flt, date_diff, add_to_date, cstr, get_first_day
 from erpnext.selling.doctype.sales_order.sales_order import make_sales_invoice
+from erplex_rental import billing, purchase_billing
+from erplex_rental.accrual import get_per_day_rate
+from erplex_rental.rental_ledger import as_of, get_rental_movements
 
 
 @frappe.whitelist()
@@ -95,94 +98,12 @@ def get_last_rental_return(so_name):
     return last_rental_return
 
 
-def create_ongoing_rental_invoices():
-    for so_name in get_ongoing_rental_orders_for_invoicing():
-        so = frappe.get_doc("Sales Order", so_name)
-        si_doc = make_sales_invoice(so_name)
-        si_doc.update_stock = 0
-        si_doc.items = []
-        for soi in so.items:
-            avg_daily_rate = soi.rate / 30
-            days = 0
-            if soi.custom_rental_delivered_qty != soi.custom_rental_returned_qty:
-                days = date_diff(
-                    getdate(), so.custom_last_billed_date or so.transaction_date
-                )
-            elif soi.custom_rental_delivered_qty == soi.custom_rental_returned_qty:
-                return_date = frappe.db.get_value(
-                    "Rental Return", get_last_rental_return(so_name), "return_date"
-                )
-                days = date_diff(
-                    return_date, so.custom_last_billed_date or so.transaction_date
-                )
-            if days > 0:
-                si_doc.append(
-                    "items",
-                    {
-                        "item_code": soi.item_code,
-                        "qty": soi.custom_rental_delivered_qty,
-                        "rate": (avg_daily_rate * days),
-                        "sales_order": soi.parent,
-                        "so_detail": soi.name,
-                    },
-                )
-        if si_doc.items:
-            si_doc.flags.ignore_permissions = True
-            si_doc.run_method("set_missing_values")
-            si_doc.run_method("calculate_taxes_and_totals")
-            si_doc.save()
-        frappe.db.commit()
+def create_ongoing_rental_invoices(orders=None):
+    return billing.create_ongoing_rental_invoices(orders)
 
 
 def create_unbilled_completed_rental_invoices(order=None):
-    for so_name in get_unbilled_completed_rental_orders(order):
-        so = frappe.get_doc("Sales Order", so_name)
-        si_doc = make_sales_invoice(so_name)
-        si_doc.update_stock = 0
-        si_doc.items = []
-        if so.custom_last_billed_date:
-            rr = frappe.get_doc("Rental Return", get_last_rental_return(so_name))
-            for rri in rr.items:
-                soi_rate = frappe.db.get_value(
-                    "Sales Order Item", rri.sales_order_detail, "rate"
-                )
-                avg_daily_rate = soi_rate / 30
-                days = date_diff(
-                    rr.return_date, so.custom_last_billed_date or so.transaction_date
-                )
-                si_doc.append(
-                    "items",
-                    {
-                        "item_code": rri.item_code,
-                        "qty": rri.return_qty + rri.maintenance_qty + rri.damaged_qty,
-                        "rate": avg_daily_rate * days,
-                        "sales_order": rri.sales_order,
-                        "so_detail": rri.sales_order_detail,
-                    },
-                )
-        else:
-            for soi in so.items:
-                avg_daily_rate = soi.rate / 30
-                days = date_diff(
-                    getdate(), so.custom_last_billed_date or so.transaction_date
-                )
-                if days > 0:
-                    si_doc.append(
-                        "items",
-                        {
-                            "item_code": soi.item_code,
-                            "qty": soi.custom_rental_delivered_qty,
-                            "rate": avg_daily_rate * days,
-                            "sales_order": soi.parent,
-                            "so_detail": soi.name,
-                        },
-                    )
-        if si_doc.items:
-            si_doc.flags.ignore_permissions = True
-            si_doc.run_method("set_missing_values")
-            si_doc.run_method("calculate_taxes_and_totals")
-            si_doc.save()
-        frappe.db.commit()
+    return billing.create_unbilled_completed_rental_invoices(order)
 
 
 def create_monthly_rental_invoice():
@@ -190,130 +111,22 @@ def create_monthly_rental_invoice():
     create_unbilled_completed_rental_invoices()
 
 
-def get_ongoing_rental_orders_for_purchase_invoicing():
-    data = (
-        frappe.db.sql(
-            """Select so.name 
-    from `tabPurchase Order` so inner join `tabPurchase Order Item` soi on so.name = soi.parent
-    where so.cutom_order_type = 'Rental' and so.docstatus = 1 and soi.returned_qty < soi.qty
-    and so.per_received > 0 """,
-            as_dict=True,
-        )
-        or []
-    )
-    return list(set([row.name for row in data]))
+def get_ongoing_rental_orders_for_purchase_invoicing(billing_date=None):
+    return purchase_billing.get_purchase_billing_orders(billing_date or today())
 
 
-def get_unbilled_completed_rental_purchase_orders(order=None):
-    conds = ""
-    if order:
-        conds += f" and so.name = '{order}' "
-    data = (
-        frappe.db.sql(
-            f"""Select so.name from `tabPurchase Order` so inner join `tabPurchase Order Item` soi on so.name = soi.parent
-            where so.cutom_order_type = 'Rental' and so.docstatus = 1 and soi.returned_qty = soi.qty {conds}
-            (Select pi.posting_date from `tabPurchase Invoice` pi inner join `tabPurchase Invoice Item` pii on pi.name = pii.parent 
-            where pii.purchase_order = so.name and pi.docstatus = 1 Order by pi.posting_date desc limit 1) as last_billed_date""",
-            as_dict=True,
-        )
-        or []
-    )
-    return list(set([row.name for row in data]))
-
-
-def create_ongoing_rental_purchase_invoices():
-    for so_name in get_ongoing_rental_orders_for_purchase_invoicing():
-        so = frappe.get_doc("Sales Order", so_name)
-        si_doc = make_sales_invoice(so_name)
-        si_doc.update_stock = 0
-        si_doc.items = []
-        for soi in so.items:
-            avg_daily_rate = soi.rate / 30
-            days = 0
-            if soi.custom_rental_delivered_qty != soi.custom_rental_returned_qty:
-                days = date_diff(
-                    getdate(), so.custom_last_billed_date or so.transaction_date
-                )
-            elif soi.custom_rental_delivered_qty == soi.custom_rental_returned_qty:
-                return_date = frappe.db.get_value(
-                    "Rental Return", get_last_rental_return(so_name), "return_date"
-                )
-                days = date_diff(
-                    return_date, so.custom_last_billed_date or so.transaction_date
-                )
-            if days > 0:
-                si_doc.append(
-                    "items",
-                    {
-                        "item_code": soi.item_code,
-                        "qty": soi.custom_rental_delivered_qty,
-                        "rate": (avg_daily_rate * days),
-                        "sales_order": soi.parent,
-                        "so_detail": soi.name,
-                    },
-                )
-        if si_doc.items:
-            si_doc.flags.ignore_permissions = True
-            si_doc.run_method("set_missing_values")
-            si_doc.run_method("calculate_taxes_and_totals")
-            si_doc.save()
-        frappe.db.commit()
+def create_ongoing_rental_purchase_invoices(orders=None):
+    return purchase_billing.create_rental_purchase_invoices(orders, today())
 
 
 def create_unbilled_completed_rental_purchase_invoices(order=None):
-    for so_name in get_unbilled_completed_rental_purchase_orders(order):
-        so = frappe.get_doc("Sales Order", so_name)
-        si_doc = make_sales_invoice(so_name)
-        si_doc.update_stock = 0
-        si_doc.items = []
-        if so.custom_last_billed_date:
-            rr = frappe.get_doc("Rental Return", get_last_rental_return(so_name))
-            for rri in rr.items:
-                soi_rate = frappe.db.get_value(
-                    "Sales Order Item", rri.sales_order_detail, "rate"
-                )
-                avg_daily_rate = soi_rate / 30
-                days = date_diff(
-                    rr.return_date, so.custom_last_billed_date or so.transaction_date
-                )
-                si_doc.append(
-                    "items",
-                    {
-                        "item_code": rri.item_code,
-                        "qty": rri.return_qty + rri.maintenance_qty + rri.damaged_qty,
-                        "rate": avg_daily_rate * days,
-                        "sales_order": rri.sales_order,
-                        "so_detail": rri.sales_order_detail,
-                    },
-                )
-        else:
-            for soi in so.items:
-                avg_daily_rate = soi.rate / 30
-                days = date_diff(
-                    getdate(), so.custom_last_billed_date or so.transaction_date
-                )
-                if days > 0:
-                    si_doc.append(
-                        "items",
-                        {
-                            "item_code": soi.item_code,
-                            "qty": soi.custom_rental_delivered_qty,
-                            "rate": avg_daily_rate * days,
-                            "sales_order": soi.parent,
-                            "so_detail": soi.name,
-                        },
-                    )
-        if si_doc.items:
-            si_doc.flags.ignore_permissions = True
-            si_doc.run_method("set_missing_values")
-            si_doc.run_method("calculate_taxes_and_totals")
-            si_doc.save()
-        frappe.db.commit()
+    return purchase_billing.create_rental_purchase_invoices(
+        purchase_billing.get_purchase_billing_orders(today(), [order] if order else None), today()
+    )
 
 
 def create_monthly_rental_purchase_invoice():
-    create_ongoing_rental_purchase_invoices()
-    create_unbilled_completed_rental_purchase_invoices()
+    return purchase_billing.enqueue_monthly_rental_purchase_billing()
 
 
 def remove_linked_transactions(from_doc, ref_fieldname, ref_value):
@@ -392,55 +205,34 @@ def update_last_billed_date_in_so(so_name):
     frappe.db.set_value(
         "Sales Order", so_name, "custom_last_billed_date", get_last_billed_date(so_name)
     )
-    frappe.db.commit()
+
+
+def update_last_billed_dates_in_so(orders):
+    """Set the last billed date of Sales Orders from their submitted invoices, one statement per chunk"""
+    for names in billing.chunked(set(orders)):
+        frappe.db.sql(
+            """Update `tabSales Order` so left join (
+            Select sii.sales_order, MAX(si.posting_date) as last_billed_date
+            from `tabSales Invoice` si inner join `tabSales Invoice Item` sii on si.name = sii.parent
+            where si.docstatus = 1 and sii.sales_order in %(orders)s group by sii.sales_order
+        ) billed on billed.sales_order = so.name
+        set so.custom_last_billed_date = billed.last_billed_date
+        where so.name in %(orders)s""",
+            {"orders": tuple(names)},
+        )
 
 def get_rental_order_per_day_rate(so, so_detail, item):
     rate = frappe.db.get_value("Sales Order Item", so_detail, "rate") or 0
     if not rate:
         rate = frappe.db.get_value("Sales Order Item", {"parent": so, "item_code": item}, "rate") or 0
-    return flt(rate/30, 2)
+    return get_per_day_rate(rate)
 
 
 def get_rental_opening_qty(so_name, item, date):
-    conds = ""
-    if date:
-        conds += f" and p.posting_date < '{date}' "
-    if item:
-        conds += f" and c.item_code = '{item}' "
-    if so_name:
-        conds += f" and c.sales_order = '{so_name}' "
-    delivered_qty = (
-        frappe.db.sql(f"""Select SUM(c.qty) as total_delivered_qty
-    from `tabRental Delivery` p inner join `tabRental Delivery Item` c on p.name = c.parent  
-    where p.docstatus = 1 {conds} """)[0][0]
-        or 0
-    )
-    returned_qty = (
-        frappe.db.sql(f"""Select (SUM(c.return_qty)+SUM(c.maintenance_qty)+SUM(c.damaged_qty)) as total_returned_qty 
-    from `tabRental Return` p inner join `tabRental Return Item` c on p.name = c.parent  
-    where p.docstatus = 1 {conds} """)[0][0]
-        or 0
-    )
-    return delivered_qty - returned_qty
+    return as_of(so_name, item, date)
 
 def get_deliveries_and_returns(so_name, item, from_date, to_date):
-    conds = ""
-    if from_date:
-        conds += f" and p.posting_date >= '{from_date}' "
-    if to_date:
-        conds += f" and p.posting_date <= '{to_date}' "
-    if item:
-        conds += f" and c.item_code = '{item}' "
-    if so_name:
-        conds += f" and c.sales_order = '{so_name}' "
-    deliveries = frappe.db.sql(f"""Select p.name, p.posting_date, c.qty
-    from `tabRental Delivery` p inner join `tabRental Delivery Item` c on p.name = c.parent  
-    where p.docstatus = 1 {conds} """, as_dict=True) or []
-    returns = frappe.db.sql(f"""Select p.name, p.posting_date, -1*(c.return_qty+c.maintenance_qty+c.damaged_qty) as qty 
-    from `tabRental Return` p inner join `tabRental Return Item` c on p.name = c.parent  
-    where p.docstatus = 1 {conds} """, as_dict=True) or []
-    data = deliveries + returns
-    return sorted(data, key=lambda x: x['posting_date'])
+    return get_rental_movements(so_name, item, from_date, to_date)
 
 def get_rental_inv_opening_date(so_name, date):
     opening_date = date